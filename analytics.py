@@ -0,0 +1,162 @@
+"""Progress trends from the workout log as NumPy column operations.
+
+The Achievements tab only had a max weight per exercise and one volume
+total. ``LogAnalytics`` loads a user's whole log into columnar arrays once
+and derives every per-exercise series in a few vectorized passes:
+
+- estimated one-rep max per set of up to ``MAX_E1RM_REPS`` reps (Epley or
+  Brzycki), best per training day,
+- the running PR of that estimate,
+- weekly volume (sets × reps × weight), overall and per exercise,
+- training frequency: days trained per week, overall and per exercise.
+
+``WorkoutAnalytics`` keeps one ``LogAnalytics`` per user and rebuilds it only
+when the store's revision for that user changes, so charts over tens of
+thousands of sets cost a dictionary lookup and an array slice per rerun.
+"""
+import threading
+
+import numpy as np
+
+from exercise_index import canonical_exercise
+
+FORMULAS = ("epley", "brzycki")
+# Past ~12 reps neither estimate means much (30 reps at 100 lbs "is" a 514 lb Brzycki max),
+# so higher-rep sets are left out of the 1RM series
+MAX_E1RM_REPS = 12
+EPOCH = np.datetime64("1970-01-01", "D")
+# 1970-01-01 was a Thursday; shifting by 3 days makes weeks start on Monday
+WEEK_OFFSET = 3
+
+
+def estimated_1rm(weight, reps, formula="epley"):
+    """Estimated one-rep max for each set; a single rep is its own max, over ``MAX_E1RM_REPS`` reps NaN."""
+    weight = np.asarray(weight, dtype=np.float64)
+    reps = np.asarray(reps, dtype=np.float64)
+    capped = np.minimum(reps, MAX_E1RM_REPS)
+    if formula == "epley":
+        estimate = weight * (1 + capped / 30)
+    elif formula == "brzycki":
+        estimate = weight * 36 / (37 - capped)
+    else:
+        raise ValueError(f"Unknown 1RM formula {formula!r}; expected one of {FORMULAS}")
+    return np.where(reps > MAX_E1RM_REPS, np.nan, np.where(reps <= 1, weight, estimate))
+
+
+def _day_groups(code, day):
+    # Sort order and the start of each (exercise, day) run in it
+    order = np.lexsort((day, code))
+    code_sorted, day_sorted = code[order], day[order]
+    starts = np.flatnonzero(
+        np.r_[True, (code_sorted[1:] != code_sorted[:-1]) | (day_sorted[1:] != day_sorted[:-1])]
+    ) if len(order) else np.zeros(0, np.int64)
+    return order, starts
+
+
+def _segmented_cummax(values, groups):
+    # Running max restarting at every group; groups must be sorted ascending and values >= 0
+    offset = values.max(initial=0.0) + 1.0
+    return np.maximum.accumulate(values + groups * offset) - groups * offset
+
+
+class LogAnalytics:
+    """Every progress series for one user's log, computed once.
+
+    ``names`` maps canonical exercise names to the names to show, as
+    ``WorkoutStore.exercise_names`` returns them; by default the first
+    spelling in alphabetical order is shown.
+    """
+
+    def __init__(self, dates, exercises, sets, reps, weights, formula="epley", names=None):
+        self.formula = formula
+        n = len(dates)
+        day = (np.array(dates, dtype="datetime64[D]") - EPOCH).astype(np.int64) if n else np.zeros(0, np.int64)
+        sets = np.asarray(sets, dtype=np.float64)
+        reps = np.asarray(reps, dtype=np.float64)
+        weights = np.asarray(weights, dtype=np.float64)
+
+        # Exercise codes by canonical name, canonicalizing each distinct spelling once
+        spellings, spelling_code = np.unique(np.array(exercises, dtype=str), return_inverse=True)
+        keys, first, canonical_code = np.unique(
+            np.array([canonical_exercise(e) for e in spellings], dtype=str), return_index=True, return_inverse=True
+        )
+        code = canonical_code[spelling_code].astype(np.int64)
+        names = names or {}
+        self.names = [names.get(str(key), str(spellings[i])) for key, i in zip(keys, first)]
+        self._codes = {name: i for i, name in enumerate(self.names)}
+        self.set_counts = np.bincount(code, minlength=len(self.names))
+
+        # Weeks as a dense range, so quiet weeks show up as zeros
+        week = (day + WEEK_OFFSET) // 7
+        self._first_week = int(week.min()) if n else 0
+        n_weeks = int(week.max()) - self._first_week + 1 if n else 0
+        week -= self._first_week
+        self.weeks = EPOCH + (np.arange(n_weeks) + self._first_week) * 7 - WEEK_OFFSET
+
+        volume = sets * reps * weights
+        self.weekly_volume = np.bincount(week, weights=volume, minlength=n_weeks)
+        self.weekly_volume_by_exercise = np.bincount(
+            code * n_weeks + week, weights=volume, minlength=len(self.names) * n_weeks
+        ).reshape(len(self.names), n_weeks)
+
+        # One entry per (exercise, day) with a set of few enough reps: the best estimate that day
+        e1rm = estimated_1rm(weights, reps, formula)
+        estimated = np.flatnonzero(~np.isnan(e1rm))
+        order, starts = _day_groups(code[estimated], day[estimated])
+        order = estimated[order]
+        self._day_code = code[order][starts]
+        self._day = day[order][starts]
+        self._day_best = np.maximum.reduceat(e1rm[order], starts) if len(order) else np.zeros(0)
+        self._day_pr = _segmented_cummax(self._day_best, self._day_code)
+        # Where each exercise's days start and end in the arrays above
+        self._bounds = np.searchsorted(self._day_code, np.arange(len(self.names) + 1))
+
+        # Frequency counts distinct days, so several sets in one session count once
+        order, starts = _day_groups(code, day)
+        day_week = (day[order][starts] + WEEK_OFFSET) // 7 - self._first_week
+        self.weekly_frequency_by_exercise = np.bincount(
+            code[order][starts] * n_weeks + day_week, minlength=len(self.names) * n_weeks
+        ).reshape(len(self.names), n_weeks)
+        unique_days = np.unique(day)
+        self.weekly_frequency = np.bincount((unique_days + WEEK_OFFSET) // 7 - self._first_week, minlength=n_weeks)
+
+    def exercises(self):
+        """Exercise names, most logged first."""
+        return [self.names[i] for i in np.argsort(-self.set_counts, kind="stable")]
+
+    def e1rm(self, exercise):
+        """``(dates, best estimated 1RM per day, running PR)`` for ``exercise``; days with only high-rep sets are left out."""
+        i = self._codes[exercise]
+        lo, hi = self._bounds[i], self._bounds[i + 1]
+        return EPOCH + self._day[lo:hi], self._day_best[lo:hi], self._day_pr[lo:hi]
+
+    def volume(self, exercise=None):
+        """``(week starts, volume per week)``, for one exercise or all of them."""
+        if exercise is None:
+            return self.weeks, self.weekly_volume
+        return self.weeks, self.weekly_volume_by_exercise[self._codes[exercise]]
+
+    def frequency(self, exercise=None):
+        """``(week starts, days trained per week)``, for one exercise or all of them."""
+        if exercise is None:
+            return self.weeks, self.weekly_frequency
+        return self.weeks, self.weekly_frequency_by_exercise[self._codes[exercise]]
+
+
+class WorkoutAnalytics:
+    def __init__(self, store):
+        self.store = store
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def for_user(self, user_id, formula="epley"):
+        key = (user_id, formula)
+        revision = self.store.revision(user_id)
+        cached = self._cache.get(key)
+        if cached is None or cached[0] != revision:
+            cached = (revision, LogAnalytics(
+                *self.store.columns(user_id), formula=formula, names=self.store.exercise_names(user_id)
+            ))
+            with self._lock:
+                self._cache[key] = cached
+        return cached[1]
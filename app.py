@@ -1,11 +1,26 @@
 import streamlit as st
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline, BitsAndBytesConfig
-import torch
+import logging
+import os
 import re
 import time
+import uuid
+
+from analytics import FORMULAS, MAX_E1RM_REPS, WorkoutAnalytics
+from coach import BUSY_RESPONSE, ERROR_RESPONSE, service_from_env
+from coach_client import CoachClient
+from exercise_index import ExerciseIndex
+from inference import DeadlineExceeded, EngineBusyError
+from intents import IntentRouter
+from metrics import REGISTRY, start_http_server, start_jsonl_writer
+from model_loader import BackgroundLoader, load_engines
+from workout_index import WorkoutIndex
+from workout_io import FORMATS, describe, detect_format, export_file, import_workouts, open_text
+from workout_store import Workout, WorkoutStore
 
 st.set_page_config(page_title="AI Fitness Assistant", layout="centered")
 
+logger = logging.getLogger(__name__)
+
 # ----------------- Dark Mode Colors -----------------
 bg_color = "#0E1117"
 bg_secondary = "#1E1E2E"
@@ -323,34 +338,90 @@ st.markdown(
 )
 
 # ----------------- Load Model -----------------
+# The 7B model loads on a background thread so the Profile, Workout Log and
+# Achievements tabs render immediately; model features wait for readiness.
+# DRAFT_MODEL names an optional small model for speculative decoding;
+# SMALL_MODEL an optional small chat model for the simple turns.
 @st.cache_resource
 def load_model():
-    bnb_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_quant_type="nf4",
-        bnb_4bit_compute_dtype=torch.float16,
-    )
-    model_name = "mistralai/Mistral-7B-Instruct-v0.3"
-    model = AutoModelForCausalLM.from_pretrained(
-        model_name,
-        quantization_config=bnb_config,
-        device_map="auto",
-        trust_remote_code=True
+    return BackgroundLoader(
+        load_engines,
+        draft_model_name=os.environ.get("DRAFT_MODEL") or None,
+        num_draft_tokens=int(os.environ.get("NUM_DRAFT_TOKENS", 4)),
+        small_model_name=os.environ.get("SMALL_MODEL") or None,
     )
-    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
-    tokenizer.pad_token = tokenizer.eos_token
-    pipe = pipeline(
-        "text-generation",
-        model=model,
-        tokenizer=tokenizer,
-        max_new_tokens=250,
-        do_sample=True,
-        temperature=0.7,
-        top_p=0.9,
-    )
-    return pipe
 
-pipe = load_model()
+# Chat and plans share one service: prompt building, the engine and the response cache
+@st.cache_resource
+def load_coach_service(_engines):
+    return service_from_env(*_engines)
+
+# With FITNESS_API_URL set, the model runs in server.py and the app is just a client
+@st.cache_resource
+def load_coach_client(url):
+    return CoachClient(url)
+
+api_url = os.environ.get("FITNESS_API_URL")
+model_loader = load_coach_client(api_url) if api_url else load_model()
+if not model_loader.ready:
+    coach = None
+elif api_url:
+    coach = model_loader
+else:
+    coach = load_coach_service(model_loader.value)
+
+@st.fragment(run_every=2)
+def model_loading_status():
+    if model_loader.ready:
+        st.rerun(scope="app")
+    elif model_loader.failed:
+        st.error(f"❌ Couldn't load the coach model: {model_loader.error}")
+    else:
+        st.info(f"⏳ Loading the coach model… ({model_loader.elapsed:.0f}s)")
+
+# METRICS_PORT serves Prometheus text at /metrics; METRICS_JSONL_PATH appends snapshots
+@st.cache_resource
+def start_metrics_export():
+    if os.environ.get("METRICS_PORT"):
+        start_http_server(int(os.environ["METRICS_PORT"]))
+    if os.environ.get("METRICS_JSONL_PATH"):
+        start_jsonl_writer(os.environ["METRICS_JSONL_PATH"], float(os.environ.get("METRICS_INTERVAL", 60)))
+
+start_metrics_export()
+
+@st.cache_resource
+def load_workout_store():
+    return WorkoutStore()
+
+workout_store = load_workout_store()
+
+# Answers PR, volume and last-session questions straight from the log
+@st.cache_resource
+def load_intent_router(_store):
+    return IntentRouter(_store)
+
+intent_router = load_intent_router(workout_store)
+
+# Picks the workouts relevant to each question from the whole log
+@st.cache_resource
+def load_workout_index(_store):
+    return WorkoutIndex(_store)
+
+workout_index = load_workout_index(workout_store)
+
+# Progress trends for the Achievements tab, rebuilt only when a user's log changes
+@st.cache_resource
+def load_workout_analytics(_store):
+    return WorkoutAnalytics(_store)
+
+workout_analytics = load_workout_analytics(workout_store)
+
+# Prefix and typo-tolerant search over exercise names, updated as new names are logged
+@st.cache_resource
+def load_exercise_index(_store):
+    return ExerciseIndex(_store)
+
+exercise_index = load_exercise_index(workout_store)
 
 # ----------------- Initialize Session State -----------------
 if "messages" not in st.session_state:
@@ -368,12 +439,91 @@ if "profile" not in st.session_state:
         "preferences": ""
     }
 
-if "workouts" not in st.session_state:
-    st.session_state.workouts = []
+# Workouts are stored per user in SQLite; the id lives in the URL so a bookmark keeps the log
+if "user_id" not in st.session_state:
+    if "user" not in st.query_params:
+        st.query_params["user"] = uuid.uuid4().hex
+    st.session_state.user_id = st.query_params["user"]
+user_id = st.session_state.user_id
 
 if "generated_plan" not in st.session_state:
     st.session_state.generated_plan = None
 
+if "last_generation_stats" not in st.session_state:
+    st.session_state.last_generation_stats = None
+
+# "small" or "large": which model wrote the last reply
+if "last_response_tier" not in st.session_state:
+    st.session_state.last_response_tier = None
+
+if "history_page" not in st.session_state:
+    st.session_state.history_page = 0
+
+# Keep today's workouts open in the history by default
+if "open_history_day" not in st.session_state:
+    st.session_state.open_history_day = time.strftime("%Y-%m-%d")
+
+if "skip_response_cache" not in st.session_state:
+    st.session_state.skip_response_cache = False
+
+if "last_response_cached" not in st.session_state:
+    st.session_state.last_response_cached = False
+
+if "last_response_fast_path" not in st.session_state:
+    st.session_state.last_response_fast_path = False
+
+# The reply streamed so far, kept if the user presses Stop
+if "partial_reply" not in st.session_state:
+    st.session_state.partial_reply = ""
+
+# Time from the st.rerun() after a reply to the rerun that shows it
+if st.session_state.get("rerun_requested_at"):
+    REGISTRY.observe_stage("chat", "rerun", time.perf_counter() - st.session_state.rerun_requested_at)
+    st.session_state.rerun_requested_at = None
+
+# ----------------- Chat Helpers -----------------
+def escape_message(message):
+    return (
+        message.replace("&", "&amp;")
+               .replace("<", "&lt;")
+               .replace(">", "&gt;")
+               .replace("\n", "<br>")
+    )
+
+def bot_bubble_html(safe_message):
+    return f"""
+    <div style="display: flex; justify-content: flex-start; align-items: flex-end; gap: 10px; margin-bottom: 16px;">
+        <div class="avatar avatar-bot">🏋️</div>
+        <div style="background: #2C2C2E;
+                    color: #FFFFFF;
+                    padding: 12px 16px;
+                    border-radius: 18px;
+                    border-bottom-left-radius: 4px;
+                    max-width: 70%;
+                    box-shadow: 0 2px 8px rgba(0, 0, 0, 0.3);
+                    border: 1px solid rgba(255, 255, 255, 0.1);
+                    word-wrap: break-word;">
+            {safe_message}
+        </div>
+    </div>
+    """
+
+def stop_generation():
+    # Runs before the rerun the click starts; the interrupted run has cancelled its request
+    if st.session_state.messages and st.session_state.messages[-1][0] == "user":
+        partial = st.session_state.partial_reply.strip()
+        st.session_state.messages.append(("bot", f"{partial} …" if partial else "⏹ Stopped."))
+    st.session_state.partial_reply = ""
+
+# ----------------- Plan Helpers -----------------
+# Seconds between chances for Stop or a rerun to interrupt a plan, even while it's queued
+PLAN_POLL_INTERVAL = 0.5
+
+def plan_markdown(plan):
+    # Plan lines come unnumbered, one per line; markdown would run them into one paragraph
+    lines = [line.strip() for line in plan.splitlines() if line.strip()]
+    return "\n".join(f"{number}. {line}" for number, line in enumerate(lines, 1))
+
 # ----------------- Title & Tabs -----------------
 st.title("💪 AI Fitness Assistant")
 tab1, tab2, tab3, tab4 = st.tabs(["Profile", "Workout Log", "Achievements", "Chat"])
@@ -500,12 +650,7 @@ with tab4:
         ''', unsafe_allow_html=True)
         
         for role, message in st.session_state.messages:
-            safe_message = (
-                message.replace("&", "&amp;")
-                       .replace("<", "&lt;")
-                       .replace(">", "&gt;")
-                       .replace("\n", "<br>")
-            )
+            safe_message = escape_message(message)
             
             if role == "user":
                 avatar_html = f'<div class="avatar avatar-user">{initials if initials else ""}</div>' if initials else '<div class="avatar avatar-user" style="background: #000000;"></div>'
@@ -525,28 +670,17 @@ with tab4:
                 </div>
                 """, unsafe_allow_html=True)
             else:
-                st.markdown(f"""
-                <div style="display: flex; justify-content: flex-start; align-items: flex-end; gap: 10px; margin-bottom: 16px;">
-                    <div class="avatar avatar-bot">🏋️</div>
-                    <div style="background: #2C2C2E;
-                                color: #FFFFFF;
-                                padding: 12px 16px;
-                                border-radius: 18px;
-                                border-bottom-left-radius: 4px;
-                                max-width: 70%;
-                                box-shadow: 0 2px 8px rgba(0, 0, 0, 0.3);
-                                border: 1px solid rgba(255, 255, 255, 0.1);
-                                word-wrap: break-word;">
-                        {safe_message}
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
+                st.markdown(bot_bubble_html(safe_message), unsafe_allow_html=True)
         
         # Check if we need to show typing indicator
         needs_response = st.session_state.messages and st.session_state.messages[-1][0] == "user"
         
-        if needs_response:
-            st.markdown("""
+        if needs_response and coach is None:
+            model_loading_status()
+        elif needs_response:
+            # Placeholder that the streamed reply is written into below
+            response_slot = st.empty()
+            response_slot.markdown("""
             <div style="display: flex; justify-content: flex-start; align-items: flex-end; gap: 10px; margin-bottom: 16px;">
                 <div class="avatar avatar-bot">🏋️</div>
                 <div style="background: #2C2C2E;
@@ -563,8 +697,28 @@ with tab4:
                 </div>
             </div>
             """, unsafe_allow_html=True)
+            st.button("⏹ Stop", key="stop_generation", on_click=stop_generation, help="Stop generating this reply")
         
         st.markdown('</div>', unsafe_allow_html=True)
+
+        stats = st.session_state.last_generation_stats
+        if not needs_response and st.session_state.last_response_fast_path:
+            st.caption("⚡ Answered from your workout log")
+        elif not needs_response and coach is not None:
+            if st.session_state.last_response_cached:
+                st.caption("⚡ Served from the response cache")
+            elif stats:
+                server = coach.status()
+                st.caption(
+                    f"⚡ First token in {stats.time_to_first_token:.2f}s "
+                    f"({stats.cached_prompt_tokens}/{stats.prompt_tokens} prompt tokens cached) • "
+                    f"{stats.new_tokens} tokens at {stats.tokens_per_second:.1f} tokens/s"
+                    + (" from the small model" if st.session_state.last_response_tier == "small" else "")
+                    + (f" (stopped early, {stats.tokens_saved} tokens saved)" if stats.tokens_saved else "")
+                    + (f" • {stats.acceptance_rate:.0%} of draft tokens accepted" if stats.draft_tokens else "")
+                    + " • "
+                    f"Server: {server['tokens_per_second']:.1f} tokens/s across {server['active_requests']} active requests"
+                )
     else:
         # Empty state
         st.markdown("""
@@ -576,146 +730,77 @@ with tab4:
     
     # Input at the bottom
     st.markdown('<div style="height: 20px;"></div>', unsafe_allow_html=True)
+
+    col1, col2 = st.columns([3, 2])
+    with col1:
+        st.toggle(
+            "🎲 Fresh answers",
+            key="skip_response_cache",
+            help="Always generate a new reply instead of reusing a cached answer to the same question",
+        )
+    with col2:
+        if coach is not None:
+            cache_stats = coach.status()["response_cache"]
+            st.caption(f"Response cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
     
+    # Questions asked while the model loads stay pending and are answered once it's ready
     prompt = st.chat_input("Ask me anything about fitness...")
 
     if prompt:
         st.session_state.messages.append(("user", prompt))
+        # Data questions don't need the model, so they're answered even while it loads
+        with REGISTRY.span("chat", "intent_route"):
+            fast_reply = intent_router.answer(user_id, prompt)
+        if fast_reply is not None:
+            st.session_state.messages.append(("bot", fast_reply))
+        st.session_state.last_response_fast_path = fast_reply is not None
         st.rerun()
 
     # Generate Response
     needs_response = st.session_state.messages and st.session_state.messages[-1][0] == "user"
-    if needs_response:
-        time.sleep(1.2)
-        
+    if needs_response and coach is not None:
         last_prompt = st.session_state.messages[-1][1]
 
-        # Build conversation history for context
-        conversation_history = []
-        # Include last 3 exchanges for context (6 messages total)
-        start_index = max(0, len(st.session_state.messages) - 7)
-        for role, msg in st.session_state.messages[start_index:-1]:
-            conversation_history.append(f"{'User' if role == 'user' else 'Assistant'}: {msg}")
-        
-        context_str = "\n".join(conversation_history) if conversation_history else ""
-        
-        # Build profile context
-        profile = st.session_state.profile
-        profile_info = []
-        
-        if profile["name"]:
-            profile_info.append(f"The user's name is {profile['name']}")
-        if profile["age"]:
-            profile_info.append(f"they are {profile['age']} years old")
-        if profile["experience_level"]:
-            profile_info.append(f"experience level is {profile['experience_level'].lower()}")
-        if profile["fitness_goal"]:
-            profile_info.append(f"their goal: {profile['fitness_goal']}")
-        if profile["injuries"]:
-            profile_info.append(f"injury considerations: {profile['injuries']}")
-        if profile["preferences"]:
-            profile_info.append(f"preferences: {profile['preferences']}")
-        
-        profile_context = "; ".join(profile_info) + "." if profile_info else ""
-
-        # Add workout history context
-        recent_workouts = st.session_state.workouts[-5:] if st.session_state.workouts else []
-        workout_context = ""
-        if recent_workouts:
-            workout_summary = [
-                f"{w['exercise']} {w['sets']}x{w['reps']} @ {w['weight']}lbs on {w['date']}"
-                for w in recent_workouts
-            ]
-            workout_context = " Recent workouts: " + "; ".join(workout_summary) + "."
-
-        # Define system prompt for Mistral
-        system_prompt = (
-            f"You are a helpful fitness coach. {profile_context}{workout_context} "
-            "Answer briefly and stop when done. For simple questions, give 1-2 sentences. "
-            "For workout advice, suggest 2-3 exercises with one sentence each explaining how to do it."
-        )
-        
-        # Build full prompt with conversation history
-        if context_str:
-            prompt_wrapped = f"<s>[INST] {system_prompt}\n\nPrevious conversation:\n{context_str}\n\nCurrent question: {last_prompt.strip()} [/INST]"
-        else:
-            prompt_wrapped = f"<s>[INST] {system_prompt}\n\n{last_prompt.strip()} [/INST]"
-
-        # Generate model response - Focus on natural stopping
-        raw_output = pipe(
-            prompt_wrapped,
-            max_new_tokens=180,
-            temperature=0.7,
-            top_p=0.85,
-            top_k=40,
-            do_sample=True,
-            repetition_penalty=1.3,
-            pad_token_id=pipe.tokenizer.eos_token_id,
-            eos_token_id=pipe.tokenizer.eos_token_id,
-        )[0]["generated_text"]
-
-        # Clean the output for Mistral
-        response = raw_output
-        
-        # Remove Mistral special tokens
-        response = re.sub(r"<s>|</s>|\[INST\]|\[/INST\]", "", response)
-        
-        # Remove the ENTIRE input (system + user question) from the start
-        # Find where the actual response begins after [/INST]
-        inst_end = raw_output.find("[/INST]")
-        if inst_end != -1:
-            response = raw_output[inst_end + 7:].strip()
-        
-        # Aggressively remove any echoed question at the start
-        # This handles cases where the question appears with or without punctuation
-        question_clean = last_prompt.strip().rstrip('?!.')
-        response = re.sub(
-            f"^{re.escape(question_clean)}[?!.]*\\s*",
-            "",
-            response,
-            flags=re.IGNORECASE
-        )
-        
-        # Remove system prompt remnants
-        response = re.sub(
-            r"You are a helpful fitness coach\..*?unless asked for detailed plans\.",
-            "",
-            response,
-            flags=re.DOTALL | re.IGNORECASE
-        )
-        
-        # Stop at any meta-text like "Question:", "Answer:", or profile repetition
-        stop_patterns = [
-            "Question:", "Answer:", "\nUser:", "\nQuestion", "Q:", "\nA:", 
-            "User:", "Assistant:", "What is your", "What are your",
-            "Your experience level", "Your goal is", "Given your"
-        ]
-        for stop_word in stop_patterns:
-            if stop_word in response:
-                response = response.split(stop_word)[0]
-        
-        # Check if it's a simple greeting/short question - enforce brevity
-        simple_patterns = ['how are you', 'hello', 'hi', 'hey', 'thanks', 'thank you', 'yes', 'no', 'okay', 'ok', 'doing', 'how old', 'what is my', 'who am i']
-        is_simple = any(pattern in last_prompt.lower() for pattern in simple_patterns)
-        
-        # Always limit to prevent runaway responses
-        sentences = re.split(r'(?<=[.!?])\s+(?=[A-Z])', response.strip())
-        
-        if is_simple and len(sentences) > 2:
-            response = ' '.join(sentences[:2])
-        elif len(sentences) > 5:
-            # Cap at 5 sentences max for any response
-            response = ' '.join(sentences[:5])
-        
-        # Clean up whitespace
-        response = response.strip()
-        response = re.sub(r'\n{3,}', '\n\n', response)
-        response = re.sub(r' {2,}', ' ', response)
-
-        if not response:
-            response = "Let's try that again — could you rephrase your question?"
+        try:
+            turn = coach.chat(
+                st.session_state.profile,
+                workout_index.relevant(user_id, last_prompt),
+                st.session_state.messages[:-1],
+                last_prompt,
+                use_cache=not st.session_state.skip_response_cache,
+            )
+            # Stream tokens into the bot bubble as they arrive
+            raw_output = ""
+            render_time = 0.0
+            try:
+                for text in turn:
+                    raw_output += text
+                    st.session_state.partial_reply = raw_output
+                    render_start = time.perf_counter()
+                    response_slot.markdown(bot_bubble_html(escape_message(raw_output.strip())), unsafe_allow_html=True)
+                    render_time += time.perf_counter() - render_start
+            except BaseException:
+                # Stop, a new message or a closed tab interrupts this run mid-stream
+                turn.cancel()
+                raise
+        except (EngineBusyError, DeadlineExceeded):
+            st.session_state.messages.append(("bot", BUSY_RESPONSE))
+            st.rerun()
+        except RuntimeError:
+            # E.g. a Coach API error or a failed generation
+            logger.exception("Chat reply failed")
+            st.session_state.partial_reply = ""
+            st.session_state.messages.append(("bot", ERROR_RESPONSE))
+            st.rerun()
+        st.session_state.partial_reply = ""
+        if not turn.cached:
+            st.session_state.last_generation_stats = turn.stats
+            st.session_state.last_response_tier = turn.tier
+            REGISTRY.observe_stage("chat", "stream_render", render_time)
+        st.session_state.last_response_cached = turn.cached
 
-        st.session_state.messages.append(("bot", response))
+        st.session_state.messages.append(("bot", turn.response))
+        st.session_state.rerun_requested_at = time.perf_counter()
         st.rerun()
 
 # ----------------- WORKOUT LOG TAB -----------------
@@ -724,9 +809,9 @@ with tab2:
     with col_header:
         st.header("📋 Workout Log")
     with col_clear:
-        if st.session_state.workouts:
+        if workout_store.has_workouts(user_id):
             if st.button("🗑️ Clear Log", key="clear_workouts"):
-                st.session_state.workouts = []
+                workout_store.clear(user_id)
                 st.session_state.generated_plan = None
                 st.rerun()
     
@@ -744,87 +829,51 @@ with tab2:
     with col2:
         st.write("")
         st.write("")
-        generate_btn = st.button("Generate Plan", type="primary")
+        generate_btn = st.button("Generate Plan", type="primary", disabled=coach is None)
+    fresh_plan = st.checkbox("🎲 Fresh plan", help="Always generate a new plan instead of reusing a cached one for the same request")
+    if coach is None:
+        model_loading_status()
     
     if generate_btn and plan_prompt:
-        with st.spinner("🏋️ Creating your workout plan..."):
-            # Build context for workout generation
-            profile = st.session_state.profile
-            profile_info = []
-            
-            if profile["name"]:
-                profile_info.append(f"Name: {profile['name']}")
-            if profile["age"]:
-                profile_info.append(f"Age: {profile['age']}")
-            if profile["experience_level"]:
-                profile_info.append(f"Experience: {profile['experience_level']}")
-            if profile["fitness_goal"]:
-                profile_info.append(f"Goal: {profile['fitness_goal']}")
-            if profile["injuries"]:
-                profile_info.append(f"Injuries: {profile['injuries']}")
-            
-            profile_context = "; ".join(profile_info) if profile_info else ""
-            
-            # Get recent workout history
-            recent_workouts = st.session_state.workouts[-5:] if st.session_state.workouts else []
-            workout_context = ""
-            if recent_workouts:
-                workout_context = "Recent workouts: " + "; ".join([
-                    f"{w['exercise']} {w['weight']}lbs {w['sets']}x{w['reps']}"
-                    for w in recent_workouts
-                ])
-            
-            system_prompt = (
-                f"You are a fitness coach creating a workout plan. {profile_context}. {workout_context}. "
-                "Create 3-4 exercises. Format each as: Exercise Name | X sets | Y reps | Z lbs | Brief tip\n"
-                "Be specific with weights. Keep tips short (5-8 words). Complete all exercises."
-            )
-            
-            prompt_wrapped = f"<s>[INST] {system_prompt}\n\n{plan_prompt.strip()} [/INST]"
-            
-            # Workout plan generation - Balanced token limit
-            raw_output = pipe(
-                prompt_wrapped,
-                max_new_tokens=280,
-                temperature=0.7,
-                top_p=0.9,
-                do_sample=True,
-                repetition_penalty=1.2,
-                eos_token_id=pipe.tokenizer.eos_token_id
-            )[0]["generated_text"]
-            
-            # Clean output
-            response = raw_output
-            inst_end = raw_output.find("[/INST]")
-            if inst_end != -1:
-                response = raw_output[inst_end + 7:].strip()
-            
-            response = re.sub(r"<s>|</s>|\[INST\]|\[/INST\]", "", response)
-            
-            # Remove any system prompt echoes
-            response = re.sub(
-                r"You are a fitness coach.*?Be specific with weights\.",
-                "",
-                response,
-                flags=re.DOTALL | re.IGNORECASE
-            )
-            
-            response = response.strip()
-            
-            st.session_state.generated_plan = response
+        plan_slot = st.empty()
+        st.button("⏹ Stop", key="stop_plan", help="Stop generating this plan")
+        try:
+            with st.spinner("🏋️ Creating your workout plan..."):
+                turn = coach.plan(
+                    st.session_state.profile,
+                    workout_index.relevant(user_id, plan_prompt),
+                    plan_prompt,
+                    use_cache=not fresh_plan,
+                )
+                # Show lines as they arrive; each poll lets Stop or a rerun interrupt the run
+                plan_text = ""
+                try:
+                    for text in turn.stream(PLAN_POLL_INTERVAL):
+                        plan_text += text
+                        plan_slot.markdown(plan_markdown(plan_text))
+                except BaseException:
+                    turn.cancel()
+                    raise
+            st.session_state.generated_plan = turn.response
+        except (EngineBusyError, DeadlineExceeded):
+            st.warning(BUSY_RESPONSE)
+        except RuntimeError:
+            logger.exception("Plan generation failed")
+            st.error(f"❌ {ERROR_RESPONSE}")
+        plan_slot.empty()
     
     # Display generated plan
     if st.session_state.generated_plan:
         st.success("✅ Workout Plan Generated!")
         st.markdown("---")
-        st.markdown(st.session_state.generated_plan)
+        st.markdown(plan_markdown(st.session_state.generated_plan))
         st.markdown("---")
         
         # Parse and add to log button
         if st.button("➕ Add This Plan to Workout Log", key="add_plan"):
             # Parse the generated plan
             lines = st.session_state.generated_plan.strip().split('\n')
-            added_count = 0
+            parsed_workouts = []
             
             for line in lines:
                 # Skip empty lines
@@ -861,21 +910,21 @@ with tab2:
                             
                             # Only add if we have a valid exercise name
                             if exercise_name:
-                                st.session_state.workouts.append({
-                                    "date": time.strftime("%Y-%m-%d"),
-                                    "exercise": exercise_name,
-                                    "sets": sets,
-                                    "reps": reps,
-                                    "weight": weight,
-                                    "notes": notes,
-                                    "completed": False
-                                })
-                                added_count += 1
+                                parsed_workouts.append(Workout(
+                                    date=time.strftime("%Y-%m-%d"),
+                                    exercise=exercise_name,
+                                    sets=sets,
+                                    reps=reps,
+                                    weight=weight,
+                                    notes=notes,
+                                    completed=False
+                                ))
                         except Exception as e:
                             # Skip exercises that fail to parse
                             st.warning(f"Couldn't parse: {line}")
                             continue
             
+            added_count = len(workout_store.add_many(user_id, parsed_workouts))
             if added_count > 0:
                 st.success(f"✅ Added {added_count} exercises to your workout log!")
                 st.session_state.generated_plan = None
@@ -905,27 +954,56 @@ with tab2:
         submitted = st.form_submit_button("Log Workout")
         
         if submitted and exercise:
-            st.session_state.workouts.append({
-                "date": str(workout_date),
-                "exercise": exercise,
-                "sets": sets,
-                "reps": reps,
-                "weight": weight,
-                "notes": notes,
-                "completed": True
-            })
+            workout_store.add(user_id, Workout(
+                date=str(workout_date),
+                exercise=exercise,
+                sets=sets,
+                reps=reps,
+                weight=weight,
+                notes=notes,
+                completed=True
+            ))
             st.success(f"✅ Logged: {exercise} - {sets}x{reps} @ {weight}lbs")
             st.rerun()
     
+    # Files are read and written a batch at a time, so years of history fit
+    with st.expander("📦 Import / Export"):
+        st.caption("CSV or JSONL, one set per row: date, exercise, sets, reps, weight, notes, completed. "
+                   "Sets already in your log are skipped.")
+        uploaded = st.file_uploader("Import from a file", type=["csv", "jsonl", "ndjson"], key="import_file")
+        if uploaded is not None and st.button("Import", key="import_log"):
+            with st.spinner("Importing..."):
+                stats = import_workouts(workout_store, user_id, open_text(uploaded), detect_format(uploaded.name))
+            if stats.stopped:
+                st.warning(f"⚠️ {describe(stats, 'import')}")
+            else:
+                st.success(f"✅ {describe(stats, 'import')}")
+            if stats.errors:
+                more = stats.invalid - len(stats.errors)
+                lines = [f"- {error}" for error in stats.errors] + ([f"- ... and {more:,} more"] if more else [])
+                st.warning("Skipped invalid rows:\n\n" + "\n".join(lines))
+        
+        export_format = st.radio("Export format", FORMATS, horizontal=True, key="export_format")
+        st.download_button(
+            "⬇️ Export Log",
+            data=lambda: export_file(workout_store, user_id, export_format),
+            file_name=f"workouts.{export_format}",
+            mime="text/csv" if export_format == "csv" else "application/jsonl",
+            on_click="ignore",
+            disabled=not workout_store.has_workouts(user_id),
+            key="export_log",
+        )
+    
     st.markdown("---")
     
     # Display workout history
     st.subheader("📊 Workout History")
     
-    if st.session_state.workouts:
+    summary = workout_store.summary(user_id)
+    if summary["total_workouts"]:
         # Show some stats
-        total_workouts = len(st.session_state.workouts)
-        completed_workouts = sum(1 for w in st.session_state.workouts if w.get("completed", False))
+        total_workouts = summary["total_workouts"]
+        completed_workouts = summary["completed_workouts"]
         
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -938,56 +1016,77 @@ with tab2:
         
         st.markdown("---")
         
-        # Group by date
-        from collections import defaultdict
-        workouts_by_date = defaultdict(list)
-        for workout in st.session_state.workouts:
-            workouts_by_date[workout["date"]].append(workout)
+        # Only one page of days is queried and only the open day builds its
+        # widgets, so rerun cost stays flat however long the history gets
+        days_per_page = 7
+        total_pages = max(1, -(-summary["days_worked_out"] // days_per_page))
+        page = min(st.session_state.history_page, total_pages - 1)
         
         # Display in reverse chronological order
-        for date_idx, date in enumerate(sorted(workouts_by_date.keys(), reverse=True)):
-            completed_count = sum(1 for w in workouts_by_date[date] if w.get("completed", False))
-            total_count = len(workouts_by_date[date])
+        today = time.strftime("%Y-%m-%d")
+        for date, total_count, completed_count in workout_store.day_page(user_id, days_per_page, page * days_per_page):
+            is_open = date == st.session_state.open_history_day
+            
+            if st.button(
+                f"{'▾' if is_open else '▸'} 📅 {'Today' if date == today else date} • {completed_count}/{total_count} completed",
+                key=f"day_{date}",
+                width="stretch",
+            ):
+                st.session_state.open_history_day = None if is_open else date
+                st.rerun()
             
-            # Keep today's workout expanded by default
-            is_today = date == time.strftime("%Y-%m-%d")
+            if not is_open:
+                continue
             
-            with st.expander(f"📅 {date} • {completed_count}/{total_count} completed", expanded=is_today):
-                for i, workout in enumerate(workouts_by_date[date]):
-                    status = "✅" if workout.get("completed", False) else "⏳"
+            with st.container():
+                for workout in workout_store.workouts_on(user_id, date):
+                    status = "✅" if workout.completed else "⏳"
                     
                     # Exercise card
                     st.markdown(f"""
-                    <div style="background: rgba(0, 122, 255, 0.05); padding: 1rem; border-radius: 12px; margin-bottom: 1rem; border-left: 3px solid {'#34C759' if workout.get('completed') else '#FF9500'};">
-                        <h4 style="margin: 0; color: #FFFFFF;">{status} {workout['exercise']}</h4>
+                    <div style="background: rgba(0, 122, 255, 0.05); padding: 1rem; border-radius: 12px; margin-bottom: 1rem; border-left: 3px solid {'#34C759' if workout.completed else '#FF9500'};">
+                        <h4 style="margin: 0; color: #FFFFFF;">{status} {workout.exercise}</h4>
                         <p style="color: #A0A0A0; margin: 0.5rem 0;">
-                            <strong>{workout['sets']}</strong> sets × <strong>{workout['reps']}</strong> reps @ <strong>{workout['weight']}</strong> lbs
+                            <strong>{workout.sets}</strong> sets × <strong>{workout.reps}</strong> reps @ <strong>{workout.weight}</strong> lbs
                         </p>
-                        {f"<p style='color: #A0A0A0; font-style: italic; margin: 0;'>{workout['notes']}</p>" if workout['notes'] else ""}
+                        {f"<p style='color: #A0A0A0; font-style: italic; margin: 0;'>{workout.notes}</p>" if workout.notes else ""}
                     </div>
                     """, unsafe_allow_html=True)
                     
-                    # Action buttons
+                    # Action buttons, keyed by the workout's id so they follow it across edits
                     col1, col2, col3 = st.columns([2, 2, 1])
                     with col1:
-                        if not workout.get("completed", False):
-                            if st.button(f"✓ Mark Complete", key=f"complete_{date}_{i}"):
-                                workout["completed"] = True
+                        if not workout.completed:
+                            if st.button(f"✓ Mark Complete", key=f"complete_{workout.id}"):
+                                workout_store.mark_complete(user_id, workout.id)
                                 # Don't rerun - just update the state
                     with col2:
                         new_weight = st.number_input(
-                            f"Update weight for {workout['exercise']}",
-                            value=workout["weight"],
-                            key=f"weight_{date}_{i}",
+                            f"Update weight for {workout.exercise}",
+                            value=workout.weight,
+                            key=f"weight_{workout.id}",
                             label_visibility="collapsed"
                         )
-                        if new_weight != workout["weight"]:
-                            if st.button("💾 Save", key=f"update_{date}_{i}"):
-                                workout["weight"] = new_weight
+                        if new_weight != workout.weight:
+                            if st.button("💾 Save", key=f"update_{workout.id}"):
+                                workout_store.update_weight(user_id, workout.id, new_weight)
                     with col3:
-                        if st.button("🗑️", key=f"delete_{date}_{i}", help="Delete exercise"):
-                            st.session_state.workouts.remove(workout)
+                        if st.button("🗑️", key=f"delete_{workout.id}", help="Delete exercise"):
+                            workout_store.delete(user_id, workout.id)
                             st.rerun()
+        
+        if total_pages > 1:
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col1:
+                if st.button("⬅️ Newer", key="history_newer", disabled=page == 0):
+                    st.session_state.history_page = page - 1
+                    st.rerun()
+            with col2:
+                st.caption(f"Page {page + 1} of {total_pages}")
+            with col3:
+                if st.button("Older ➡️", key="history_older", disabled=page >= total_pages - 1):
+                    st.session_state.history_page = page + 1
+                    st.rerun()
     else:
         st.info("💡 No workouts logged yet. Generate a plan or log a workout manually to get started!")
 
@@ -995,36 +1094,18 @@ with tab2:
 with tab3:
     st.header("🏆 Achievements")
     
-    if st.session_state.workouts:
-        # Calculate stats
-        from collections import defaultdict
-        from datetime import datetime
-        
+    summary = workout_store.summary(user_id)
+    if summary["total_workouts"]:
         # Get personal records (max weight per exercise)
-        pr_dict = defaultdict(lambda: {"weight": 0, "date": "", "sets": 0, "reps": 0})
-        
-        for workout in st.session_state.workouts:
-            exercise = workout["exercise"]
-            weight = workout["weight"]
-            if weight > pr_dict[exercise]["weight"]:
-                pr_dict[exercise] = {
-                    "weight": weight,
-                    "date": workout["date"],
-                    "sets": workout["sets"],
-                    "reps": workout["reps"]
-                }
+        pr_dict = workout_store.personal_records(user_id)
         
         # Calculate other stats
-        total_workouts = len(st.session_state.workouts)
-        completed_workouts = sum(1 for w in st.session_state.workouts if w.get("completed", False))
-        unique_exercises = len(set(w["exercise"] for w in st.session_state.workouts))
-        
-        # Get unique workout dates
-        workout_dates = set(w["date"] for w in st.session_state.workouts)
-        days_worked_out = len(workout_dates)
+        completed_workouts = summary["completed_workouts"]
+        unique_exercises = summary["unique_exercises"]
+        days_worked_out = summary["days_worked_out"]
         
         # Calculate total volume (sets × reps × weight)
-        total_volume = sum(w["sets"] * w["reps"] * w["weight"] for w in st.session_state.workouts)
+        total_volume = summary["total_volume"]
         
         # Top stats cards
         st.subheader("📊 Your Stats")
@@ -1066,6 +1147,25 @@ with tab3:
             </div>
             """, unsafe_allow_html=True)
         
+        # Streaks and recent consistency come from the per-day index, not the full log
+        today = time.strftime("%Y-%m-%d")
+        streaks = workout_store.streaks(user_id, today)
+        monday = time.strftime("%Y-%m-%d", time.localtime(time.time() - time.localtime().tm_wday * 86400))
+        this_week = workout_store.rollup(user_id, "week", start=monday, end=today)
+        month_ago = time.strftime("%Y-%m-%d", time.localtime(time.time() - 29 * 86400))
+        recent_days = workout_store.days(user_id, month_ago, today)
+        
+        st.markdown("")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("🔥 Current Streak", f"{streaks['current']} days")
+        with col2:
+            st.metric("Longest Streak", f"{streaks['longest']} days")
+        with col3:
+            st.metric("Days This Week", this_week[0][1] if this_week else 0)
+        with col4:
+            st.metric("Days in Last 30", len(recent_days))
+        
         st.markdown("---")
         
         # Personal Records section
@@ -1074,16 +1174,18 @@ with tab3:
         # Search bar
         search_query = st.text_input("🔍 Search exercises", placeholder="e.g., Squat, Bench Press, Deadlift...")
         
-        # Filter PRs based on search
-        filtered_prs = {
-            exercise: data 
-            for exercise, data in pr_dict.items() 
-            if search_query.lower() in exercise.lower()
-        } if search_query else pr_dict
+        # Best matches first while searching, heaviest first otherwise
+        if search_query:
+            # A set logged since pr_dict was read can rename an exercise; skip names it doesn't have
+            sorted_prs = [
+                (exercise, pr_dict[exercise])
+                for exercise in exercise_index.search(user_id, search_query)
+                if exercise in pr_dict
+            ]
+        else:
+            sorted_prs = sorted(pr_dict.items(), key=lambda x: x[1]["weight"], reverse=True)
         
-        if filtered_prs:
-            # Sort by weight descending
-            sorted_prs = sorted(filtered_prs.items(), key=lambda x: x[1]["weight"], reverse=True)
+        if sorted_prs:
             
             # Display as cards
             for i in range(0, len(sorted_prs), 2):
@@ -1148,7 +1250,7 @@ with tab3:
             
             # Show search results count
             if search_query:
-                st.info(f"Found {len(filtered_prs)} exercise(s) matching '{search_query}'")
+                st.info(f"Found {len(sorted_prs)} exercise(s) matching '{search_query}'")
         else:
             if search_query:
                 st.warning(f"No exercises found matching '{search_query}'")
@@ -1157,20 +1259,45 @@ with tab3:
         
         st.markdown("---")
         
+        # Progress charts, computed once per log change
+        st.subheader("📈 Progress")
+        col1, col2 = st.columns([3, 1])
+        with col2:
+            formula = st.selectbox("1RM formula", FORMULAS, format_func=str.capitalize, key="e1rm_formula")
+        analytics = workout_analytics.for_user(user_id, formula)
+        with col1:
+            chart_exercise = st.selectbox("Exercise", analytics.exercises(), key="progress_exercise")
+        
+        dates, best_e1rm, pr_e1rm = analytics.e1rm(chart_exercise)
+        st.caption(f"Estimated 1RM per training day, from sets of up to {MAX_E1RM_REPS} reps, and its running PR (lbs)")
+        st.line_chart({"Date": dates, "Estimated 1RM": best_e1rm, "PR": pr_e1rm}, x="Date")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            weeks, volume = analytics.volume(chart_exercise)
+            st.caption(f"Weekly {chart_exercise} volume (lbs)")
+            st.bar_chart({"Week": weeks, "Volume": volume}, x="Week")
+        with col2:
+            weeks, frequency = analytics.frequency()
+            st.caption("Days trained per week")
+            st.bar_chart({"Week": weeks, "Days": frequency}, x="Week")
+        
+        st.markdown("---")
+        
         # Recent milestones
         st.subheader("🎯 Recent Activity")
-        recent_workouts = sorted(st.session_state.workouts, key=lambda x: x["date"], reverse=True)[:5]
+        recent_workouts = workout_store.recent(user_id, 5)[::-1]
         
         for workout in recent_workouts:
-            status = "✅" if workout.get("completed", False) else "⏳"
+            status = "✅" if workout.completed else "⏳"
             st.markdown(f"""
             <div style="background: rgba(0, 122, 255, 0.05); 
                         padding: 1rem; 
                         border-radius: 12px; 
                         margin-bottom: 0.5rem;
-                        border-left: 3px solid {'#34C759' if workout.get('completed') else '#FF9500'};">
-                <strong>{status} {workout['exercise']}</strong> - {workout['weight']} lbs × {workout['sets']}x{workout['reps']}
-                <span style="color: #A0A0A0; float: right;">📅 {workout['date']}</span>
+                        border-left: 3px solid {'#34C759' if workout.completed else '#FF9500'};">
+                <strong>{status} {workout.exercise}</strong> - {workout.weight} lbs × {workout.sets}x{workout.reps}
+                <span style="color: #A0A0A0; float: right;">📅 {workout.date}</span>
             </div>
             """, unsafe_allow_html=True)
     else:
@@ -0,0 +1,331 @@
+"""Latency benchmark for the chat and plan generation paths.
+
+Replays a fixed corpus of profiles, workout logs and questions through the
+same prompt building, generation and cleanup code the app uses (``coach.py``)
+and reports time to first token, latency percentiles, tokens/s, prompt
+tokens and post-processing time per path. By default it runs on CPU against
+a tiny randomly initialized Mistral-architecture model with a byte-level
+tokenizer, so it needs no downloads or GPU; the replies are gibberish but
+the work done per token is the real pipeline's::
+
+    python benchmark.py
+    python benchmark.py --concurrency 4 --repeats 3 --json results.json
+    python benchmark.py --model mistralai/Mistral-7B-Instruct-v0.3
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from coach import (
+    build_plan_prompt,
+    chat_system_prompt,
+    clean_chat_response,
+    clean_plan_response,
+    fit_workouts,
+    plan_system_prompt,
+    submit_chat,
+    submit_plan,
+)
+from inference import InferenceEngine
+from plan_grammar import PlanGrammar
+from prefix_cache import PrefixCache
+from prompt_builder import PromptBuilder
+from workout_index import WorkoutIndex
+from workout_store import Workout, WorkoutStore
+
+EMPTY_PROFILE = {
+    "name": "", "age": "", "weight": "", "height": "", "fitness_goal": "",
+    "experience_level": "", "injuries": "", "preferences": "",
+}
+
+CORPUS = [
+    {
+        "profile": {**EMPTY_PROFILE},
+        "workouts": [],
+        "history": [],
+        "questions": ["hello", "How many rest days do I need per week?"],
+        "plans": ["Give me a full body workout"],
+    },
+    {
+        "profile": {
+            **EMPTY_PROFILE, "name": "Sam Lee", "age": "29", "weight": "175", "height": "5'10",
+            "fitness_goal": "build muscle", "experience_level": "Intermediate",
+            "preferences": "gym, 1 hour sessions",
+        },
+        "workouts": [
+            ("2024-05-01", "Bench Press", 4, 8, 155),
+            ("2024-05-01", "Incline Dumbbell Press", 3, 10, 50),
+            ("2024-05-03", "Barbell Squat", 5, 5, 225),
+            ("2024-05-03", "Romanian Deadlift", 3, 8, 185),
+            ("2024-05-05", "Pull Up", 4, 8, 0),
+            ("2024-05-05", "Barbell Row", 4, 8, 135),
+        ],
+        "history": [
+            ("user", "How should I split my week?"),
+            ("bot", "Try an upper/lower split four days a week. Keep one rest day between lower body sessions."),
+        ],
+        "questions": [
+            "How do I break through my bench press plateau?",
+            "thanks",
+            "Should I deload this week?",
+        ],
+        "plans": ["Create a push day workout", "Give me a leg day workout"],
+    },
+    {
+        "profile": {
+            **EMPTY_PROFILE, "name": "Ana", "age": "52", "fitness_goal": "lose weight and stay mobile",
+            "experience_level": "Beginner", "injuries": "left knee pain when kneeling",
+            "preferences": "home workouts, resistance bands only",
+        },
+        "workouts": [
+            ("2024-05-02", "Band Row", 3, 15, 0),
+            ("2024-05-02", "Glute Bridge", 3, 12, 0),
+            ("2024-05-04", "Wall Push Up", 3, 10, 0),
+        ],
+        "history": [],
+        "questions": [
+            "What cardio is safe for my knee?",
+            "How long until I see results?",
+        ],
+        "plans": ["Create a 30 minute home workout"],
+    },
+    {
+        "profile": {
+            **EMPTY_PROFILE, "name": "Jordan", "age": "35", "fitness_goal": "run a half marathon",
+            "experience_level": "Advanced", "preferences": "3 runs and 2 lifts per week",
+        },
+        "workouts": [
+            ("2024-04-28", "Deadlift", 3, 3, 365),
+            ("2024-04-30", "Front Squat", 4, 5, 205),
+            ("2024-05-02", "Bulgarian Split Squat", 3, 8, 60),
+            ("2024-05-04", "Overhead Press", 4, 6, 115),
+            ("2024-05-06", "Hip Thrust", 3, 10, 275),
+        ],
+        "history": [
+            ("user", "Can I lift heavy during marathon training?"),
+            ("bot", "Yes, keep two short strength sessions a week. Put them on easy run days."),
+            ("user", "Which lifts matter most for running?"),
+            ("bot", "Single leg work and hinges carry over best. Split squats and Romanian deadlifts are good picks."),
+        ],
+        "questions": [
+            "How should I taper my lifting before race day?",
+            "what is my deadlift PR?",
+        ],
+        "plans": ["Give me a strength session for runners"],
+    },
+]
+
+
+# ----------------- Model -----------------
+def tiny_tokenizer():
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    # One token per byte, plus the special tokens of Mistral's chat template
+    vocab = {"<unk>": 0, "<s>": 1, "</s>": 2}
+    for ch in sorted(pre_tokenizers.ByteLevel.alphabet()):
+        vocab[ch] = len(vocab)
+    backend = Tokenizer(models.BPE(vocab=vocab, merges=[], unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    backend.decoder = decoders.ByteLevel()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+    )
+    tokenizer.add_special_tokens({"additional_special_tokens": ["[INST]", "[/INST]"]})
+    tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+
+def tiny_model(tokenizer, hidden_size=64, num_layers=2, seed=0):
+    from transformers import MistralConfig, MistralForCausalLM
+
+    torch.manual_seed(seed)
+    config = MistralConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=4096,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    return MistralForCausalLM(config).eval()
+
+
+def build_engine(model_name, draft_model_name=None, num_draft_tokens=4, max_batch_size=8):
+    if model_name != "tiny":
+        from model_loader import load_engine
+        return load_engine(model_name, draft_model_name=draft_model_name, num_draft_tokens=num_draft_tokens)
+    tokenizer = tiny_tokenizer()
+    draft_model = None
+    if draft_model_name == "tiny":
+        draft_model = tiny_model(tokenizer, hidden_size=32, num_layers=1, seed=1)
+    elif draft_model_name:
+        raise ValueError("The tiny model can only be paired with --draft-model tiny")
+    return InferenceEngine(
+        tiny_model(tokenizer),
+        tokenizer,
+        max_batch_size=max_batch_size,
+        prefix_cache=PrefixCache(max_bytes=1 << 30),
+        draft_model=draft_model,
+        num_draft_tokens=num_draft_tokens,
+    )
+
+
+# ----------------- Replay -----------------
+def load_corpus_store(corpus):
+    # The app's own store, so context comes from the same queries
+    store = WorkoutStore(":memory:")
+    for i, case in enumerate(corpus):
+        store.add_many(f"bench-{i}", [
+            Workout(date, exercise, sets, reps, weight, completed=True)
+            for date, exercise, sets, reps, weight in case["workouts"]
+        ])
+    return store
+
+
+def run_chat(engine, prompt_builder, index, user_id, case, question):
+    start = time.perf_counter()
+    workouts = fit_workouts(prompt_builder, index.relevant(user_id, question))
+    system_prompt = chat_system_prompt(case["profile"], workouts)
+    built_prompt = prompt_builder.build_chat_prompt(system_prompt, case["history"], question)
+    prompt_time = time.perf_counter() - start
+
+    request = submit_chat(engine, built_prompt, question)
+    raw_output = "".join(request.stream())
+
+    post_start = time.perf_counter()
+    clean_chat_response(raw_output, question)
+    return request, prompt_time, time.perf_counter() - post_start
+
+
+def run_plan(engine, prompt_builder, grammar, index, user_id, case, plan_request):
+    start = time.perf_counter()
+    workouts = fit_workouts(prompt_builder, index.relevant(user_id, plan_request))
+    system_prompt = plan_system_prompt(case["profile"], workouts)
+    prompt = build_plan_prompt(system_prompt, plan_request)
+    prompt_time = time.perf_counter() - start
+
+    request = submit_plan(engine, prompt, grammar)
+    raw_output = request.result()
+
+    post_start = time.perf_counter()
+    clean_plan_response(raw_output)
+    return request, prompt_time, time.perf_counter() - post_start
+
+
+def replay(engine, corpus, paths=("chat", "plan"), repeats=1, concurrency=1, prompt_builder=None, grammar=None):
+    index = WorkoutIndex(load_corpus_store(corpus))
+    prompt_builder = prompt_builder or PromptBuilder(engine.tokenizer)
+    grammar = grammar or PlanGrammar(engine.tokenizer)
+    jobs = []
+    for _ in range(repeats):
+        for i, case in enumerate(corpus):
+            user_id = f"bench-{i}"
+            if "chat" in paths:
+                jobs += [("chat", run_chat, (engine, prompt_builder, index, user_id, case, q))
+                         for q in case["questions"]]
+            if "plan" in paths:
+                jobs += [("plan", run_plan, (engine, prompt_builder, grammar, index, user_id, case, p))
+                         for p in case["plans"]]
+
+    # Each worker plays one user waiting on their reply, so requests overlap up to `concurrency`
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [(path, pool.submit(fn, *args)) for path, fn, args in jobs]
+        samples = [(path, future.result()) for path, future in futures]
+
+    return {path: summarize([result for p, result in samples if p == path]) for path in paths}
+
+
+# ----------------- Report -----------------
+def percentile(values, q):
+    # Nearest-rank percentile
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = max(1, min(len(values), round(q / 100 * len(values) + 0.5)))
+    return values[rank - 1]
+
+
+def summarize(results):
+    requests = [r[0] for r in results]
+    stats = [request.stats for request in requests]
+    # From the first request submitted to the last one finished
+    wall_time = max((r.submitted_at + r.stats.total_time for r in requests), default=0.0) \
+        - min((r.submitted_at for r in requests), default=0.0)
+    latencies = [s.total_time for s in stats]
+    ttfts = [s.time_to_first_token for s in stats]
+    post = [r[2] for r in results]
+    new_tokens = sum(s.new_tokens for s in stats)
+    draft_tokens = sum(s.draft_tokens for s in stats)
+    return {
+        "requests": len(stats),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p95": percentile(ttfts, 95),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "tokens_per_second": new_tokens / sum(latencies) if latencies else 0.0,
+        "throughput": new_tokens / wall_time if wall_time else 0.0,
+        "prompt_tokens_mean": sum(s.prompt_tokens for s in stats) / len(stats) if stats else 0.0,
+        "cached_prompt_tokens_mean": sum(s.cached_prompt_tokens for s in stats) / len(stats) if stats else 0.0,
+        "new_tokens_mean": new_tokens / len(stats) if stats else 0.0,
+        "prompt_build_ms_p50": percentile([r[1] for r in results], 50) * 1000,
+        "postprocess_ms_p50": percentile(post, 50) * 1000,
+        "postprocess_ms_p95": percentile(post, 95) * 1000,
+        "acceptance_rate": sum(s.accepted_draft_tokens for s in stats) / draft_tokens if draft_tokens else None,
+    }
+
+
+def print_report(report):
+    for path, row in report.items():
+        print(f"{path}: {row['requests']} requests")
+        print(f"  TTFT        p50 {row['ttft_p50'] * 1000:8.1f} ms   p95 {row['ttft_p95'] * 1000:8.1f} ms")
+        print(f"  latency     p50 {row['latency_p50'] * 1000:8.1f} ms   p95 {row['latency_p95'] * 1000:8.1f} ms"
+              f"   p99 {row['latency_p99'] * 1000:8.1f} ms")
+        print(f"  tokens/s    {row['tokens_per_second']:8.1f} per request   {row['throughput']:8.1f} overall")
+        print(f"  tokens      {row['prompt_tokens_mean']:8.1f} prompt ({row['cached_prompt_tokens_mean']:.1f} cached)"
+              f"   {row['new_tokens_mean']:8.1f} generated")
+        print(f"  prompt build p50 {row['prompt_build_ms_p50']:.2f} ms   post-processing"
+              f" p50 {row['postprocess_ms_p50']:.2f} ms   p95 {row['postprocess_ms_p95']:.2f} ms")
+        if row["acceptance_rate"] is not None:
+            print(f"  draft acceptance {row['acceptance_rate']:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chat and plan generation paths.")
+    parser.add_argument("--model", default="tiny",
+                        help="'tiny' for a random CPU model (default), or a model name for load_engine")
+    parser.add_argument("--draft-model", default=None,
+                        help="draft model for speculative decoding; 'tiny' pairs with the tiny model")
+    parser.add_argument("--num-draft-tokens", type=int, default=4)
+    parser.add_argument("--paths", nargs="+", choices=["chat", "plan"], default=["chat", "plan"])
+    parser.add_argument("--repeats", type=int, default=1, help="times to replay the corpus")
+    parser.add_argument("--concurrency", type=int, default=1, help="requests in flight at once")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="tiny model only")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    engine = build_engine(args.model, args.draft_model, args.num_draft_tokens, args.max_batch_size)
+    # Shared across runs like the app's cached resources
+    prompt_builder = PromptBuilder(engine.tokenizer)
+    grammar = PlanGrammar(engine.tokenizer)
+    # Warm up once so one-off setup (grammar masks, kernels) isn't measured
+    replay(engine, CORPUS[:1], args.paths, prompt_builder=prompt_builder, grammar=grammar)
+    torch.manual_seed(args.seed)
+    report = replay(engine, CORPUS, args.paths, args.repeats, args.concurrency, prompt_builder, grammar)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
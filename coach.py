@@ -0,0 +1,544 @@
+"""Chat and plan generation without the Streamlit UI.
+
+The Chat tab and "Generate Plan" build a prompt from the profile and the
+recent workout log, run it through the shared ``InferenceEngine`` and clean
+the raw output with a few regexes. Those steps live here so the app,
+``server.py`` and ``benchmark.py`` run exactly the same code.
+``CoachService`` ties them together with the response cache.
+"""
+import asyncio
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+
+from inference import BACKGROUND, INTERACTIVE, SENTENCE_BOUNDARY
+from metrics import REGISTRY, TOKEN_BUCKETS
+from plan_grammar import PlanGrammar
+from prompt_builder import MAX_PROMPT_TOKENS, PromptBuilder
+from response_cache import ResponseCache
+
+# Stop at any meta-text like "Question:", "Answer:", or profile repetition
+STOP_PATTERNS = (
+    "Question:", "Answer:", "\nUser:", "\nQuestion", "Q:", "\nA:",
+    "User:", "Assistant:", "What is your", "What are your",
+    "Your experience level", "Your goal is", "Given your"
+)
+
+# Simple greetings/short questions get a shorter answer
+SIMPLE_PATTERNS = (
+    'how are you', 'hello', 'hi', 'hey', 'thanks', 'thank you', 'yes', 'no', 'okay', 'ok',
+    'doing', 'how old', 'what is my', 'who am i'
+)
+# Whole words only, so "which" and "know" don't count as "hi" and "no"
+SIMPLE_PATTERN = re.compile(r"\b(" + "|".join(map(re.escape, SIMPLE_PATTERNS)) + r")\b")
+# Turns made only of greetings and acknowledgements, the small model's share of the chat
+SMALL_TALK_PATTERN = re.compile(
+    r"((hi|hello|hey|yo|hiya|howdy|good (morning|afternoon|evening|night)|how are you( doing)?( today)?"
+    r"|how's it going|what's up|sup|thanks|thank you|thank you so much|thanks a lot|thx|ty|cheers|ok|okay|k"
+    r"|cool|great|nice|awesome|perfect|got it|sounds good|makes sense|will do|yes|yeah|yep|no|nope|sure"
+    r"|bye|goodbye|see you|see ya|later)( (there|coach|man|again|buddy))?[\s,.!?]*)+"
+)
+# Besides small talk, the small model answers questions of at most SMALL_MODEL_MAX_WORDS words
+# that ask for a short answer (see max_sentences_for) or match a SMALL_MODEL_PATTERNS entry,
+# unless they match a LARGE_MODEL_PATTERNS entry
+SMALL_MODEL_MAX_WORDS = 8
+# Definitions and single facts
+SMALL_MODEL_PATTERNS = (
+    r"^(what|what's|whats) (is|are|does) (a|an|the)\b",
+    r"\b(stand for|mean|means|meaning|define|definition)\b",
+    r"^how many (calories|grams|kcal)\b",
+    r"^(what|which) muscles?\b",
+)
+# Coaching: programming, injuries, exercise choice, judgement and yes/no questions about the user
+LARGE_MODEL_PATTERNS = (
+    r"\b(plan|program|programming|routine|split|schedule|design)\b",
+    r"\b(injur\w*|pain\w*|hurts?|sore\w*|rehab\w*|physio\w*|sprain\w*|strain\w*|tendon\w*|surgery)\b",
+    r"\b(exercises?|workouts?|stretch\w*|alternatives?|substitut\w*|swap|replace)\b",
+    r"\b(should|can i|safe|recommend\w*|best|better|worse|vs|versus|compare|why)\b",
+    r"^(is|are|am|do|does|did|was|can|could|would|will)\b",
+)
+
+# Tokens of workout history in a chat or plan prompt, however long the log
+WORKOUT_CONTEXT_TOKENS = 256
+
+FALLBACK_RESPONSE = "Let's try that again — could you rephrase your question?"
+BUSY_RESPONSE = "The coach is busy right now — please ask again in a moment."
+ERROR_RESPONSE = "Something went wrong reaching the coach — please try again."
+
+# Seconds a request may take, queueing included, before it's stopped
+CHAT_TIMEOUT = 60
+PLAN_TIMEOUT = 180
+# Replies cut short by the user or a deadline are never cached
+INTERRUPTED = ("cancelled", "deadline")
+
+
+def record_generation(path, stats, metrics=REGISTRY):
+    """Record a finished request's engine-side stages and token counts under ``path``."""
+    metrics.observe_stage(path, "queue", stats.queue_time)
+    metrics.observe_stage(path, "prefill", stats.prefill_time)
+    metrics.observe_stage(path, "decode", stats.decode_time)
+    metrics.histogram("time_to_first_token_seconds", "Submit to first streamed text").observe(
+        stats.time_to_first_token, path=path
+    )
+    metrics.histogram("generation_seconds", "Submit to last token").observe(stats.total_time, path=path)
+    metrics.histogram("prompt_tokens", "Prompt length", buckets=TOKEN_BUCKETS).observe(stats.prompt_tokens, path=path)
+    metrics.histogram("new_tokens", "Generated length", buckets=TOKEN_BUCKETS).observe(stats.new_tokens, path=path)
+    metrics.counter("cached_prompt_tokens_total", "Prompt tokens reused from the prefix cache").inc(
+        stats.cached_prompt_tokens, path=path
+    )
+    metrics.counter("generations_total", "Finished generations").inc(path=path, stop_reason=stats.stop_reason)
+
+
+def record_tier(tier, stats, metrics=REGISTRY):
+    """Record which model tier answered a chat turn, and how fast."""
+    metrics.counter("chat_tier_turns_total", "Chat replies generated per model tier").inc(tier=tier)
+    metrics.counter("chat_tier_tokens_total", "Chat tokens generated per model tier").inc(stats.new_tokens, tier=tier)
+    metrics.histogram("chat_tier_time_to_first_token_seconds", "Submit to first streamed text per model tier") \
+        .observe(stats.time_to_first_token, tier=tier)
+    metrics.histogram("chat_tier_generation_seconds", "Submit to last token per model tier") \
+        .observe(stats.total_time, tier=tier)
+
+
+# ----------------- Workout context -----------------
+def workout_line(w):
+    return f"{w.exercise} {w.sets}x{w.reps} @ {w.weight}lbs on {w.date}"
+
+
+def fit_workouts(prompt_builder, workouts, budget=WORKOUT_CONTEXT_TOKENS):
+    """The leading ``workouts`` (most relevant first) that fit in ``budget`` tokens, oldest first."""
+    kept, used = [], 0
+    for w in workouts:
+        cost = prompt_builder.count(workout_line(w) + "; ")
+        if used + cost > budget:
+            break
+        kept.append(w)
+        used += cost
+    return sorted(kept, key=lambda w: w.date)
+
+
+# ----------------- Chat -----------------
+def chat_system_prompt(profile, workouts):
+    profile_info = []
+
+    if profile["name"]:
+        profile_info.append(f"The user's name is {profile['name']}")
+    if profile["age"]:
+        profile_info.append(f"they are {profile['age']} years old")
+    if profile["experience_level"]:
+        profile_info.append(f"experience level is {profile['experience_level'].lower()}")
+    if profile["fitness_goal"]:
+        profile_info.append(f"their goal: {profile['fitness_goal']}")
+    if profile["injuries"]:
+        profile_info.append(f"injury considerations: {profile['injuries']}")
+    if profile["preferences"]:
+        profile_info.append(f"preferences: {profile['preferences']}")
+
+    profile_context = "; ".join(profile_info) + "." if profile_info else ""
+
+    workout_context = ""
+    if workouts:
+        workout_context = "Workout history: " + "; ".join(workout_line(w) for w in workouts) + "."
+
+    # Instructions first and the workout history last: a prompt over budget loses the end of the system prompt
+    return " ".join(part for part in (
+        "You are a helpful fitness coach. "
+        "Answer briefly and stop when done. For simple questions, give 1-2 sentences. "
+        "For workout advice, suggest 2-3 exercises with one sentence each explaining how to do it.",
+        profile_context,
+        workout_context,
+    ) if part)
+
+
+def max_sentences_for(question):
+    # Cap at 2 sentences for simple questions and 5 for anything else
+    is_simple = SIMPLE_PATTERN.search(question.lower()) is not None
+    return 2 if is_simple else 5
+
+
+def _any_of(patterns):
+    # A pattern matching any of ``patterns``; none of them matches nothing
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns) or r"(?!)")
+
+
+@dataclass
+class RoutingPolicy:
+    """Which questions, besides small talk, ``chat_tier`` sends to the small model.
+
+    ``max_words=0`` keeps every question on the large model.
+    """
+    max_words: int = SMALL_MODEL_MAX_WORDS
+    small_patterns: tuple = SMALL_MODEL_PATTERNS
+    large_patterns: tuple = LARGE_MODEL_PATTERNS
+
+    def __post_init__(self):
+        self.small_pattern = _any_of(self.small_patterns)
+        self.large_pattern = _any_of(self.large_patterns)
+
+
+def chat_tier(question, policy=None):
+    """``"small"`` for small talk and the short questions ``policy`` allows, ``"large"`` for the rest."""
+    policy = policy if policy is not None else RoutingPolicy()
+    q = question.lower().strip()
+    if SMALL_TALK_PATTERN.fullmatch(q):
+        return "small"
+    if len(q.split()) > policy.max_words or policy.large_pattern.search(q):
+        return "large"
+    if max_sentences_for(question) < 5 or policy.small_pattern.search(q):
+        return "small"
+    return "large"
+
+
+def submit_chat(engine, built_prompt, question, timeout=CHAT_TIMEOUT):
+    return engine.submit(
+        prompt_ids=built_prompt.token_ids,
+        # Someone is watching the reply stream in
+        priority=INTERACTIVE,
+        timeout=timeout,
+        max_new_tokens=180,
+        temperature=0.7,
+        top_p=0.85,
+        top_k=40,
+        do_sample=True,
+        repetition_penalty=1.3,
+        eos_token_id=engine.tokenizer.eos_token_id,
+        # Halt decoding as soon as the reply would be cut below anyway
+        stop_sequences=STOP_PATTERNS,
+        max_sentences=max_sentences_for(question),
+    )
+
+
+def clean_chat_response(raw_output, question):
+    response = raw_output
+
+    # Remove Mistral special tokens
+    response = re.sub(r"<s>|</s>|\[INST\]|\[/INST\]", "", response)
+
+    # Remove the ENTIRE input (system + user question) from the start
+    # Find where the actual response begins after [/INST]
+    inst_end = raw_output.find("[/INST]")
+    if inst_end != -1:
+        response = raw_output[inst_end + 7:].strip()
+
+    # Aggressively remove any echoed question at the start
+    # This handles cases where the question appears with or without punctuation
+    question_clean = question.strip().rstrip('?!.')
+    response = re.sub(
+        f"^{re.escape(question_clean)}[?!.]*\\s*",
+        "",
+        response,
+        flags=re.IGNORECASE
+    )
+
+    # Remove system prompt remnants
+    response = re.sub(
+        r"You are a helpful fitness coach\..*?unless asked for detailed plans\.",
+        "",
+        response,
+        flags=re.DOTALL | re.IGNORECASE
+    )
+
+    # Decoding halts at the first stop pattern; trim the pattern itself
+    for stop_word in STOP_PATTERNS:
+        if stop_word in response:
+            response = response.split(stop_word)[0]
+
+    # Always limit to prevent runaway responses
+    max_sentences = max_sentences_for(question)
+    sentences = SENTENCE_BOUNDARY.split(response.strip())
+
+    if len(sentences) > max_sentences:
+        response = ' '.join(sentences[:max_sentences])
+
+    # Clean up whitespace
+    response = response.strip()
+    response = re.sub(r'\n{3,}', '\n\n', response)
+    response = re.sub(r' {2,}', ' ', response)
+    return response
+
+
+# ----------------- Workout plan -----------------
+def plan_system_prompt(profile, workouts):
+    profile_info = []
+
+    if profile["name"]:
+        profile_info.append(f"Name: {profile['name']}")
+    if profile["age"]:
+        profile_info.append(f"Age: {profile['age']}")
+    if profile["experience_level"]:
+        profile_info.append(f"Experience: {profile['experience_level']}")
+    if profile["fitness_goal"]:
+        profile_info.append(f"Goal: {profile['fitness_goal']}")
+    if profile["injuries"]:
+        profile_info.append(f"Injuries: {profile['injuries']}")
+
+    profile_context = "; ".join(profile_info) if profile_info else ""
+
+    workout_context = ""
+    if workouts:
+        workout_context = "Workout history: " + "; ".join([
+            f"{w.exercise} {w.weight}lbs {w.sets}x{w.reps}"
+            for w in workouts
+        ])
+
+    return (
+        f"You are a fitness coach creating a workout plan. {profile_context}. {workout_context}. "
+        "Create 3-4 exercises. Format each as: Exercise Name | X sets | Y reps | Z lbs | Brief tip\n"
+        "Be specific with weights. Keep tips short (5-8 words). Complete all exercises."
+    )
+
+
+def build_plan_prompt(system_prompt, plan_request):
+    return f"<s>[INST] {system_prompt}\n\n{plan_request.strip()} [/INST]"
+
+
+def submit_plan(engine, prompt, grammar, timeout=PLAN_TIMEOUT):
+    # Room for the longest plan the grammar allows, so the budget never cuts a line
+    return engine.submit(
+        prompt,
+        priority=BACKGROUND,
+        timeout=timeout,
+        max_new_tokens=grammar.max_new_tokens,
+        temperature=0.7,
+        top_p=0.9,
+        do_sample=True,
+        repetition_penalty=1.2,
+        eos_token_id=engine.tokenizer.eos_token_id,
+        # Only "Name | X sets | Y reps | Z lbs | tip" lines can be generated
+        constraint=grammar,
+    )
+
+
+def clean_plan_response(raw_output):
+    response = raw_output
+    inst_end = raw_output.find("[/INST]")
+    if inst_end != -1:
+        response = raw_output[inst_end + 7:]
+
+    response = re.sub(r"<s>|</s>|\[INST\]|\[/INST\]", "", response)
+
+    # Every finished plan line ends with a newline; one cut short by a timeout would log the wrong weight
+    response = response[:response.rfind("\n") + 1]
+
+    # Remove any system prompt echoes
+    response = re.sub(
+        r"You are a fitness coach.*?Be specific with weights\.",
+        "",
+        response,
+        flags=re.DOTALL | re.IGNORECASE
+    )
+    return response.strip()
+
+
+# ----------------- Service -----------------
+class Turn:
+    """A chat reply or plan in progress.
+
+    Iterate over it (``for`` or ``async for``) to receive text as it is
+    generated; ``response``, the cleaned reply, is set once iteration ends.
+    Cached answers have no ``request`` and yield nothing. Abandoning the
+    iteration early cancels the generation. ``tier`` names the model that
+    generated it, "small" or "large". ``stream`` and ``astream`` with a
+    ``poll_interval`` also yield "" while no text arrives (see
+    ``GenerationRequest.stream``).
+    """
+
+    def __init__(self, path, request=None, response=None, finish=None, tier=None):
+        self.path = path
+        self.tier = tier
+        self.request = request
+        self.response = response
+        self.cached = request is None
+        self.stats = request.stats if request is not None else None
+        self._finish = finish
+
+    def __iter__(self):
+        return self.stream()
+
+    def __aiter__(self):
+        return self.astream()
+
+    def stream(self, poll_interval=None):
+        if self.request is None:
+            return
+        raw_output = ""
+        try:
+            for text in self.request.stream(poll_interval):
+                raw_output += text
+                yield text
+        finally:
+            self.request.cancel()
+        self.response = self._finish(raw_output)
+
+    async def astream(self, poll_interval=None):
+        if self.request is None:
+            return
+        raw_output = ""
+        try:
+            async for text in self.request.astream(poll_interval):
+                raw_output += text
+                yield text
+        finally:
+            self.request.cancel()
+        # Post-processing and the cache write stay off the event loop
+        self.response = await asyncio.to_thread(self._finish, raw_output)
+
+    def cancel(self):
+        if self.request is not None:
+            self.request.cancel()
+
+    def result(self):
+        for _ in self:
+            pass
+        return self.response
+
+    def to_dict(self):
+        return {
+            "response": self.response,
+            "cached": self.cached,
+            "tier": self.tier,
+            "stats": asdict(self.stats) if self.stats is not None else None,
+        }
+
+
+class CoachService:
+    """Chat replies and workout plans from one engine, behind the response cache.
+
+    With a ``small_engine``, simple chat turns (see ``chat_tier``) are
+    answered by that smaller model instead; plans always use ``engine``.
+    """
+
+    def __init__(self, engine, response_cache=None, max_prompt_tokens=MAX_PROMPT_TOKENS, metrics=REGISTRY,
+                 small_engine=None, workout_context_tokens=WORKOUT_CONTEXT_TOKENS, routing=None):
+        self.engine = engine
+        self.workout_context_tokens = workout_context_tokens
+        self.small_engine = small_engine
+        self.routing = routing if routing is not None else RoutingPolicy()
+        self.response_cache = response_cache if response_cache is not None else ResponseCache()
+        # Token IDs of messages and system prompts are cached across turns and sessions
+        self.prompt_builder = PromptBuilder(engine.tokenizer, max_prompt_tokens=max_prompt_tokens)
+        # The small model has its own tokenizer, so its own token ID cache
+        self.small_prompt_builder = (
+            PromptBuilder(small_engine.tokenizer, max_prompt_tokens=max_prompt_tokens) if small_engine else None
+        )
+        # Token masks for plan lines are computed once per process and shared by all sessions,
+        # ahead of the first plan so the engine thread doesn't stall on them
+        self.grammar = PlanGrammar(engine.tokenizer)
+        self.grammar.warm_up_in_background()
+        self.metrics = metrics
+        cache = self.response_cache
+        metrics.counter("response_cache_hits_total", "Replies served from the response cache") \
+            .set_function(lambda: cache.hits)
+        metrics.counter("response_cache_misses_total", "Response cache lookups that missed") \
+            .set_function(lambda: cache.misses)
+
+    def chat(self, profile, workouts, messages, question, use_cache=True, timeout=CHAT_TIMEOUT):
+        """Answer ``question`` given ``(role, message)`` history; returns a ``Turn``.
+
+        ``workouts`` are log rows, most relevant first (see ``workout_index``).
+        """
+        metrics = self.metrics
+        tier = "large"
+        if self.small_engine is not None:
+            tier = chat_tier(question, self.routing)
+        engine, prompt_builder = (
+            (self.small_engine, self.small_prompt_builder) if tier == "small" else (self.engine, self.prompt_builder)
+        )
+        with metrics.span("chat", "context"):
+            workouts = fit_workouts(prompt_builder, workouts, self.workout_context_tokens)
+            system_prompt = chat_system_prompt(profile, workouts)
+        # Build full prompt with as much conversation history as the token budget allows
+        with metrics.span("chat", "prompt_build"):
+            if tier == "small":
+                # The small model was trained on its own chat format, not Mistral's
+                built_prompt = prompt_builder.build_template_prompt(system_prompt, messages, question)
+            else:
+                built_prompt = prompt_builder.build_chat_prompt(system_prompt, messages, question)
+
+        # Identical question with identical context, answered by the same model: reuse the earlier answer
+        cache_key = ResponseCache.make_key("chat", question, tier, system_prompt, built_prompt.history_text)
+        if use_cache:
+            with metrics.span("chat", "cache_lookup"):
+                cached_response = self.response_cache.get(cache_key)
+            if cached_response is not None:
+                return Turn("chat", response=cached_response)
+
+        request = submit_chat(engine, built_prompt, question, timeout)
+
+        def finish(raw_output):
+            record_generation("chat", request.stats, metrics)
+            record_tier(tier, request.stats, metrics)
+            with metrics.span("chat", "postprocess"):
+                response = clean_chat_response(raw_output, question)
+            if not response:
+                return FALLBACK_RESPONSE
+            if request.stats.stop_reason not in INTERRUPTED:
+                self.response_cache.put(cache_key, response)
+            return response
+
+        return Turn("chat", request, finish=finish, tier=tier)
+
+    def plan(self, profile, workouts, plan_request, use_cache=True, timeout=PLAN_TIMEOUT):
+        """Generate a workout plan for ``plan_request``; returns a ``Turn``."""
+        metrics = self.metrics
+        with metrics.span("plan", "context"):
+            workouts = fit_workouts(self.prompt_builder, workouts, self.workout_context_tokens)
+        with metrics.span("plan", "prompt_build"):
+            system_prompt = plan_system_prompt(profile, workouts)
+            prompt = build_plan_prompt(system_prompt, plan_request)
+
+        cache_key = ResponseCache.make_key("plan", plan_request, system_prompt)
+        if use_cache:
+            with metrics.span("plan", "cache_lookup"):
+                cached_plan = self.response_cache.get(cache_key)
+            if cached_plan is not None:
+                return Turn("plan", response=cached_plan)
+
+        request = submit_plan(self.engine, prompt, self.grammar, timeout)
+
+        def finish(raw_output):
+            record_generation("plan", request.stats, metrics)
+            with metrics.span("plan", "postprocess"):
+                response = clean_plan_response(raw_output)
+            if response and request.stats.stop_reason not in INTERRUPTED:
+                self.response_cache.put(cache_key, response)
+            return response
+
+        return Turn("plan", request, finish=finish, tier="large")
+
+    def status(self):
+        engine = self.engine
+        return {
+            "ready": True,
+            "tokens_per_second": engine.tokens_per_second(),
+            "active_requests": engine.active_requests,
+            "queued_requests": engine.queued_requests,
+            "small_model": self.small_engine is not None,
+            "response_cache": {"hits": self.response_cache.hits, "misses": self.response_cache.misses},
+        }
+
+
+def _patterns_from_env(name, default):
+    # A JSON list of regular expressions, replacing the defaults
+    value = os.environ.get(name)
+    return tuple(json.loads(value)) if value else default
+
+
+def service_from_env(engine, small_engine=None):
+    # Configured the same way wherever the service runs (Streamlit or server.py)
+    return CoachService(
+        engine,
+        response_cache=ResponseCache(
+            ttl=int(os.environ.get("RESPONSE_CACHE_TTL", 6 * 60 * 60)),
+            max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", 1024)),
+            path=os.environ.get("RESPONSE_CACHE_PATH") or None,
+        ),
+        max_prompt_tokens=int(os.environ.get("MAX_PROMPT_TOKENS", MAX_PROMPT_TOKENS)),
+        small_engine=small_engine,
+        routing=RoutingPolicy(
+            max_words=int(os.environ.get("SMALL_MODEL_MAX_WORDS", SMALL_MODEL_MAX_WORDS)),
+            small_patterns=_patterns_from_env("SMALL_MODEL_PATTERNS", SMALL_MODEL_PATTERNS),
+            large_patterns=_patterns_from_env("LARGE_MODEL_PATTERNS", LARGE_MODEL_PATTERNS),
+        ),
+        workout_context_tokens=int(os.environ.get("WORKOUT_CONTEXT_TOKENS", WORKOUT_CONTEXT_TOKENS)),
+    )
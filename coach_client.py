@@ -0,0 +1,129 @@
+"""Client for ``server.py`` with the same surface as ``coach.CoachService``.
+
+The Streamlit app uses it instead of loading the model itself when
+``FITNESS_API_URL`` is set. Only the standard library is needed.
+"""
+import json
+import time
+import urllib.error
+import urllib.request
+from dataclasses import asdict
+
+from inference import DeadlineExceeded, EngineBusyError, GenerationStats
+
+
+class RemoteTurn:
+    """A ``coach.Turn`` streamed from the server."""
+
+    def __init__(self, path, response):
+        self.path = path
+        self.response = None
+        self.cached = False
+        self.tier = None
+        self.stats = None
+        self._http_response = response
+
+    def __iter__(self):
+        return self.stream()
+
+    def stream(self, poll_interval=None):
+        # The server's blank keep-alive lines set the polling interval
+        with self._http_response as lines:
+            for line in lines:
+                if not line.strip():
+                    if poll_interval is not None:
+                        yield ""
+                    continue
+                event = json.loads(line)
+                if "error" in event:
+                    if event.get("type") == "DeadlineExceeded":
+                        raise DeadlineExceeded(event["error"])
+                    raise RuntimeError(event["error"])
+                if "text" in event:
+                    yield event["text"]
+                elif event.get("done"):
+                    self.response = event["response"]
+                    self.cached = event["cached"]
+                    self.tier = event.get("tier")
+                    self.stats = GenerationStats(**event["stats"]) if event["stats"] else None
+
+    def result(self):
+        for _ in self:
+            pass
+        return self.response
+
+    def cancel(self):
+        # The server cancels the generation when the connection closes
+        self._http_response.close()
+
+
+class CoachClient:
+    def __init__(self, base_url, timeout=300, health_ttl=1.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        # /health is read on every Streamlit rerun; reuse it briefly
+        self.health_ttl = health_ttl
+        self._health = None
+        self._health_at = 0.0
+
+    # ----------------- Readiness (same as BackgroundLoader) -----------------
+    def health(self):
+        now = time.monotonic()
+        if self._health is None or now - self._health_at > self.health_ttl:
+            try:
+                with urllib.request.urlopen(f"{self.base_url}/health", timeout=5) as response:
+                    self._health = json.load(response)
+            except (OSError, ValueError) as e:
+                self._health = {"ready": False, "elapsed": 0.0, "error": f"Coach API unreachable: {e}"}
+            self._health_at = now
+        return self._health
+
+    @property
+    def ready(self):
+        return self.health()["ready"]
+
+    @property
+    def failed(self):
+        return self.health()["error"] is not None
+
+    @property
+    def error(self):
+        return self.health()["error"]
+
+    @property
+    def elapsed(self):
+        return self.health()["elapsed"]
+
+    # ----------------- Generation -----------------
+    def chat(self, profile, workouts, messages, question, use_cache=True):
+        return RemoteTurn("chat", self._post("/chat", {
+            "question": question,
+            "profile": profile,
+            "workouts": [asdict(w) for w in workouts],
+            "messages": [list(m) for m in messages],
+            "use_cache": use_cache,
+        }))
+
+    def plan(self, profile, workouts, plan_request, use_cache=True):
+        return RemoteTurn("plan", self._post("/plan", {
+            "request": plan_request,
+            "profile": profile,
+            "workouts": [asdict(w) for w in workouts],
+            "use_cache": use_cache,
+        }))
+
+    def status(self):
+        return self.health()
+
+    def _post(self, path, payload):
+        request = urllib.request.Request(
+            f"{self.base_url}{path}",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                raise EngineBusyError(e.read().decode("utf-8", "replace")) from e
+            raise RuntimeError(f"Coach API error {e.code}: {e.read().decode('utf-8', 'replace')}") from e
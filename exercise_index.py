@@ -0,0 +1,230 @@
+"""Exercise names: one canonical spelling per lift, and fast fuzzy search.
+
+People log the same lift as "Bench", "Bench Presses" and "bench press
+(barbell)", and each spelling used to get its own personal record, while
+the Personal Records search box matched substrings of every name on each
+rerun. ``canonical_exercise`` folds case, spacing, punctuation, plurals,
+shorthand ("ohp", "rdl") and common full-name aliases into one spelling.
+The store keys records by it, and analytics and prompt retrieval group by
+it.
+
+``ExerciseIndex`` finds a user's exercises by word prefix and with typos
+("bech", "sqaut", "deadlfit"). A deletion dictionary maps every spelling
+within the allowed edits of each indexed word to that word, so a lookup is
+a few dictionary hits instead of a scan. The index is updated in place:
+only names logged or removed since the last lookup are touched.
+"""
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+WORD = re.compile(r"[a-z0-9]+")
+# Shorthand people log or ask with, spelled out
+ALIASES = {
+    "ohp": "overhead press",
+    "rdl": "romanian deadlift",
+    "rdls": "romanian deadlift",
+    "bb": "barbell",
+    "db": "dumbbell",
+    "pullup": "pull up",
+    "pullups": "pull up",
+    "chinup": "chin up",
+    "chinups": "chin up",
+    "pushup": "push up",
+    "pushups": "push up",
+    "situp": "sit up",
+    "situps": "sit up",
+    # "Pull-ups", "push-ups", "sit-ups"
+    "ups": "up",
+}
+# Whole names that mean another, after the word-level clean-up
+NAME_ALIASES = {
+    "bench": "bench press",
+    "flat bench": "bench press",
+    "flat bench press": "bench press",
+    "back squat": "squat",
+    "conventional deadlift": "deadlift",
+    "military press": "overhead press",
+    "standing overhead press": "overhead press",
+    "bent over row": "barbell row",
+    "barbell bent over row": "barbell row",
+}
+# Lifts done with a barbell unless said otherwise, so "(barbell)" adds nothing
+BARBELL_LIFTS = {
+    "bench press", "incline bench press", "squat", "front squat", "deadlift", "romanian deadlift",
+    "overhead press", "hip thrust",
+}
+
+# Edits forgiven per query word, by length; short words must match exactly
+MIN_FUZZY_LENGTH = 4
+LONG_WORD_LENGTH = 8
+# Typos allowed inside a prefix, while the user is still typing the word
+PREFIX_TYPOS = 1
+
+
+def _singular(word):
+    if word.endswith("sses"):
+        return word[:-2]
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def words(text):
+    """Lowercase, singular, alias-expanded words of ``text``."""
+    result = []
+    for word in WORD.findall(text.lower()):
+        result.extend(ALIASES.get(word, _singular(word)).split())
+    return result
+
+
+@lru_cache(maxsize=4096)
+def canonical_exercise(name):
+    """One spelling per exercise: "Back  Squats" and "squat (barbell)" are the same lift."""
+    tokens = words(name)
+    canonical = " ".join(tokens)
+    canonical = NAME_ALIASES.get(canonical, canonical)
+    if "barbell" in tokens:
+        rest = " ".join(t for t in tokens if t != "barbell")
+        rest = NAME_ALIASES.get(rest, rest)
+        if rest in BARBELL_LIFTS:
+            return rest
+    return canonical
+
+
+def _max_typos(word):
+    if len(word) < MIN_FUZZY_LENGTH:
+        return 0
+    return 2 if len(word) >= LONG_WORD_LENGTH else 1
+
+
+def _deletes(word, depth):
+    """``word`` and every string made by deleting up to ``depth`` of its characters."""
+    found = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        found |= frontier
+    return found
+
+
+def _distance(a, b):
+    """Edit distance counting a swap of adjacent characters as one edit."""
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class _UserExercises:
+    def __init__(self):
+        self.revision = None
+        self.names = {}
+        # Indexed word -> canonical names containing it
+        self.by_word = defaultdict(set)
+        self.by_prefix = defaultdict(set)
+        # Spelling within the allowed deletions of a word or one of its prefixes -> words
+        self.by_delete = defaultdict(set)
+
+    @staticmethod
+    def _variants(word):
+        variants = _deletes(word, _max_typos(word))
+        for end in range(MIN_FUZZY_LENGTH, len(word)):
+            variants |= _deletes(word[:end], PREFIX_TYPOS)
+        return variants
+
+    def _index_word(self, word, add):
+        keys = [(self.by_prefix, word[:end]) for end in range(1, len(word) + 1)]
+        keys += [(self.by_delete, variant) for variant in self._variants(word)]
+        for table, key in keys:
+            if add:
+                table[key].add(word)
+            else:
+                table[key].discard(word)
+                if not table[key]:
+                    del table[key]
+
+    @staticmethod
+    def _words_of(canonical, name):
+        return set(canonical.split()) | set(words(name))
+
+    def update(self, names):
+        """Bring the index to ``names`` (canonical -> display name), touching only the difference."""
+        # A record moving to a set spelled differently renames its exercise
+        renamed = {c for c in names.keys() & self.names.keys() if names[c] != self.names[c]}
+        for canonical in (self.names.keys() - names.keys()) | renamed:
+            for word in self._words_of(canonical, self.names.pop(canonical)):
+                self.by_word[word].discard(canonical)
+                if not self.by_word[word]:
+                    del self.by_word[word]
+                    self._index_word(word, add=False)
+        for canonical in (names.keys() - self.names.keys()) | renamed:
+            self.names[canonical] = names[canonical]
+            for word in self._words_of(canonical, names[canonical]):
+                if word not in self.by_word:
+                    self._index_word(word, add=True)
+                self.by_word[word].add(canonical)
+
+    def _word_costs(self, query_word):
+        # Cost per matching indexed word: whole word 0, prefix 1, typo 1 + edits
+        costs = {word: 1 for word in self.by_prefix.get(query_word, ())}
+        if query_word in self.by_word:
+            costs[query_word] = 0
+        typos = _max_typos(query_word)
+        if typos:
+            candidates = set()
+            for variant in _deletes(query_word, typos):
+                candidates |= self.by_delete.get(variant, set())
+            for word in candidates - costs.keys():
+                edits = _distance(query_word, word)
+                if edits > typos:
+                    # A typo in the part of the word typed so far
+                    ends = range(len(query_word) - PREFIX_TYPOS, min(len(word), len(query_word) + PREFIX_TYPOS) + 1)
+                    edits = min(_distance(query_word, word[:end]) for end in ends)
+                    if edits > PREFIX_TYPOS:
+                        continue
+                costs[word] = 1 + edits
+        return costs
+
+    def search(self, query, limit):
+        query_words = list(dict.fromkeys(words(query)))
+        if not query_words:
+            return sorted(self.names.values(), key=str.lower)[:limit]
+        # Every query word must match a word of the name; lowest total cost first
+        totals = None
+        for query_word in query_words:
+            best = {}
+            for word, cost in self._word_costs(query_word).items():
+                for canonical in self.by_word[word]:
+                    best[canonical] = min(cost, best.get(canonical, cost))
+            totals = best if totals is None else {c: totals[c] + best[c] for c in totals.keys() & best.keys()}
+            if not totals:
+                return []
+        ranked = sorted(totals, key=lambda c: (totals[c], len(c), c))
+        return [self.names[c] for c in ranked[:limit]]
+
+
+class ExerciseIndex:
+    def __init__(self, store):
+        self.store = store
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def search(self, user_id, query, limit=None):
+        """Display names of the user's exercises matching ``query``, best match first; all of them if it's blank."""
+        revision = self.store.revision(user_id)
+        with self._lock:
+            index = self._indexes.setdefault(user_id, _UserExercises())
+            if index.revision != revision:
+                index.update(self.store.exercise_names(user_id))
+                index.revision = revision
+            return index.search(query, limit)
@@ -0,0 +1,712 @@
+"""Shared inference engine that batches generation requests from every session.
+
+Streamlit runs each browser session in its own script thread, but they all
+share the single model returned by ``load_model()``. Instead of letting those
+threads take turns calling ``generate``, every session submits its prompt to
+one ``InferenceEngine``. A background thread keeps a running batch of
+sequences and decodes them one token per step, admitting newly submitted
+requests between steps (continuous batching). Interactive requests are
+admitted ahead of background ones, a few batch slots are kept free for them,
+and queued or running requests can be cancelled or given a deadline.
+
+With a small ``draft_model`` that shares the tokenizer, the engine decodes
+speculatively instead: the draft proposes a few tokens, the main model
+scores them all in one forward pass, and each is accepted or resampled so
+that the output follows exactly the main model's distribution.
+"""
+import asyncio
+import heapq
+import itertools
+import queue
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import torch
+import torch.nn.functional as F
+from transformers import DynamicCache
+
+from metrics import REGISTRY
+
+# Same boundary the chat post-processing uses to count sentences
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+(?=[A-Z])')
+
+# Priority classes, most urgent first: chat turns someone is watching, then plans
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class EngineBusyError(RuntimeError):
+    """The queue for this priority class is full; retry later."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before it reached the model."""
+
+
+@dataclass
+class GenerationStats:
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    new_tokens: int = 0
+    time_to_first_token: float = 0.0
+    total_time: float = 0.0
+    # Waiting for a batch slot, then the prompt's forward pass
+    queue_time: float = 0.0
+    prefill_time: float = 0.0
+    # "eos", "length", "stop_sequence", "sentence_cap", "cancelled" or "deadline"
+    stop_reason: str = ""
+    # Tokens of the max_new_tokens budget left unused by an early stop
+    tokens_saved: int = 0
+    # Speculative decoding: tokens proposed by the draft model, and how many the main model kept
+    draft_tokens: int = 0
+    accepted_draft_tokens: int = 0
+
+    @property
+    def tokens_per_second(self):
+        return self.new_tokens / self.total_time if self.total_time > 0 else 0.0
+
+    @property
+    def acceptance_rate(self):
+        return self.accepted_draft_tokens / self.draft_tokens if self.draft_tokens else 0.0
+
+    @property
+    def decode_time(self):
+        return max(0.0, self.total_time - self.queue_time - self.prefill_time)
+
+
+@dataclass
+class SamplingParams:
+    max_new_tokens: int = 250
+    temperature: float = 0.7
+    top_p: float = 0.9
+    top_k: int = 0
+    do_sample: bool = True
+    repetition_penalty: float = 1.0
+    eos_token_id: int = None
+    # Halt as soon as the reply contains one of these strings...
+    stop_sequences: tuple = ()
+    # ...or starts a sentence past this many
+    max_sentences: int = None
+    # Grammar restricting which tokens may be sampled, e.g. plan_grammar.PlanGrammar
+    constraint: object = None
+
+
+class GenerationRequest:
+    """Handle returned by ``InferenceEngine.submit`` for one prompt."""
+
+    def __init__(self, prompt_ids, params, priority=INTERACTIVE, timeout=None):
+        self.prompt_ids = prompt_ids
+        self.params = params
+        self.priority = priority
+        self.stats = GenerationStats(prompt_tokens=len(prompt_ids))
+        self.text = ""
+        self.error = None
+        self.submitted_at = time.perf_counter()
+        self.deadline = self.submitted_at + timeout if timeout is not None else None
+        self.cancelled = False
+        # Set once the engine takes the request off the queue
+        self._started = False
+        self._lock = threading.Lock()
+        self._chunks = queue.Queue()
+        self._done = threading.Event()
+        # (event loop, asyncio.Event) of async consumers to wake on new chunks
+        self._waiters = []
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def stream(self, poll_interval=None):
+        """Yield pieces of the reply as the engine produces them.
+
+        With ``poll_interval``, an empty string is yielded whenever that many
+        seconds pass without one, e.g. while the request is queued, so the
+        caller gets a chance to give up.
+        """
+        while True:
+            try:
+                chunk = self._chunks.get(timeout=poll_interval)
+            except queue.Empty:
+                yield ""
+                continue
+            if chunk is None:
+                break
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+    async def astream(self, poll_interval=None):
+        """Like ``stream``, but waits on the event loop instead of blocking a thread."""
+        wakeup = asyncio.Event()
+        self._waiters.append((asyncio.get_running_loop(), wakeup))
+        while True:
+            try:
+                chunk = self._chunks.get_nowait()
+            except queue.Empty:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), poll_interval)
+                except TimeoutError:
+                    yield ""
+                    continue
+                wakeup.clear()
+                continue
+            if chunk is None:
+                break
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        """Stop generating; the reply so far is kept and the stream ends."""
+        with self._lock:
+            if self.cancelled or self.done:
+                return
+            self.cancelled = True
+            if self._started:
+                # The engine drops it before its next step
+                return
+            self._started = True
+        self.stats.stop_reason = "cancelled"
+        self._finish()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError("Generation did not finish in time")
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+    def _emit(self, text):
+        if not self.stats.time_to_first_token:
+            self.stats.time_to_first_token = time.perf_counter() - self.submitted_at
+        self.text += text
+        self._chunks.put(text)
+        self._notify()
+
+    def _finish(self, error=None):
+        self.error = error
+        self.stats.total_time = time.perf_counter() - self.submitted_at
+        self._done.set()
+        self._chunks.put(None)
+        self._notify()
+
+    def _notify(self):
+        for loop, wakeup in self._waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # The consumer's event loop has closed
+                pass
+
+
+class _Slot:
+    # One running sequence in the batch
+    def __init__(self, request):
+        self.request = request
+        self.token_ids = list(request.prompt_ids)
+        self.generated = []
+        # Position id of the next token fed to the model
+        self.position = len(request.prompt_ids)
+        self.finished = False
+        constraint = request.params.constraint
+        self.constraint_state = constraint.initial_state() if constraint is not None else None
+        # Per-sequence caches when decoding speculatively; the draft cache covers draft_len tokens
+        self.past = None
+        self.draft_past = None
+        self.draft_len = 0
+
+    @property
+    def next_token(self):
+        return self.generated[-1]
+
+
+def _cache_to_tuples(past):
+    if isinstance(past, tuple):
+        return past
+    if hasattr(past, "to_legacy_cache"):
+        return past.to_legacy_cache()
+    return tuple((layer.keys, layer.values) for layer in past.layers)
+
+
+def _tuples_to_cache(past):
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(past)
+    return DynamicCache(past)
+
+
+def _crop(past, length):
+    return tuple((k[:, :, :length], v[:, :, :length]) for k, v in past)
+
+
+def _left_pad(tensor, length, dim):
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    # F.pad takes (left, right) pairs starting from the last dimension
+    pad = [0, 0] * (tensor.dim() - dim - 1) + [missing, 0]
+    return F.pad(tensor, pad)
+
+
+class InferenceEngine:
+    def __init__(self, model, tokenizer, max_batch_size=8, prefix_cache=None,
+                 draft_model=None, num_draft_tokens=4, interactive_slots=2, max_queued=None,
+                 metrics=REGISTRY):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = prefix_cache
+        self.device = model.device
+        self.draft_model = draft_model
+        self.num_draft_tokens = num_draft_tokens
+        if draft_model is not None:
+            # Output layers are often padded past the tokenizer; compare only the shared ids
+            self._draft_vocab_size = min(model.config.vocab_size, draft_model.config.vocab_size)
+
+        # Batch slots background requests may not take, so a chat turn never waits for a plan
+        self.interactive_slots = min(interactive_slots, max_batch_size - 1)
+        # Queue-depth limit per priority class; submit() raises EngineBusyError beyond it
+        self.max_queued = max_queued or {INTERACTIVE: 64, BACKGROUND: 16}
+
+        # Heap of (priority, arrival order, request)
+        self._pending = []
+        self._pending_changed = threading.Condition()
+        self._arrivals = itertools.count()
+        self._active = []
+        # Batched key/value cache and attention mask for self._active, left-padded
+        self._past = None
+        self._attention_mask = None
+        # (timestamp, tokens) per decode step, for aggregate throughput
+        self._recent_steps = deque()
+        self.early_stops = 0
+        self.tokens_saved = 0
+        self.draft_tokens = 0
+        self.accepted_draft_tokens = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.deadlines_missed = 0
+        self._register_metrics(metrics)
+
+        self._thread = threading.Thread(target=self._run, name="inference-engine", daemon=True)
+        self._thread.start()
+
+    # ----------------- Public API -----------------
+    def submit(self, prompt=None, prompt_ids=None, priority=INTERACTIVE, timeout=None, **generate_kwargs):
+        """Queue a prompt, given as text or as already tokenized ``prompt_ids``.
+
+        ``timeout`` is in seconds from now: a request still queued by then
+        fails with ``DeadlineExceeded``, one already decoding stops there.
+        """
+        generate_kwargs.setdefault("eos_token_id", self.tokenizer.eos_token_id)
+        params = SamplingParams(**generate_kwargs)
+        if prompt_ids is None:
+            # The prompt already carries "<s>", so don't let the tokenizer add another
+            prompt_ids = self.tokenizer(prompt, add_special_tokens=False)["input_ids"]
+        request = GenerationRequest(list(prompt_ids), params, priority, timeout)
+        with self._pending_changed:
+            queued = sum(1 for p, _, r in self._pending if p == priority and not r.done)
+            if queued >= self.max_queued.get(priority, float("inf")):
+                self.rejected += 1
+                raise EngineBusyError(f"{queued} requests already queued at priority {priority}")
+            heapq.heappush(self._pending, (priority, next(self._arrivals), request))
+            self._pending_changed.notify()
+        return request
+
+    def generate(self, prompt, **generate_kwargs):
+        return self.submit(prompt, **generate_kwargs).result()
+
+    def tokens_per_second(self, window=10.0):
+        now = time.perf_counter()
+        tokens = sum(n for t, n in list(self._recent_steps) if now - t <= window)
+        return tokens / window
+
+    @property
+    def acceptance_rate(self):
+        return self.accepted_draft_tokens / self.draft_tokens if self.draft_tokens else 0.0
+
+    @property
+    def active_requests(self):
+        return len(self._active)
+
+    @property
+    def queued_requests(self):
+        return len(self._pending)
+
+    def _register_metrics(self, metrics):
+        self._step_seconds = metrics.histogram("inference_step_seconds", "Time per decode step")
+        self._batch_size = metrics.histogram(
+            "inference_batch_size", "Sequences per decode step", buckets=(1, 2, 4, 8, 16, 32)
+        )
+        metrics.gauge("inference_queued_requests", "Requests waiting for a batch slot") \
+            .set_function(lambda: self.queued_requests)
+        metrics.gauge("inference_active_requests", "Requests being decoded").set_function(lambda: self.active_requests)
+        metrics.gauge("inference_tokens_per_second", "Generated tokens/s over the last 10s") \
+            .set_function(self.tokens_per_second)
+        metrics.counter("inference_early_stops_total", "Replies halted by a stop sequence or sentence cap") \
+            .set_function(lambda: self.early_stops)
+        metrics.counter("inference_tokens_saved_total", "max_new_tokens left unused by early stops") \
+            .set_function(lambda: self.tokens_saved)
+        metrics.counter("inference_draft_tokens_total", "Tokens proposed by the draft model") \
+            .set_function(lambda: self.draft_tokens)
+        metrics.counter("inference_accepted_draft_tokens_total", "Draft tokens kept by the main model") \
+            .set_function(lambda: self.accepted_draft_tokens)
+        metrics.counter("inference_rejected_total", "Requests refused because their queue was full") \
+            .set_function(lambda: self.rejected)
+        metrics.counter("inference_cancelled_total", "Requests cancelled while decoding") \
+            .set_function(lambda: self.cancelled)
+        metrics.counter("inference_deadlines_missed_total", "Requests stopped or failed by their deadline") \
+            .set_function(lambda: self.deadlines_missed)
+        cache = self.prefix_cache
+        if cache is not None:
+            metrics.counter("prefix_cache_hits_total", "Prompts with a cached prefix").set_function(lambda: cache.hits)
+            metrics.counter("prefix_cache_misses_total", "Prompts without a cached prefix") \
+                .set_function(lambda: cache.misses)
+            metrics.counter("prefix_cache_reused_tokens_total", "Prompt tokens served from the prefix cache") \
+                .set_function(lambda: cache.reused_tokens)
+            metrics.gauge("prefix_cache_bytes", "Memory held by the prefix cache").set_function(lambda: cache.used_bytes)
+
+    # ----------------- Scheduler loop -----------------
+    def _run(self):
+        with torch.inference_mode():
+            while True:
+                self._admit()
+                self._expire()
+                if not self._active:
+                    continue
+                try:
+                    start = time.perf_counter()
+                    self._batch_size.observe(len(self._active))
+                    if self.draft_model is not None:
+                        self._speculative_step()
+                    else:
+                        self._decode_step()
+                    self._step_seconds.observe(time.perf_counter() - start)
+                except Exception as e:
+                    for slot in self._active:
+                        slot.request._finish(error=e)
+                    self._active = []
+                    self._past = None
+                    self._attention_mask = None
+
+    def _admit(self):
+        while len(self._active) < self.max_batch_size:
+            with self._pending_changed:
+                if not self._pending:
+                    if self._active:
+                        break
+                    # Block only when there is nothing to decode
+                    self._pending_changed.wait()
+                    continue
+                priority, _, request = self._pending[0]
+                if priority > INTERACTIVE:
+                    background = sum(1 for s in self._active if s.request.priority > INTERACTIVE)
+                    if background >= self.max_batch_size - self.interactive_slots:
+                        break
+                heapq.heappop(self._pending)
+            with request._lock:
+                if request.cancelled:
+                    continue
+                request._started = True
+            if request.deadline is not None and time.perf_counter() > request.deadline:
+                self.deadlines_missed += 1
+                request._finish(error=DeadlineExceeded("Deadline passed while queued"))
+                continue
+            try:
+                self._prefill(request)
+            except Exception as e:
+                request._finish(error=e)
+
+    def _expire(self):
+        # Drop cancelled and overdue sequences before spending another step on them
+        now = time.perf_counter()
+        keep = []
+        for i, slot in enumerate(self._active):
+            request = slot.request
+            if request.cancelled:
+                request.stats.stop_reason = "cancelled"
+                self.cancelled += 1
+            elif request.deadline is not None and now > request.deadline:
+                request.stats.stop_reason = "deadline"
+                self.deadlines_missed += 1
+            else:
+                keep.append(i)
+                continue
+            slot.finished = True
+            request._finish()
+        if len(keep) == len(self._active):
+            return
+        if self.draft_model is not None:
+            self._active = [self._active[i] for i in keep]
+        else:
+            self._select(keep)
+
+    def _prefill(self, request):
+        start = time.perf_counter()
+        request.stats.queue_time = start - request.submitted_at
+        slot = _Slot(request)
+        cached_len, cached_past = 0, None
+        if self.prefix_cache is not None:
+            cached_len, cached_past = self.prefix_cache.lookup(request.prompt_ids)
+        request.stats.cached_prompt_tokens = cached_len
+
+        # Only the part of the prompt that isn't cached needs a forward pass
+        input_ids = torch.tensor([request.prompt_ids[cached_len:]], device=self.device)
+        out = self.model(
+            input_ids=input_ids,
+            past_key_values=_tuples_to_cache(cached_past) if cached_past else None,
+            use_cache=True,
+        )
+        past = _cache_to_tuples(out.past_key_values)
+        if self.prefix_cache is not None:
+            self.prefix_cache.store(request.prompt_ids, past)
+
+        self._append_token(slot, out.logits[0, -1])
+        request.stats.prefill_time = time.perf_counter() - start
+        if slot.finished:
+            return
+        if self.draft_model is not None:
+            # Accepted run lengths differ per sequence, so each keeps its own cache
+            slot.past = past
+            self._active.append(slot)
+            return
+        mask = torch.ones((1, len(request.prompt_ids)), dtype=torch.long, device=self.device)
+        self._merge(slot, past, mask)
+
+    def _merge(self, slot, past, mask):
+        if self._past is None:
+            self._past, self._attention_mask = past, mask
+        else:
+            length = max(self._attention_mask.shape[1], mask.shape[1])
+            self._past = tuple(
+                (
+                    torch.cat([_left_pad(k, length, 2), _left_pad(new_k, length, 2)]),
+                    torch.cat([_left_pad(v, length, 2), _left_pad(new_v, length, 2)]),
+                )
+                for (k, v), (new_k, new_v) in zip(self._past, past)
+            )
+            self._attention_mask = torch.cat(
+                [_left_pad(self._attention_mask, length, 1), _left_pad(mask, length, 1)]
+            )
+        self._active.append(slot)
+
+    def _decode_step(self):
+        batch_size = len(self._active)
+        input_ids = torch.tensor([[s.next_token] for s in self._active], device=self.device)
+        position_ids = torch.tensor([[s.position] for s in self._active], device=self.device)
+        attention_mask = torch.cat(
+            [self._attention_mask, torch.ones((batch_size, 1), dtype=torch.long, device=self.device)],
+            dim=1,
+        )
+        out = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=_tuples_to_cache(self._past),
+            use_cache=True,
+        )
+        self._past = _cache_to_tuples(out.past_key_values)
+        self._attention_mask = attention_mask
+
+        keep = []
+        for i, slot in enumerate(self._active):
+            slot.position += 1
+            self._append_token(slot, out.logits[i, -1])
+            if not slot.finished:
+                keep.append(i)
+
+        self._recent_steps.append((time.perf_counter(), batch_size))
+        while len(self._recent_steps) > 1000:
+            self._recent_steps.popleft()
+
+        if len(keep) < batch_size:
+            self._select(keep)
+
+    def _select(self, keep):
+        # Drop finished rows, then trim padding columns no remaining row needs
+        self._active = [self._active[i] for i in keep]
+        if not keep:
+            self._past = None
+            self._attention_mask = None
+            return
+        index = torch.tensor(keep, device=self.device)
+        mask = self._attention_mask.index_select(0, index)
+        start = int(mask.any(dim=0).nonzero()[0])
+        self._attention_mask = mask[:, start:]
+        self._past = tuple(
+            (k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:])
+            for k, v in self._past
+        )
+
+    # ----------------- Speculative decoding -----------------
+    def _speculative_step(self):
+        produced = 0
+        for slot in self._active:
+            before = len(slot.generated)
+            self._speculate(slot)
+            produced += len(slot.generated) - before
+        self._recent_steps.append((time.perf_counter(), produced))
+        while len(self._recent_steps) > 1000:
+            self._recent_steps.popleft()
+        self._active = [slot for slot in self._active if not slot.finished]
+
+    def _speculate(self, slot):
+        request = slot.request
+        params = request.params
+        constraint = params.constraint
+        # The main model's cache holds every token but the last one sampled
+        start = len(slot.token_ids) - 1
+        num_draft = min(self.num_draft_tokens, params.max_new_tokens - len(slot.generated))
+
+        # Draft: propose tokens one at a time, first catching up on tokens it hasn't seen
+        context = list(slot.token_ids)
+        state = slot.constraint_state
+        drafted, draft_probs = [], []
+        for _ in range(num_draft):
+            out = self.draft_model(
+                input_ids=torch.tensor([context[slot.draft_len:]], device=self.draft_model.device),
+                past_key_values=_tuples_to_cache(slot.draft_past) if slot.draft_past else None,
+                use_cache=True,
+            )
+            slot.draft_past = _cache_to_tuples(out.past_key_values)
+            slot.draft_len = len(context)
+            q = self._token_probs(out.logits[0, -1, :self._draft_vocab_size], context, state, params)
+            token = int(torch.multinomial(q, 1))
+            drafted.append(token)
+            draft_probs.append(q)
+            if self._is_eos(token, params):
+                break
+            context.append(token)
+            if constraint is not None:
+                state = constraint.advance(state, token)
+
+        # Verify: one forward pass of the main model scores every drafted position
+        out = self.model(
+            input_ids=torch.tensor([[slot.next_token] + drafted], device=self.device),
+            past_key_values=_tuples_to_cache(slot.past),
+            use_cache=True,
+        )
+        logits = out.logits[0, :, :self._draft_vocab_size]
+        context = list(slot.token_ids)
+        state = slot.constraint_state
+        accepted, extra = [], None
+        for i, token in enumerate(drafted):
+            p = self._token_probs(logits[i], context, state, params).to(draft_probs[i].device)
+            q = draft_probs[i]
+            if torch.rand(()) * q[token] < p[token]:
+                # Accepted with probability min(1, p/q)
+                accepted.append(token)
+                context.append(token)
+                if constraint is not None:
+                    state = constraint.advance(state, token)
+                continue
+            # Rejected: resample from the part of p that q under-covers
+            residual = (p - q).clamp(min=0)
+            extra = int(torch.multinomial(residual if residual.sum() > 0 else p, 1))
+            break
+        else:
+            # Every draft was accepted, so the main model's last position yields one more token
+            if not (drafted and self._is_eos(drafted[-1], params)):
+                extra = self._sample(logits[len(drafted)], context, state, params)
+
+        request.stats.draft_tokens += len(drafted)
+        request.stats.accepted_draft_tokens += len(accepted)
+        self.draft_tokens += len(drafted)
+        self.accepted_draft_tokens += len(accepted)
+
+        # Drop cache entries for rejected drafts; the final token is fed next step
+        slot.past = _crop(_cache_to_tuples(out.past_key_values), start + 1 + len(accepted))
+        slot.draft_len = min(slot.draft_len, start + 1 + len(accepted))
+        slot.draft_past = _crop(slot.draft_past, slot.draft_len)
+        for token in accepted + ([extra] if extra is not None else []):
+            self._accept_token(slot, token)
+            if slot.finished:
+                break
+
+    # ----------------- Sampling -----------------
+    def _append_token(self, slot, logits):
+        token = self._sample(logits, slot.token_ids, slot.constraint_state, slot.request.params)
+        self._accept_token(slot, token)
+
+    def _accept_token(self, slot, token):
+        request = slot.request
+        params = request.params
+        if params.constraint is not None:
+            slot.constraint_state = params.constraint.advance(slot.constraint_state, token)
+
+        is_eos = self._is_eos(token, params)
+        stop_reason = "eos" if is_eos else None
+        if not is_eos:
+            slot.generated.append(token)
+            slot.token_ids.append(token)
+            request.stats.new_tokens += 1
+            text = self.tokenizer.decode(slot.generated, skip_special_tokens=True)
+            # Hold back incomplete multi-byte characters until the next token
+            if not text.endswith("�") and len(text) > len(request.text):
+                delta = text[len(request.text):]
+                request._emit(delta)
+                stop_reason = self._check_stop(request, delta)
+        if stop_reason is None and len(slot.generated) >= params.max_new_tokens:
+            stop_reason = "length"
+
+        if stop_reason is not None:
+            request.stats.stop_reason = stop_reason
+            if stop_reason in ("stop_sequence", "sentence_cap"):
+                request.stats.tokens_saved = params.max_new_tokens - len(slot.generated)
+                self.early_stops += 1
+                self.tokens_saved += request.stats.tokens_saved
+            slot.finished = True
+            request._finish()
+
+    def _check_stop(self, request, delta):
+        params = request.params
+        if params.stop_sequences:
+            # Only the tail can contain a match that wasn't there a token ago
+            longest = max(len(s) for s in params.stop_sequences)
+            tail = request.text[-(len(delta) + longest - 1):]
+            if any(s in tail for s in params.stop_sequences):
+                return "stop_sequence"
+        # A new sentence only starts with a capital letter
+        if params.max_sentences and any(c.isupper() for c in delta):
+            if len(SENTENCE_BOUNDARY.split(request.text.strip())) > params.max_sentences:
+                return "sentence_cap"
+        return None
+
+    @staticmethod
+    def _is_eos(token, params):
+        eos = params.eos_token_id
+        return token in eos if isinstance(eos, (list, tuple)) else token == eos
+
+    def _sample(self, logits, token_ids, constraint_state, params):
+        probs = self._token_probs(logits, token_ids, constraint_state, params)
+        if not params.do_sample:
+            return int(torch.argmax(probs))
+        return int(torch.multinomial(probs, 1))
+
+    def _token_probs(self, logits, token_ids, constraint_state, params):
+        # Next-token distribution after every logits processor; one-hot when greedy
+        logits = logits.float()
+        if params.repetition_penalty != 1.0:
+            seen = torch.tensor(token_ids, device=logits.device)
+            score = logits[seen]
+            logits[seen] = torch.where(
+                score < 0, score * params.repetition_penalty, score / params.repetition_penalty
+            )
+        if params.constraint is not None:
+            allowed = params.constraint.allowed_tokens(constraint_state, logits.shape[-1])
+            logits = logits.masked_fill(~allowed.to(logits.device), float("-inf"))
+        if not params.do_sample:
+            return F.one_hot(torch.argmax(logits), logits.shape[-1]).float()
+
+        logits = logits / max(params.temperature, 1e-5)
+        if params.top_k:
+            kth = torch.topk(logits, min(params.top_k, logits.shape[-1])).values[-1]
+            logits[logits < kth] = float("-inf")
+        if params.top_p < 1.0:
+            sorted_logits, order = torch.sort(logits, descending=True)
+            probs = torch.softmax(sorted_logits, dim=-1)
+            remove = torch.cumsum(probs, dim=-1) - probs > params.top_p
+            sorted_logits[remove] = float("-inf")
+            logits = torch.full_like(logits, float("-inf")).scatter(0, order, sorted_logits)
+        return torch.softmax(logits, dim=-1)
@@ -0,0 +1,233 @@
+"""Fast-path answers to questions about the user's own workout log.
+
+"What's my bench PR", "how much volume did I do this week" and "when did I
+last squat" are lookups, not coaching. The model only sees the last five
+workouts and takes seconds to reply, so these used to be slow and often
+wrong. ``IntentRouter.answer`` recognises them with a few patterns and
+answers from ``WorkoutStore`` in milliseconds. Only questions about the
+user's own log ("my", "did I", "this week") are routed, and coaching
+phrasing ("should", "need", "a beginner") never is. Anything it isn't sure
+about returns ``None`` and goes to the model. Every routed turn is counted in
+``chat_turns_total{route}``.
+"""
+import re
+from datetime import date, timedelta
+
+from metrics import REGISTRY
+
+# Asking for advice about a number ("how do I increase my bench PR", "how many rest days do I
+# need") is coaching
+COACHING_PATTERN = re.compile(
+    r"\b(how (can|could|do|should|to)|why|should|improve|increase|boost|break|beat|plan|program"
+    r"|routine|tips?|advice|help me|recommend(ed)?|need|beginners?|good|rest|normal|average|typical|ideal"
+    r"|enough|safe|a week|per week|a day|per day)\b"
+)
+# Only questions about the user's own log are answered from it; "how many days a week" isn't one
+OWN_LOG_PATTERN = re.compile(
+    r"\b(my|mine|did i|have i|i've|i have|i last|was i|am i|i did|i (lifted|trained|logged|worked out|went|hit)"
+    r"|(this|last) (week|month|year)|today|yesterday|so far)\b"
+)
+PR_PATTERN = re.compile(
+    r"\b(prs?|personal (best|record)s?|max(es)?|heaviest|best (lift|weight|set)s?|one rep max|1rm)\b"
+)
+VOLUME_PATTERN = re.compile(r"\b(volume|tonnage|total weight|how much (weight )?(did i )?(lift|move)(ed)?)\b")
+LAST_PATTERN = re.compile(r"\b(when did i last|when was (my|the) last|last time i|when did i (do|train) .* last)\b")
+STREAK_PATTERN = re.compile(r"\b(streaks?|in a row|consecutive|straight days)\b")
+COUNT_PATTERN = re.compile(r"\bhow many (workouts|sessions|days|times)\b")
+# Without a known exercise, only answer when the question is clearly about everything
+ALL_PRS_PATTERN = re.compile(r"\b(prs|records|bests|maxes|all)\b")
+ANY_WORKOUT_PATTERN = re.compile(r"\b(work ?out|workouts|worked out|train|trained|training|gym|session|lift|lifted)\b")
+
+WORD = re.compile(r"[a-z0-9]+")
+# Filler that also turns up in exercise names ("Farmer's Walk", "Clean and Jerk")
+STOPWORDS = {
+    "a", "an", "and", "at", "did", "do", "for", "i", "in", "is", "my", "of", "on", "s", "the", "to", "what", "with",
+}
+MAX_LISTED_PRS = 5
+
+
+def _stem(word):
+    # Just enough to match "squatted", "squats" and "benching" to the logged name
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[: -len(suffix)]
+            break
+    if len(word) > 3 and word[-1] == word[-2]:
+        word = word[:-1]
+    return word
+
+
+def _stems(text):
+    return {_stem(w) for w in WORD.findall(text.lower()) if w not in STOPWORDS}
+
+
+# Words many exercises share; "press" alone doesn't say which press
+GENERIC_STEMS = _stems("press row curl raise extension fly pull push up down dumbbell barbell cable machine")
+
+
+def match_exercise(question, exercises):
+    """The logged exercise the question names, or ``None``.
+
+    Every word of the name counts; "bench" finds "Bench Press", and the
+    shortest name wins a tie so it doesn't pick "Incline Bench Press".
+    """
+    words = _stems(question)
+    best, best_key = None, None
+    for exercise in exercises:
+        names = _stems(exercise)
+        shared = names & words
+        full = shared == names
+        if not shared or (not full and shared <= GENERIC_STEMS):
+            continue
+        key = (full, len(shared), -len(names))
+        if best_key is None or key > best_key:
+            best, best_key = exercise, key
+    return best
+
+
+def parse_period(question, today):
+    """``(start, end, label)`` for the time range a question asks about; all time if none."""
+    q = question.lower()
+    monday = today - timedelta(days=today.weekday())
+    first_of_month = today.replace(day=1)
+    days = re.search(r"\b(?:last|past) (\d+) days\b", q)
+    if days:
+        n = max(int(days.group(1)), 1)
+        return today - timedelta(days=n - 1), today, f"in the last {n} days"
+    if "today" in q:
+        return today, today, "today"
+    if "yesterday" in q:
+        yesterday = today - timedelta(days=1)
+        return yesterday, yesterday, "yesterday"
+    if "last week" in q:
+        return monday - timedelta(days=7), monday - timedelta(days=1), "last week"
+    if "week" in q:
+        return monday, today, "this week"
+    if "last month" in q:
+        end = first_of_month - timedelta(days=1)
+        return end.replace(day=1), end, "last month"
+    if "month" in q:
+        return first_of_month, today, "this month"
+    if "year" in q:
+        return today.replace(month=1, day=1), today, "this year"
+    return None, None, "in total"
+
+
+def _plural(n, word):
+    return f"{n} {word}" if n == 1 else f"{n} {word}s"
+
+
+def _days_ago(day, today):
+    delta = (today - date.fromisoformat(day)).days
+    if delta == 0:
+        return "today"
+    if delta == 1:
+        return "yesterday"
+    return f"{delta} days ago"
+
+
+def _describe_sets(workouts, with_exercise):
+    parts = []
+    for w in workouts:
+        sets = f"{w.sets} × {w.reps} at {w.weight} lbs"
+        parts.append(f"{w.exercise} {sets}" if with_exercise else sets)
+    return ", ".join(parts)
+
+
+class IntentRouter:
+    def __init__(self, store, metrics=REGISTRY):
+        self.store = store
+        self._turns = metrics.counter("chat_turns_total", "Chat turns by route: fast_path (workout data) or llm")
+        metrics.gauge(
+            "chat_fast_path_fraction", "Fraction of chat turns answered from workout data"
+        ).set_function(self.fast_path_fraction)
+
+    def fast_path_fraction(self):
+        fast, llm = self._turns.value(route="fast_path"), self._turns.value(route="llm")
+        return fast / (fast + llm) if fast + llm else 0.0
+
+    def answer(self, user_id, question, today=None):
+        """Answer ``question`` from the log, or return ``None`` to send it to the model."""
+        reply = self._route(user_id, question, today or date.today())
+        self._turns.inc(route="llm" if reply is None else "fast_path")
+        return reply
+
+    def _route(self, user_id, question, today):
+        q = question.lower()
+        if COACHING_PATTERN.search(q) or not OWN_LOG_PATTERN.search(q):
+            return None
+        if LAST_PATTERN.search(q):
+            intent = self._last_session
+        elif PR_PATTERN.search(q):
+            intent = self._personal_record
+        elif VOLUME_PATTERN.search(q):
+            intent = self._volume
+        elif STREAK_PATTERN.search(q):
+            intent = self._streak
+        elif COUNT_PATTERN.search(q):
+            intent = self._count
+        else:
+            return None
+
+        records = self.store.personal_records(user_id)
+        if not records:
+            return "You haven't logged any workouts yet. Add some in the Workout Log tab and I can answer from them."
+        exercise = match_exercise(q, records)
+        return intent(user_id, q, exercise, records, today)
+
+    def _personal_record(self, user_id, q, exercise, records, today):
+        if exercise is not None:
+            pr = records[exercise]
+            return (
+                f"Your {exercise} PR is {pr['weight']} lbs ({pr['sets']} × {pr['reps']}), "
+                f"set on {pr['date']}."
+            )
+        if not ALL_PRS_PATTERN.search(q):
+            return None
+        ranked = sorted(records.items(), key=lambda item: item[1]["weight"], reverse=True)
+        listed = "; ".join(f"{name}: {pr['weight']} lbs ({pr['date']})" for name, pr in ranked[:MAX_LISTED_PRS])
+        more = len(ranked) - MAX_LISTED_PRS
+        return f"Your personal records — {listed}." + (
+            f" Plus {more} more in the Achievements tab." if more > 0 else ""
+        )
+
+    def _volume(self, user_id, q, exercise, records, today):
+        start, end, label = parse_period(q, today)
+        totals = self.store.totals(user_id, start and start.isoformat(), end and end.isoformat(), exercise)
+        what = f"{exercise} " if exercise else ""
+        if not totals["workouts"]:
+            return f"You haven't logged any {what}workouts {label}."
+        return (
+            f"Your {what}volume {label} is {totals['volume']:,} lbs (sets × reps × weight) across "
+            f"{_plural(totals['workouts'], 'workout')} on {_plural(totals['days'], 'day')}."
+        )
+
+    def _count(self, user_id, q, exercise, records, today):
+        start, end, label = parse_period(q, today)
+        totals = self.store.totals(user_id, start and start.isoformat(), end and end.isoformat(), exercise)
+        if exercise:
+            return f"You did {exercise} on {_plural(totals['days'], 'day')} {label}."
+        return (
+            f"You logged {_plural(totals['workouts'], 'workout')} on {_plural(totals['days'], 'day')} {label}, "
+            f"{totals['completed']} of them completed."
+        )
+
+    def _streak(self, user_id, q, exercise, records, today):
+        # Streaks are counted over training days, not per exercise
+        if exercise is not None:
+            return None
+        streaks = self.store.streaks(user_id, today.isoformat())
+        longest = f"Your longest is {_plural(streaks['longest'], 'day')}."
+        if not streaks["current"]:
+            return f"You're not on a streak right now; train today to start one. {longest}"
+        return f"You're on a {streaks['current']}-day streak. {longest}"
+
+    def _last_session(self, user_id, q, exercise, records, today):
+        if exercise is None and not ANY_WORKOUT_PATTERN.search(q):
+            return None
+        workouts = self.store.last_session(user_id, exercise)
+        day = workouts[0].date
+        when = f"{day} ({_days_ago(day, today)})"
+        if exercise:
+            return f"You last did {exercise} on {when}: {_describe_sets(workouts, with_exercise=False)}."
+        return f"Your last workout was on {when}: {_describe_sets(workouts, with_exercise=True)}."
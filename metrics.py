@@ -0,0 +1,217 @@
+"""In-process metrics: counters, gauges and histograms with label sets.
+
+Every stage of a chat reply or workout plan (prompt building, cache lookup,
+queueing, prefill, decode, post-processing, the Streamlit rerun) is timed
+into ``stage_seconds``; token counts, cache hits and queue depth sit next
+to it. ``REGISTRY`` is the process-wide registry. It can be scraped as
+Prometheus text over HTTP (``start_http_server``) or appended to a JSONL
+file as periodic snapshots (``start_jsonl_writer``).
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Seconds; wide enough for a 7B model's slowest plan
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, lock):
+        self.name = name
+        self.help = help
+        self._lock = lock
+        # label key -> value (or histogram state)
+        self._values = {}
+        self._function = None
+
+    def set_function(self, fn):
+        """Read the value from ``fn()`` at export time instead of storing it."""
+        self._function = fn
+        return self
+
+    def samples(self):
+        if self._function is not None:
+            return [((), float(self._function()))]
+        with self._lock:
+            return list(self._values.items())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def value(self, **labels):
+        if self._function is not None:
+            return self._function()
+        return self._values.get(_label_key(labels), 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, lock, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, lock)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, the last one for +Inf
+                state = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            i = 0
+            while i < len(self.buckets) and value > self.buckets[i]:
+                i += 1
+            state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def samples(self):
+        with self._lock:
+            return [(key, {**state, "counts": list(state["counts"])}) for key, state in self._values.items()]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, threading.Lock(), **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help=""):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help=""):
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help="", buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    @contextmanager
+    def span(self, path, stage):
+        """Time the enclosed block into ``stage_seconds{path, stage}``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(path, stage, time.perf_counter() - start)
+
+    def observe_stage(self, path, stage, seconds):
+        self.histogram("stage_seconds", "Time spent per request stage").observe(seconds, path=path, stage=stage)
+
+    # ----------------- Export -----------------
+    def prometheus_text(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key, value in metric.samples():
+                if metric.kind != "histogram":
+                    lines.append(f"{metric.name}{_format_labels(key)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), value["counts"]):
+                    cumulative += count
+                    lines.append(f"{metric.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{metric.name}_sum{_format_labels(key)} {value['sum']}")
+                lines.append(f"{metric.name}_count{_format_labels(key)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        metrics = []
+        for metric in list(self._metrics.values()):
+            entry = {"name": metric.name, "type": metric.kind, "samples": []}
+            if metric.kind == "histogram":
+                entry["buckets"] = list(metric.buckets)
+            for key, value in metric.samples():
+                entry["samples"].append({"labels": dict(key), "value": value})
+            metrics.append(entry)
+        return {"timestamp": time.time(), "metrics": metrics}
+
+    def write_jsonl(self, path):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+
+REGISTRY = MetricsRegistry()
+
+
+def start_http_server(port, registry=REGISTRY, host="0.0.0.0"):
+    """Serve ``registry`` as Prometheus text at ``/metrics`` on a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def start_jsonl_writer(path, interval=60.0, registry=REGISTRY):
+    """Append a snapshot of ``registry`` to ``path`` every ``interval`` seconds."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                registry.write_jsonl(path)
+            except OSError as e:
+                logger.warning("Couldn't write metrics to %s: %s", path, e)
+
+    threading.Thread(target=run, name="metrics-jsonl", daemon=True).start()
+    return stop
@@ -0,0 +1,223 @@
+"""Loading the quantized coach model, optionally in the background.
+
+Quantizing the full-precision checkpoint to 4-bit on every start is slow and
+briefly needs a lot of memory, so the quantized weights and tokenizer are
+saved once to a local artifact directory keyed by model name and
+quantization config. Later starts load that artifact directly; safetensors
+files are memory-mapped. Build the artifact ahead of time during deployment
+with::
+
+    python model_loader.py build
+
+Passing ``draft_model_name``, a small causal LM that shares the main model's
+tokenizer, to ``load_engine`` turns on speculative decoding (see ``inference.py``).
+``load_engines`` also loads ``small_model_name``, a much smaller chat model
+with its own engine that answers the simple chat turns (see ``coach.py``).
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+
+from inference import InferenceEngine
+from metrics import MetricsRegistry
+from prefix_cache import PrefixCache
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.3"
+ARTIFACT_DIR = os.environ.get(
+    "MODEL_ARTIFACT_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "ai-fitness-assistant", "models"),
+)
+# Written last, so a half-saved artifact is never loaded
+COMPLETE_MARKER = "artifact_complete.json"
+
+
+def quantization_config():
+    return BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.float16,
+    )
+
+
+def artifact_path(model_name, bnb_config, artifact_dir=ARTIFACT_DIR):
+    config_json = json.dumps(bnb_config.to_dict(), sort_keys=True, default=str)
+    config_hash = hashlib.sha256(config_json.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(artifact_dir, f"{model_name.replace('/', '--')}-{config_hash}")
+
+
+def has_artifact(path):
+    return os.path.exists(os.path.join(path, COMPLETE_MARKER))
+
+
+def quantize_from_hub(model_name, bnb_config):
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        quantization_config=bnb_config,
+        device_map="auto",
+        trust_remote_code=True
+    )
+    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+    return model, tokenizer
+
+
+def save_artifact(model, tokenizer, path, model_name):
+    tmp_path = f"{path}.partial"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    model.save_pretrained(tmp_path, safe_serialization=True)
+    tokenizer.save_pretrained(tmp_path)
+    with open(os.path.join(tmp_path, COMPLETE_MARKER), "w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name, "created_at": time.time()}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def load_model_and_tokenizer(model_name=MODEL_NAME, artifact_dir=ARTIFACT_DIR, use_artifact=True):
+    bnb_config = quantization_config()
+    path = artifact_path(model_name, bnb_config, artifact_dir)
+    if use_artifact and has_artifact(path):
+        # The saved config.json already carries the quantization config
+        model = AutoModelForCausalLM.from_pretrained(path, device_map="auto", trust_remote_code=True)
+        tokenizer = AutoTokenizer.from_pretrained(path, trust_remote_code=True)
+    else:
+        model, tokenizer = quantize_from_hub(model_name, bnb_config)
+        if use_artifact:
+            try:
+                save_artifact(model, tokenizer, path, model_name)
+            except OSError as e:
+                # A read-only or full disk shouldn't stop the app from starting
+                logger.warning("Couldn't save model artifact to %s: %s", path, e)
+    tokenizer.pad_token = tokenizer.eos_token
+    return model, tokenizer
+
+
+def load_draft_model(draft_model_name, tokenizer):
+    draft_tokenizer = AutoTokenizer.from_pretrained(draft_model_name, trust_remote_code=True)
+    if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+        raise ValueError(f"Draft model {draft_model_name} doesn't share the main model's tokenizer")
+    # Small enough to keep in half precision; quantizing it would only cost acceptance rate
+    return AutoModelForCausalLM.from_pretrained(
+        draft_model_name,
+        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+        device_map="auto",
+        trust_remote_code=True,
+    ).eval()
+
+
+def load_engine(model_name=MODEL_NAME, draft_model_name=None, num_draft_tokens=4):
+    model, tokenizer = load_model_and_tokenizer(model_name)
+    draft_model = load_draft_model(draft_model_name, tokenizer) if draft_model_name else None
+    # One engine per server process: every session's requests are batched together.
+    # Prompt prefixes (instructions, profile context) are prefilled once and reused.
+    return InferenceEngine(
+        model,
+        tokenizer,
+        prefix_cache=PrefixCache(max_bytes=1 << 30),
+        draft_model=draft_model,
+        num_draft_tokens=num_draft_tokens,
+    )
+
+
+def load_small_engine(model_name):
+    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # Small enough to keep in half precision next to the quantized main model
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+        device_map="auto",
+        trust_remote_code=True,
+    ).eval()
+    # Its engine gauges would replace the main engine's in the shared registry;
+    # per-tier latency and usage are recorded by CoachService instead
+    return InferenceEngine(model, tokenizer, prefix_cache=PrefixCache(max_bytes=1 << 28), metrics=MetricsRegistry())
+
+
+def load_engines(model_name=MODEL_NAME, draft_model_name=None, num_draft_tokens=4, small_model_name=None):
+    """The main engine and the small-tier engine, or ``None`` without ``small_model_name``."""
+    engine = load_engine(model_name, draft_model_name, num_draft_tokens)
+    small_engine = load_small_engine(small_model_name) if small_model_name else None
+    return engine, small_engine
+
+
+class BackgroundLoader:
+    """Run ``load_fn`` on a background thread and expose its readiness."""
+
+    def __init__(self, load_fn, *args, **kwargs):
+        self.value = None
+        self.error = None
+        self.started_at = time.perf_counter()
+        self.load_time = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(
+            target=self._load, args=(load_fn, args, kwargs), name="model-loader", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def ready(self):
+        return self._ready.is_set() and self.error is None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    @property
+    def elapsed(self):
+        return self.load_time if self.load_time is not None else time.perf_counter() - self.started_at
+
+    def wait(self, timeout=None):
+        self._ready.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def _load(self, load_fn, args, kwargs):
+        try:
+            self.value = load_fn(*args, **kwargs)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.load_time = time.perf_counter() - self.started_at
+            self._ready.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or check the pre-quantized model artifact.")
+    parser.add_argument("command", choices=["build", "load"],
+                        help="build: quantize and save the artifact; load: time loading it")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--artifact-dir", default=ARTIFACT_DIR)
+    args = parser.parse_args()
+
+    path = artifact_path(args.model, quantization_config(), args.artifact_dir)
+    if args.command == "build":
+        start = time.perf_counter()
+        model, tokenizer = quantize_from_hub(args.model, quantization_config())
+        quantize_time = time.perf_counter() - start
+        save_artifact(model, tokenizer, path, args.model)
+        print(f"Quantized {args.model} in {quantize_time:.1f}s, saved to {path} "
+              f"in {time.perf_counter() - start - quantize_time:.1f}s")
+        del model
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    elif not has_artifact(path):
+        parser.exit(1, f"No artifact at {path}; run 'python model_loader.py build' first\n")
+
+    start = time.perf_counter()
+    load_model_and_tokenizer(args.model, args.artifact_dir)
+    print(f"Loaded artifact from {path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
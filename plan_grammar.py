@@ -0,0 +1,296 @@
+"""Constrained decoding for "Generate Plan".
+
+The plan generator used to free-write its lines, and "Add This Plan to
+Workout Log" scraped them back out, asking the user to regenerate when
+that failed. ``PlanGrammar`` instead restricts sampling, token by token,
+to lines of the form::
+
+    Barbell Squat | 3 sets | 8 reps | 135 lbs | Keep your chest up
+
+with integer sets, reps and weight, and ends the plan after 3-4 of them.
+The model can't write a preamble, so every plan parses on the first try.
+
+The grammar is a small automaton over characters, and ``_step`` only
+tells ASCII characters apart, so its transitions fit a table over a few
+hundred states and about a hundred character classes. An allowed-token
+mask walks every token through that table at once, one character position
+per tensor lookup. ``warm_up`` computes the masks of every reachable state
+in batches when the service starts, in about a second at 32k tokens and
+mostly outside the GIL, so the engine thread never stalls on a new state.
+"""
+import threading
+from collections import deque
+
+import torch
+
+# One line of the plan, as (kind, argument) segments:
+# name text, a literal separator, an integer with at most N digits, or tip text
+LINE_SEGMENTS = [
+    ("name", None),
+    ("lit", "| "),
+    ("int", 2),
+    ("lit", " sets | "),
+    ("int", 2),
+    ("lit", " reps | "),
+    ("int", 4),
+    ("lit", " lbs | "),
+    ("tip", None),
+]
+TIP_SEGMENT = len(LINE_SEGMENTS) - 1
+NAME_MAX_CHARS = 40
+TIP_MAX_CHARS = 60
+NAME_PUNCTUATION = set(" -()'/")
+# State once the last allowed line is finished: only EOS may follow
+DONE = "done"
+# States whose masks are computed together by warm_up; bounds the (states, vocab) tensors
+WARM_UP_BATCH = 32
+
+
+class PlanGrammar:
+    def __init__(self, tokenizer, min_exercises=3, max_exercises=4):
+        self.tokenizer = tokenizer
+        self.min_exercises = min_exercises
+        self.max_exercises = max_exercises
+        self.eos_token_id = tokenizer.eos_token_id
+        self._token_strings = None
+        self._max_token_chars = 0
+        # Automaton state -> row of _transitions, whose columns are character classes
+        self._state_index = None
+        self._transitions = None
+        # Token ids, longest string first, and the rank of each id in that order
+        self._tokens_by_length = None
+        self._token_rank = None
+        # (max token chars, vocab) character class at each position of the tokens in that order,
+        # and how many of them are longer than each position
+        self._token_classes = None
+        self._tokens_longer_than = None
+        self._strings_lock = threading.Lock()
+        # Allowed-token masks, keyed by a state summary that ignores irrelevant counters
+        self._masks = {}
+
+    @property
+    def max_new_tokens(self):
+        """Tokens enough for the longest plan plus EOS; every allowed token adds at least one character."""
+        literals = sum(len(arg) for kind, arg in LINE_SEGMENTS if kind == "lit")
+        digits = sum(arg for kind, arg in LINE_SEGMENTS if kind == "int")
+        # A name may close with one space past its limit; a tip ends with a newline
+        line = NAME_MAX_CHARS + 1 + literals + digits + TIP_MAX_CHARS + 1
+        return self.max_exercises * line + 1
+
+    # A state is (line, segment, chars consumed in the segment, previous char was a space)
+    def initial_state(self):
+        return (0, 0, 0, False)
+
+    def advance(self, state, token_id):
+        if token_id == self.eos_token_id:
+            return state
+        return self._walk(state, self._strings()[token_id])
+
+    def allowed_tokens(self, state, vocab_size):
+        mask = self._mask(state)
+        if vocab_size > len(mask):
+            mask = torch.cat([mask, torch.zeros(vocab_size - len(mask), dtype=torch.bool)])
+        return mask[:vocab_size]
+
+    def warm_up(self):
+        """Compute the mask of every reachable state, nearest the start of a plan first."""
+        states = self._reachable_states()
+        for start in range(0, len(states), WARM_UP_BATCH):
+            batch = states[start:start + WARM_UP_BATCH]
+            for state, mask in zip(batch, self._compute_masks(batch)):
+                self._masks.setdefault(self._mask_key(state), mask)
+
+    def warm_up_in_background(self):
+        thread = threading.Thread(target=self.warm_up, name="plan-grammar-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def _mask(self, state):
+        # The key depends on the longest token, known once the strings are
+        self._strings()
+        key = self._mask_key(state)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._compute_masks([state])[0]
+            # Both threads may compute the same mask; either copy is correct
+            self._masks[key] = mask
+        return mask
+
+    def _compute_masks(self, states):
+        # Walk every token from each state at once, one character position per lookup;
+        # tokens are ordered longest first, so each position only touches a prefix of them
+        num_classes = self._transitions.shape[1]
+        transitions = self._transitions.flatten()
+        current = torch.tensor([self._state_index[state] for state in states])
+        current = current[:, None].repeat(1, len(self._tokens_by_length))
+        for position, count in enumerate(self._tokens_longer_than):
+            walking = current[:, :count]
+            current[:, :count] = transitions[walking * num_classes + self._token_classes[position, :count]]
+        # Empty strings never move, so they end where they started; they're never allowed
+        allowed = current != len(self._state_index)
+        allowed[:, self._tokens_longer_than[0]:] = False
+        masks = allowed[:, self._token_rank]
+        masks[:, self.eos_token_id] = torch.tensor([self._can_end(state) for state in states])
+        return list(masks)
+
+    def _reachable_states(self):
+        # Breadth-first order (the automaton's), one state per mask key
+        self._strings()
+        seen_keys = set()
+        states = []
+        for state in self._state_index:
+            key = self._mask_key(state)
+            if key not in seen_keys:
+                seen_keys.add(key)
+                states.append(state)
+        return states
+
+    # ----------------- Automaton -----------------
+    def _can_end(self, state):
+        return state == DONE or (state[1:3] == (0, 0) and state[0] >= self.min_exercises)
+
+    def _walk(self, state, text):
+        for ch in text:
+            state = self._step(state, ch)
+            if state is None:
+                return None
+        return state
+
+    def _step(self, state, ch):
+        if state == DONE:
+            return None
+        line, segment, n, prev_space = state
+        kind, arg = LINE_SEGMENTS[segment]
+
+        if kind == "name":
+            if ch == "|":
+                # The name ends with the space before the separator
+                return (line, segment + 1, 1, False) if n >= 2 and prev_space else None
+            if ch == " " and n > 0 and not prev_space:
+                # Always allowed, so a name at the length limit can still close
+                return (line, segment, n + 1, True)
+            if n >= NAME_MAX_CHARS:
+                return None
+            if ch.isalpha() and ch.isascii():
+                return (line, segment, n + 1, False)
+            if ch in NAME_PUNCTUATION and ch != " " and n > 0:
+                return (line, segment, n + 1, False)
+            return None
+
+        if kind == "lit":
+            if ch != arg[n]:
+                return None
+            if n + 1 == len(arg):
+                return (line, segment + 1, 0, False)
+            return (line, segment, n + 1, False)
+
+        if kind == "int":
+            if ch.isdigit() and ch.isascii():
+                return (line, segment, n + 1, False) if n < arg else None
+            # The following separator starts the moment the digits stop
+            following = LINE_SEGMENTS[segment + 1][1]
+            if n > 0 and ch == following[0]:
+                return (line, segment + 1, 1, False)
+            return None
+
+        # Tip: free text up to the end of the line
+        if ch == "\n":
+            if n == 0:
+                return None
+            if line + 1 == self.max_exercises:
+                return DONE
+            return (line + 1, 0, 0, False)
+        if ch == "|" or not ch.isprintable() or n >= TIP_MAX_CHARS:
+            return None
+        return (line, segment, n + 1, False)
+
+    def _mask_key(self, state):
+        if state == DONE:
+            return state
+        line, segment, n, prev_space = state
+        kind = LINE_SEGMENTS[segment][0]
+        # Only tokens that can reach the end of a line care which line it is
+        line_key = line if segment == TIP_SEGMENT or (segment, n) == (0, 0) else None
+        if kind in ("name", "tip"):
+            limit = NAME_MAX_CHARS if kind == "name" else TIP_MAX_CHARS
+            # Lengths well inside the limit all allow exactly the same tokens
+            if 2 <= n < limit - self._max_token_chars:
+                n = "mid"
+        return (line_key, segment, n, prev_space)
+
+    def _strings(self):
+        with self._strings_lock:
+            if self._token_strings is None:
+                self._build_strings()
+        return self._token_strings
+
+    @staticmethod
+    def _char_class(ch):
+        # _step tells non-ASCII characters apart only by whether they're printable
+        if ch.isascii():
+            return ch
+        return "printable" if ch.isprintable() else "other"
+
+    def _build_automaton(self, representatives):
+        # Every state reachable from the start, breadth-first, and its row of transitions
+        start = self.initial_state()
+        self._state_index = {start: 0}
+        queue = deque([start])
+        rows = []
+        while queue:
+            state = queue.popleft()
+            row = []
+            for ch in representatives:
+                following = self._step(state, ch)
+                if following is not None and following not in self._state_index:
+                    self._state_index[following] = len(self._state_index)
+                    queue.append(following)
+                row.append(-1 if following is None else self._state_index[following])
+            rows.append(row)
+        # Rejected characters lead to a dead state that nothing leaves
+        dead = len(rows)
+        self._transitions = torch.tensor(rows + [[dead] * len(representatives)], dtype=torch.long)
+        self._transitions[self._transitions < 0] = dead
+
+    def _build_strings(self):
+        tokenizer = self.tokenizer
+        # Decode each token after a fixed anchor so leading spaces survive
+        anchor = tokenizer("a", add_special_tokens=False)["input_ids"][-1]
+        prefix = tokenizer.decode([anchor], clean_up_tokenization_spaces=False)
+        decoded = tokenizer.batch_decode(
+            [[anchor, token_id] for token_id in range(len(tokenizer))],
+            clean_up_tokenization_spaces=False,
+        )
+        special = set(tokenizer.all_special_ids)
+        strings = []
+        for token_id, text in enumerate(decoded):
+            text = text[len(prefix):] if text.startswith(prefix) else ""
+            # Special tokens and partial UTF-8 bytes never fit the grammar
+            if token_id in special or "�" in text:
+                text = ""
+            strings.append(text)
+        class_ids = {}
+        representatives = []
+        for text in strings:
+            for ch in text:
+                key = self._char_class(ch)
+                if key not in class_ids:
+                    class_ids[key] = len(representatives)
+                    representatives.append(ch)
+        self._build_automaton(representatives)
+        self._max_token_chars = max(len(text) for text in strings)
+        by_length = sorted(range(len(strings)), key=lambda token_id: -len(strings[token_id]))
+        self._tokens_by_length = torch.tensor(by_length)
+        self._token_rank = torch.argsort(self._tokens_by_length)
+        # Positions past a token's end are never read
+        pad = [0] * self._max_token_chars
+        self._token_classes = torch.tensor(
+            [([class_ids[self._char_class(ch)] for ch in strings[token_id]] + pad)[:self._max_token_chars]
+             for token_id in by_length],
+            dtype=torch.long,
+        ).T.contiguous()
+        lengths = torch.tensor([len(strings[token_id]) for token_id in by_length])
+        self._tokens_longer_than = [
+            int((lengths > position).sum()) for position in range(self._max_token_chars)
+        ]
+        self._token_strings = strings
@@ -0,0 +1,96 @@
+"""LRU cache of attention key/values for prompt prefixes.
+
+Chat prompts all start with the same instructions and, within one
+conversation, the same profile context. The cache keeps the key/value
+tensors for those prefixes so prefill only has to run over the new suffix.
+
+Prompts are split into fixed-size token blocks. Each block is stored under
+a hash of the whole token prefix ending with it, so two prompts share
+cached blocks for exactly as long as their tokens agree.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+import torch
+
+
+class PrefixCache:
+    def __init__(self, max_bytes=1 << 30, block_size=32):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        # prefix hash -> per-layer (key, value) tensors for that block
+        self._blocks = OrderedDict()
+        self._lock = Lock()
+
+    def _block_hashes(self, token_ids):
+        hashes = []
+        prefix_hash = None
+        for start in range(0, len(token_ids) - self.block_size + 1, self.block_size):
+            prefix_hash = hash((prefix_hash, tuple(token_ids[start:start + self.block_size])))
+            hashes.append(prefix_hash)
+        return hashes
+
+    def lookup(self, token_ids):
+        """Return ``(length, past)`` for the longest cached prefix of ``token_ids``.
+
+        At least one token is always left uncached so the caller still gets
+        logits for the last prompt position. ``past`` is None on a miss.
+        """
+        with self._lock:
+            blocks = []
+            for prefix_hash in self._block_hashes(token_ids[:-1]):
+                block = self._blocks.get(prefix_hash)
+                if block is None:
+                    break
+                blocks.append((prefix_hash, block))
+
+            if not blocks:
+                self.misses += 1
+                return 0, None
+
+            # Touch longer prefixes first so shorter ones are evicted last
+            for prefix_hash, _ in reversed(blocks):
+                self._blocks.move_to_end(prefix_hash)
+            self.hits += 1
+            length = len(blocks) * self.block_size
+            self.reused_tokens += length
+
+        layers = zip(*(block for _, block in blocks))
+        past = tuple(
+            (torch.cat([k for k, _ in layer], dim=2), torch.cat([v for _, v in layer], dim=2))
+            for layer in layers
+        )
+        return length, past
+
+    def store(self, token_ids, past):
+        """Cache every complete block of ``token_ids`` from a batch-of-one ``past``."""
+        with self._lock:
+            for i, prefix_hash in enumerate(self._block_hashes(token_ids)):
+                if prefix_hash in self._blocks:
+                    continue
+                start, end = i * self.block_size, (i + 1) * self.block_size
+                # Copy so the block doesn't keep the whole prefill tensor alive
+                block = tuple(
+                    (k[:, :, start:end].clone(), v[:, :, start:end].clone()) for k, v in past
+                )
+                self._blocks[prefix_hash] = block
+                self.used_bytes += _block_bytes(block)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.used_bytes = 0
+
+    def _evict(self):
+        while self.used_bytes > self.max_bytes and self._blocks:
+            _, block = self._blocks.popitem(last=False)
+            self.used_bytes -= _block_bytes(block)
+
+
+def _block_bytes(block):
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in block)
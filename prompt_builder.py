@@ -0,0 +1,258 @@
+"""Token-budgeted chat prompts assembled from cached token IDs.
+
+Chat context used to be picked by fixed counts (the last 6 messages), so
+one long message could blow up the prompt while short conversations left
+context unused, and the whole prompt was re-tokenized every turn.
+``PromptBuilder`` measures every segment with the model's tokenizer,
+caches the token IDs of each message and system prompt, and fills the
+budget with as much history as fits, newest first. The token IDs go
+straight to the engine, so nothing is tokenized twice.
+
+Each segment after the first is encoded as it reads mid-prompt, after a
+fixed anchor, so SentencePiece tokenizers don't start it with an extra
+word-start "▁" and the IDs match tokenizing the whole prompt at once.
+
+Models other than Mistral get their own chat template instead, through
+``build_template_prompt``.
+"""
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from jinja2 import TemplateError
+
+MAX_PROMPT_TOKENS = 1536
+# Text every mid-prompt segment is encoded after; newlines don't merge with the word that follows
+ANCHOR = "\n"
+WORD_THEN_SPACE = re.compile(r"\S\s")
+# Stands in for the system prompt and question when measuring a chat template turn
+PLACEHOLDER = "-"
+
+
+@dataclass
+class BuiltPrompt:
+    text: str
+    token_ids: list
+    # The history lines that made it into the prompt, oldest first
+    history: list = field(default_factory=list)
+
+    @property
+    def history_text(self):
+        return "\n".join(self.history)
+
+
+def _exchanges(messages):
+    # (user, assistant) pairs from (role, message) history, so roles alternate
+    turns = []
+    for role, message in messages:
+        role = "user" if role == "user" else "assistant"
+        if turns and turns[-1][0] == role:
+            turns[-1] = (role, f"{turns[-1][1]}\n\n{message}")
+        else:
+            turns.append((role, message))
+    if turns and turns[0][0] == "assistant":
+        turns = turns[1:]
+    # A last user message without a reply is dropped, so the question follows an assistant turn
+    return [(turns[i][1], turns[i + 1][1]) for i in range(0, len(turns) - 1, 2)]
+
+
+def _longest_prefix(pieces, fits):
+    # The most leading pieces that fit, by binary search
+    low, high = 0, len(pieces)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(pieces[:middle]):
+            low = middle
+        else:
+            high = middle - 1
+    return pieces[:low]
+
+
+class PromptBuilder:
+    def __init__(self, tokenizer, max_prompt_tokens=MAX_PROMPT_TOKENS, cache_size=8192):
+        self.tokenizer = tokenizer
+        self.max_prompt_tokens = max_prompt_tokens
+        # Keyed by segment text: messages, system prompts (one per profile snapshot) and fixed glue
+        self.encode = lru_cache(maxsize=cache_size)(self._encode)
+        self.encode_mid = lru_cache(maxsize=cache_size)(self._encode_mid)
+        # Keyed by (user, assistant) message pair, for chat templates
+        self.exchange_cost = lru_cache(maxsize=cache_size)(self._exchange_cost)
+        self._anchor_ids = self._encode(ANCHOR)
+        self.exact_segments = self._check_segments()
+
+    def _encode(self, text):
+        return tuple(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _encode_mid(self, text):
+        # Encoded on its own, text gets a word-start "▁" from SentencePiece tokenizers that it
+        # doesn't get mid-prompt, so encode it after the anchor and drop the anchor's IDs
+        ids = self._encode(ANCHOR + text)
+        if ids[:len(self._anchor_ids)] != self._anchor_ids:
+            # The tokenizer merged the anchor into the text
+            return self._encode(text)
+        return ids[len(self._anchor_ids):]
+
+    def _decode_mid(self, ids):
+        text = self.tokenizer.decode(list(self._anchor_ids) + list(ids), clean_up_tokenization_spaces=False)
+        return text[len(ANCHOR):] if text.startswith(ANCHOR) else text.lstrip()
+
+    def _check_segments(self):
+        # Segments start at a space or newline, so encoding them apart gives the IDs of the whole
+        # prompt unless some token runs from a word into the whitespace after it
+        decoded = self.tokenizer.batch_decode(
+            [list(self._anchor_ids) + [token_id] for token_id in range(len(self.tokenizer))],
+            clean_up_tokenization_spaces=False,
+        )
+        return not any(WORD_THEN_SPACE.search(text[len(ANCHOR):]) for text in decoded)
+
+    def _ids(self, text, segments):
+        # A tokenizer with merges across segment boundaries gets the whole prompt tokenized
+        return list(segments) if self.exact_segments else list(self._encode(text))
+
+    def count(self, text):
+        return len(self.encode(text))
+
+    def build_chat_prompt(self, system_prompt, messages, question):
+        """Build the chat prompt for ``question`` from ``(role, message)`` history.
+
+        A prompt over budget without any history keeps the start of the
+        system prompt and of the question, the question up to half the
+        budget, so put the context that matters least at the end of the
+        system prompt.
+        """
+        question = question.strip()
+        # Every segment after the header starts with the space or newline before its first word
+        header = self.encode(f"<s>[INST] {system_prompt}")
+        history_open = self.encode_mid("\n\nPrevious conversation:")
+        question_open = self.encode_mid("\n\nCurrent question:")
+        footer = self.encode_mid(" [/INST]")
+        question_ids = self.encode_mid(f" {question}")
+
+        # Without history the question follows the system prompt directly
+        alone_ids = self.encode_mid(f"\n\n{question}")
+        room = self.max_prompt_tokens - len(footer)
+        if len(header) + len(alone_ids) > room:
+            header_room = room - min(len(alone_ids), room // 2)
+            if len(header) > header_room:
+                system_prompt = self._fit_system_prompt(system_prompt, header_room)
+                header = self.encode(f"<s>[INST] {system_prompt}")
+            # Cut where the room ends, then encode what the text will say: a cut can end in a space or part of a character
+            question = self._decode_mid(alone_ids[:max(0, room - len(header))]).rstrip("\ufffd").strip()
+            alone_ids = self.encode_mid(f"\n\n{question}")
+            text = f"<s>[INST] {system_prompt}\n\n{question} [/INST]"
+            return BuiltPrompt(text, self._ids(text, header + alone_ids + footer))
+
+        # Newest first, stopping at the first message that doesn't fit
+        budget = self.max_prompt_tokens - len(header) - len(history_open) - len(question_open) \
+            - len(question_ids) - len(footer)
+        history = []
+        history_ids = []
+        for role, message in reversed(messages):
+            line = f"{'User' if role == 'user' else 'Assistant'}: {message}"
+            line_ids = self.encode_mid(f"\n{line}")
+            if len(line_ids) > budget:
+                break
+            budget -= len(line_ids)
+            history.append(line)
+            history_ids.append(line_ids)
+        history.reverse()
+        history_ids.reverse()
+
+        if not history:
+            text = f"<s>[INST] {system_prompt}\n\n{question} [/INST]"
+            return BuiltPrompt(text, self._ids(text, header + alone_ids + footer))
+
+        segments = list(header + history_open)
+        for line_ids in history_ids:
+            segments.extend(line_ids)
+        segments.extend(question_open + question_ids + footer)
+        history_text = "\n".join(history)
+        text = f"<s>[INST] {system_prompt}\n\nPrevious conversation:\n{history_text}\n\nCurrent question: {question} [/INST]"
+        return BuiltPrompt(text, self._ids(text, segments), history)
+
+    def _fit_system_prompt(self, system_prompt, room):
+        # The most leading words of the system prompt whose header fits in room tokens
+        words = _longest_prefix(
+            system_prompt.split(" "), lambda words: len(self._encode(f"<s>[INST] {' '.join(words)}")) <= room,
+        )
+        return " ".join(words)
+
+    def build_template_prompt(self, system_prompt, messages, question):
+        """Like ``build_chat_prompt``, in the tokenizer's own chat template.
+
+        History goes in as alternating user and assistant turns, which
+        strict templates require: consecutive messages from one role are
+        merged, and a leading assistant message or a last user message
+        without a reply is left out. A tokenizer without a template gets
+        Mistral's format.
+        """
+        if not getattr(self.tokenizer, "chat_template", None):
+            return self.build_chat_prompt(system_prompt, messages, question)
+        question = question.strip()
+        text = self._render(system_prompt, [], question)
+        if len(self._encode(text)) > self.max_prompt_tokens:
+            system_prompt, question = self._fit_template_prompt(system_prompt, question)
+            text = self._render(system_prompt, [], question)
+            return BuiltPrompt(text, list(self._encode(text)))
+
+        # Newest first, stopping at the first exchange that doesn't fit
+        budget = self.max_prompt_tokens - len(self._encode(text))
+        kept = []
+        for exchange in reversed(_exchanges(messages)):
+            cost = self.exchange_cost(*exchange)
+            if cost > budget:
+                break
+            budget -= cost
+            kept.insert(0, exchange)
+        # Templates that render a turn differently by position can run over the measured cost
+        while True:
+            turns = [turn for user, assistant in kept for turn in (("user", user), ("assistant", assistant))]
+            text = self._render(system_prompt, turns, question)
+            token_ids = list(self._encode(text))
+            if len(token_ids) <= self.max_prompt_tokens or not kept:
+                break
+            kept.pop(0)
+        history = [f"{'User' if role == 'user' else 'Assistant'}: {message}" for role, message in turns]
+        return BuiltPrompt(text, token_ids, history)
+
+    def _exchange_cost(self, user, assistant):
+        # Tokens one exchange adds to a rendered prompt, measured around placeholder turns
+        bare = self._render(PLACEHOLDER, [], PLACEHOLDER)
+        rendered = self._render(PLACEHOLDER, [("user", user), ("assistant", assistant)], PLACEHOLDER)
+        return len(self._encode(rendered)) - self.count(bare)
+
+    def _fit_template_prompt(self, system_prompt, question):
+        # As in build_chat_prompt: the start of the system prompt, and of the question up to half the budget
+        question_ids = self.encode(question)
+        bare = self.count(self._render("", [], ""))
+        room = self.max_prompt_tokens - bare
+        system_room = room - min(len(question_ids), room // 2)
+        words = _longest_prefix(
+            system_prompt.split(" "),
+            lambda words: len(self._encode(self._render(" ".join(words), [], ""))) - bare <= system_room,
+        )
+        system_prompt = " ".join(words)
+        ids = _longest_prefix(
+            question_ids,
+            lambda ids: len(self._encode(self._render(system_prompt, [], self._decode(ids)))) <= self.max_prompt_tokens,
+        )
+        return system_prompt, self._decode(ids)
+
+    def _decode(self, ids):
+        # A cut can end in a space or part of a character
+        return self.tokenizer.decode(list(ids), clean_up_tokenization_spaces=False).rstrip("\ufffd").strip()
+
+    def _render(self, system_prompt, messages, question):
+        turns = [
+            {"role": "user" if role == "user" else "assistant", "content": message} for role, message in messages
+        ]
+        turns.append({"role": "user", "content": question})
+        try:
+            return self.tokenizer.apply_chat_template(
+                [{"role": "system", "content": system_prompt}] + turns, tokenize=False, add_generation_prompt=True,
+            )
+        except TemplateError:
+            # Templates without a system role get the instructions in the first user turn
+            first = next(i for i, turn in enumerate(turns) if turn["role"] == "user")
+            turns[first] = {**turns[first], "content": f"{system_prompt}\n\n{turns[first]['content']}"}
+            return self.tokenizer.apply_chat_template(turns, tokenize=False, add_generation_prompt=True)
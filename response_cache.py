@@ -0,0 +1,135 @@
+"""Cache of finished chat replies and workout plans.
+
+Many users ask the same questions with the same profile and workout
+context. Replies are cached under a hash of the normalized question and
+that context, expire after a TTL, and are evicted least-recently-used once
+the cache is full. The cache can optionally be persisted to a JSON file so
+it survives server restarts. The file is rewritten by a background thread
+every ``save_interval`` seconds when something changed, and once more at
+exit, so replies never wait on disk.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+SAVE_INTERVAL = 30.0
+
+
+def normalize_question(question):
+    question = question.lower()
+    question = re.sub(r"[^\w\s]", " ", question)
+    return " ".join(question.split())
+
+
+class ResponseCache:
+    def __init__(self, ttl=6 * 60 * 60, max_entries=1024, path=None, save_interval=SAVE_INTERVAL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        # key -> (stored_at, response)
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        # Changed since the file was last written
+        self._dirty = False
+        # Serializes file writes; the entry lock is only held to copy the entries
+        self._save_lock = Lock()
+        self._stop = threading.Event()
+        if path:
+            if os.path.exists(path):
+                self._load()
+            threading.Thread(
+                target=self._autosave, args=(save_interval,), name="response-cache-writer", daemon=True
+            ).start()
+            atexit.register(self.close)
+
+    @staticmethod
+    def make_key(kind, question, *context):
+        payload = json.dumps([kind, normalize_question(question), *context])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, response):
+        with self._lock:
+            self._entries[key] = (time.time(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def flush(self):
+        """Write the cache to ``path`` now if it changed since the last write."""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = [[key, stored_at, response] for key, (stored_at, response) in self._entries.items()]
+                self._dirty = False
+            try:
+                self._save(entries)
+            except OSError as e:
+                self._dirty = True
+                logger.warning("Couldn't write the response cache to %s: %s", self.path, e)
+
+    def close(self):
+        """Stop the background writer after a final flush."""
+        self._stop.set()
+        self.flush()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, stored_at, response in entries:
+            if now - stored_at <= self.ttl:
+                self._entries[key] = (stored_at, response)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _autosave(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def _save(self, entries):
+        # Write to a temp file first so a crash never leaves a truncated cache
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,188 @@
+"""Headless HTTP API for chat replies and workout plans.
+
+Serves the same ``CoachService`` as the Streamlit app, on one shared engine,
+so the coach can be load-tested, put behind other clients, and scaled
+apart from the UI. Generation runs on the engine's thread, prompt building
+and post-processing on worker threads, and replies are streamed from the
+event loop, so one worker holds many connections::
+
+    python server.py --port 8000
+    FITNESS_API_URL=http://localhost:8000 streamlit run app.py
+
+``POST /chat`` and ``POST /plan`` stream newline-delimited JSON: one
+``{"text": ...}`` line per chunk, then ``{"done": true, "response": ...,
+"cached": ..., "tier": ..., "stats": ...}`` with the cleaned reply. A
+blank line is sent each ``KEEPALIVE_INTERVAL`` seconds nothing else is, e.g.
+while a plan waits behind chats. Send ``"stream": false`` to get only the
+final object. Closing the connection cancels the generation; a full queue
+answers 429.
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from coach import CHAT_TIMEOUT, PLAN_TIMEOUT, service_from_env
+from inference import EngineBusyError
+from metrics import REGISTRY
+from model_loader import MODEL_NAME, BackgroundLoader, load_engines
+from workout_store import Workout
+
+# Seconds between blank lines while no text is generated, so clients waiting on the stream can give up
+KEEPALIVE_INTERVAL = 1.0
+
+
+class Profile(BaseModel):
+    name: str = ""
+    age: str = ""
+    weight: str = ""
+    height: str = ""
+    fitness_goal: str = ""
+    experience_level: str = ""
+    injuries: str = ""
+    preferences: str = ""
+
+
+class ChatRequest(BaseModel):
+    question: str
+    profile: Profile = Field(default_factory=Profile)
+    # Workout log rows, most relevant first: date, exercise, sets, reps, weight.
+    # As many as fit the context budget are used.
+    workouts: list[Workout] = []
+    # (role, message) pairs before the question; role is "user" or "bot"
+    messages: list[tuple[str, str]] = []
+    stream: bool = True
+    use_cache: bool = True
+    # Seconds, queueing included
+    timeout: float = CHAT_TIMEOUT
+
+
+class PlanRequest(BaseModel):
+    request: str
+    profile: Profile = Field(default_factory=Profile)
+    workouts: list[Workout] = []
+    stream: bool = True
+    use_cache: bool = True
+    timeout: float = PLAN_TIMEOUT
+
+
+class _Coach:
+    # The engine loads in the background; the service is built once it's ready
+    def __init__(self):
+        self.loader = None
+        self._service = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.loader = BackgroundLoader(
+            load_engines,
+            os.environ.get("MODEL_NAME", MODEL_NAME),
+            draft_model_name=os.environ.get("DRAFT_MODEL") or None,
+            num_draft_tokens=int(os.environ.get("NUM_DRAFT_TOKENS", 4)),
+            small_model_name=os.environ.get("SMALL_MODEL") or None,
+        )
+
+    @property
+    def service(self):
+        if self._service is None:
+            if self.loader.failed:
+                raise HTTPException(503, f"Model failed to load: {self.loader.error}")
+            if not self.loader.ready:
+                raise HTTPException(503, "Model is still loading", headers={"Retry-After": "5"})
+            with self._lock:
+                if self._service is None:
+                    self._service = service_from_env(*self.loader.value)
+        return self._service
+
+
+coach = _Coach()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    coach.start()
+    yield
+
+
+app = FastAPI(title="AI Fitness Assistant", lifespan=lifespan)
+
+
+async def _respond(start_turn, stream):
+    try:
+        # Context retrieval, tokenization and the cache lookup block, so they run on a worker thread
+        turn = await asyncio.to_thread(start_turn)
+    except EngineBusyError as e:
+        raise HTTPException(429, str(e), headers={"Retry-After": "2"})
+
+    if not stream:
+        try:
+            async for _ in turn:
+                pass
+        except TimeoutError as e:
+            raise HTTPException(504, str(e))
+        return JSONResponse(turn.to_dict())
+
+    async def events():
+        try:
+            async for text in turn.astream(KEEPALIVE_INTERVAL):
+                yield json.dumps({"text": text}) + "\n" if text else "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e), "type": type(e).__name__}) + "\n"
+            return
+        finally:
+            # Runs when the client disconnects mid-stream too
+            turn.cancel()
+        yield json.dumps({"done": True, **turn.to_dict()}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.post("/chat")
+async def chat(body: ChatRequest):
+    return await _respond(lambda: coach.service.chat(
+        body.profile.model_dump(), body.workouts, body.messages, body.question,
+        use_cache=body.use_cache, timeout=body.timeout,
+    ), body.stream)
+
+
+@app.post("/plan")
+async def plan(body: PlanRequest):
+    return await _respond(lambda: coach.service.plan(
+        body.profile.model_dump(), body.workouts, body.request,
+        use_cache=body.use_cache, timeout=body.timeout,
+    ), body.stream)
+
+
+@app.get("/health")
+async def health():
+    loader = coach.loader
+    if not loader.ready:
+        return {"ready": False, "elapsed": loader.elapsed, "error": str(loader.error) if loader.failed else None}
+    # The first call builds the service
+    status = await asyncio.to_thread(lambda: coach.service.status())
+    return {**status, "elapsed": loader.elapsed, "error": None}
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the coach's chat and plan generation over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    # A single process: the model and its batch are shared by every connection
+    uvicorn.run(app, host=args.host, port=args.port, workers=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import pytest
+
+from benchmark import tiny_tokenizer
+
+CORPUS = [
+    "Barbell Squat | 3 sets | 8 reps | 135 lbs | Keep your chest up",
+    "Bench Press | 4 sets | 6 reps | 185 lbs | Pause briefly on the chest",
+    "Romanian Deadlift | 3 sets | 10 reps | 155 lbs | Push your hips back",
+    "How much did I bench last week? What should I train today?",
+    "You are a fitness coach. Keep answers short and specific.",
+]
+
+
+@pytest.fixture(scope="session")
+def byte_tokenizer():
+    """One token per byte, as in ``benchmark``."""
+    return tiny_tokenizer()
+
+
+@pytest.fixture(scope="session")
+def sentencepiece_tokenizer():
+    """A small BPE tokenizer with Mistral's "▁" word prefix and multi-character tokens."""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    backend = Tokenizer(models.BPE(unk_token="<unk>", byte_fallback=True))
+    backend.pre_tokenizer = pre_tokenizers.Metaspace(prepend_scheme="always")
+    backend.decoder = decoders.Sequence([
+        decoders.Metaspace(prepend_scheme="always"), decoders.ByteFallback(), decoders.Fuse(),
+    ])
+    byte_tokens = [f"<0x{b:02X}>" for b in range(256)]
+    trainer = trainers.BpeTrainer(
+        vocab_size=600, special_tokens=["<unk>", "<s>", "</s>", "[INST]", "[/INST]"] + byte_tokens,
+    )
+    backend.train_from_iterator(CORPUS * 20, trainer)
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, bos_token="<s>", eos_token="</s>", unk_token="<unk>",
+        additional_special_tokens=["[INST]", "[/INST]"],
+    )
+    tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from analytics import MAX_E1RM_REPS, LogAnalytics, WorkoutAnalytics, estimated_1rm
+from workout_store import Workout, WorkoutStore
+
+
+@pytest.mark.parametrize("formula", ["epley", "brzycki"])
+def test_single_rep_is_its_own_max(formula):
+    assert estimated_1rm([225], [1], formula)[0] == 225
+
+
+def test_high_rep_sets_are_not_estimated():
+    # Brzycki would put 30 reps at 100 lbs at a 514 lb max
+    e1rm = estimated_1rm([100, 100], [MAX_E1RM_REPS, 30], "brzycki")
+    assert e1rm[0] == pytest.approx(100 * 36 / (37 - MAX_E1RM_REPS))
+    assert np.isnan(e1rm[1])
+
+
+def test_unknown_formula():
+    with pytest.raises(ValueError):
+        estimated_1rm([100], [5], "lombardi")
+
+
+def test_e1rm_leaves_out_high_rep_sets_but_frequency_counts_them():
+    analytics = LogAnalytics(
+        ["2026-03-02", "2026-03-02", "2026-03-04", "2026-03-10"],
+        ["Squat", "Squat", "Squat", "squats"],
+        [3, 3, 3, 3],
+        [5, 30, 20, 3],
+        [200, 100, 135, 220],
+    )
+    dates, best, pr = analytics.e1rm("Squat")
+    assert list(dates.astype(str)) == ["2026-03-02", "2026-03-10"]
+    assert best == pytest.approx([200 * (1 + 5 / 30), 220 * (1 + 3 / 30)])
+    assert pr == pytest.approx(best)
+    weeks, frequency = analytics.frequency("Squat")
+    assert list(weeks.astype(str)) == ["2026-03-02", "2026-03-09"]
+    assert list(frequency) == [2, 1]
+
+
+def test_running_pr_never_drops():
+    analytics = LogAnalytics(
+        ["2026-03-02", "2026-03-04", "2026-03-06"], ["Bench Press"] * 3, [3] * 3, [5] * 3, [200, 180, 210]
+    )
+    _, best, pr = analytics.e1rm("Bench Press")
+    assert list(pr) == pytest.approx([best[0], best[0], best[2]])
+
+
+def test_exercises_are_labelled_by_their_record_name(tmp_path):
+    store = WorkoutStore(str(tmp_path / "w.db"))
+    for name, weight in [("Bench", 185), ("bench press", 205), ("Squat", 275)]:
+        store.add("alice", Workout(date="2026-03-02", exercise=name, sets=3, reps=5, weight=weight))
+    names = store.exercise_names("alice")
+    assert names["bench press"] == "bench press"
+    # Not "Bench", the first spelling in alphabetical order
+    analytics = WorkoutAnalytics(store).for_user("alice")
+    assert sorted(analytics.exercises()) == ["Squat", "bench press"]
+    assert analytics.e1rm("bench press")[1] == pytest.approx([205 * (1 + 5 / 30)])
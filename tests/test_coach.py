@@ -0,0 +1,47 @@
+import pytest
+
+from coach import RoutingPolicy, chat_tier, clean_chat_response, max_sentences_for
+
+
+@pytest.mark.parametrize("question", ["hi", "Hey coach!", "thanks, got it", "ok cool thanks!", "Good morning",
+                                      "How are you doing today?", "bye"])
+def test_greetings_and_acknowledgements_go_to_the_small_model(question):
+    assert chat_tier(question) == "small"
+
+
+@pytest.mark.parametrize("question", [
+    "Which grip is best for bench?",
+    "I don't know how to brace for squats",
+    "What is my best lift?",
+    "hi, how do I deadlift without back pain?",
+    "Is this form ok?",
+    "thanks! what should I eat after training?",
+])
+def test_questions_go_to_the_large_model(question):
+    assert chat_tier(question) == "large"
+
+
+@pytest.mark.parametrize("question", ["What does RPE stand for?", "What is a deload?", "How old am I?",
+                                      "Which muscles does the squat work?"])
+def test_short_factual_questions_go_to_the_small_model(question):
+    assert chat_tier(question) == "small"
+    assert chat_tier(question, RoutingPolicy(max_words=0)) == "large"
+
+
+def test_routing_patterns_are_configurable():
+    policy = RoutingPolicy(small_patterns=(r"\bmacros?\b",), large_patterns=(r"\bdeload\b",))
+    assert chat_tier("What are macros for cutting exactly?", policy) == "small"
+    assert chat_tier("What is a deload?", policy) == "large"
+    assert chat_tier("thanks!", RoutingPolicy(max_words=0)) == "small"
+
+
+def test_brevity_cap_matches_whole_words():
+    assert max_sentences_for("hi there") == 2
+    assert max_sentences_for("Thanks!") == 2
+    assert max_sentences_for("Which muscles does this work?") == 5
+    assert max_sentences_for("I know nothing about the snatch") == 5
+
+
+def test_clean_chat_response_trims_echoes_and_stop_patterns():
+    raw = "How do I squat? Keep your chest up. Brace hard.\nUser: next"
+    assert clean_chat_response(raw, "How do I squat?") == "Keep your chest up. Brace hard."
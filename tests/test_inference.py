@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+import torch
+
+from benchmark import tiny_model
+from inference import GenerationRequest, InferenceEngine, SamplingParams
+from metrics import MetricsRegistry
+from plan_grammar import DONE, PlanGrammar
+from prefix_cache import PrefixCache
+
+PROMPTS = ["<s>[INST] What should I train today? [/INST]", "<s>[INST] Hi [/INST]"]
+MAX_NEW_TOKENS = 24
+
+
+@pytest.fixture(scope="module")
+def model(byte_tokenizer):
+    return tiny_model(byte_tokenizer)
+
+
+@pytest.fixture(scope="module")
+def draft_model(byte_tokenizer):
+    return tiny_model(byte_tokenizer, hidden_size=32, num_layers=1, seed=1)
+
+
+def make_engine(model, tokenizer, **kwargs):
+    return InferenceEngine(model, tokenizer, metrics=MetricsRegistry(), **kwargs)
+
+
+def reference(model, tokenizer, prompt):
+    prompt_ids = tokenizer(prompt, add_special_tokens=False, return_tensors="pt").input_ids
+    with torch.inference_mode():
+        output = model.generate(
+            prompt_ids, max_new_tokens=MAX_NEW_TOKENS, do_sample=False,
+            eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id,
+        )
+    text = tokenizer.decode(output[0, prompt_ids.shape[1]:], skip_special_tokens=True)
+    # The engine holds back a character whose bytes are still incomplete when it stops
+    return text.rstrip("\ufffd")
+
+
+def greedy(engine, prompt):
+    return engine.submit(prompt, max_new_tokens=MAX_NEW_TOKENS, do_sample=False).result(timeout=60)
+
+
+@pytest.mark.parametrize("prompt", PROMPTS)
+def test_greedy_output_matches_model_generate(model, byte_tokenizer, prompt):
+    engine = make_engine(model, byte_tokenizer)
+    assert greedy(engine, prompt) == reference(model, byte_tokenizer, prompt)
+
+
+@pytest.mark.parametrize("prompt", PROMPTS)
+def test_speculative_decoding_keeps_greedy_output(model, draft_model, byte_tokenizer, prompt):
+    engine = make_engine(model, byte_tokenizer, draft_model=draft_model, num_draft_tokens=4)
+    assert greedy(engine, prompt) == reference(model, byte_tokenizer, prompt)
+    assert engine.draft_tokens > 0
+
+
+def test_batched_requests_match_single_ones(model, byte_tokenizer):
+    engine = make_engine(model, byte_tokenizer)
+    requests = [engine.submit(p, max_new_tokens=MAX_NEW_TOKENS, do_sample=False) for p in PROMPTS * 2]
+    outputs = [request.result(timeout=60) for request in requests]
+    assert outputs == [reference(model, byte_tokenizer, p) for p in PROMPTS * 2]
+
+
+def test_prefix_cached_prompt_matches_model_generate(model, byte_tokenizer):
+    engine = make_engine(model, byte_tokenizer, prefix_cache=PrefixCache(block_size=8))
+    greedy(engine, PROMPTS[0])
+    assert greedy(engine, PROMPTS[0]) == reference(model, byte_tokenizer, PROMPTS[0])
+    assert engine.prefix_cache.hits == 1
+
+
+def test_constrained_output_follows_the_grammar(model, byte_tokenizer):
+    engine = make_engine(model, byte_tokenizer)
+    grammar = PlanGrammar(byte_tokenizer, min_exercises=1, max_exercises=1)
+    request = engine.submit(
+        PROMPTS[0], max_new_tokens=grammar.max_new_tokens, do_sample=True, constraint=grammar,
+    )
+    text = request.result(timeout=120)
+    assert grammar._walk(grammar.initial_state(), text) == DONE
+
+
+def test_cancel_keeps_the_reply_so_far(model, byte_tokenizer):
+    engine = make_engine(model, byte_tokenizer)
+    request = engine.submit(PROMPTS[0], max_new_tokens=2000, do_sample=False, eos_token_id=-1)
+    next(request.stream())
+    request.cancel()
+    text = request.result(timeout=60)
+    assert request.stats.stop_reason == "cancelled"
+    assert 0 < len(text) < 2000
+
+
+def test_polled_streams_yield_empty_text_while_queued():
+    request = GenerationRequest([1, 2], SamplingParams())
+    chunks = request.stream(poll_interval=0.01)
+    assert next(chunks) == ""
+    request.cancel()
+    assert list(chunks) == []
+
+    async def first_chunk():
+        request = GenerationRequest([1, 2], SamplingParams())
+        return await anext(request.astream(poll_interval=0.01))
+
+    assert asyncio.run(first_chunk()) == ""
@@ -0,0 +1,71 @@
+from datetime import date
+
+import pytest
+
+from intents import IntentRouter, match_exercise, parse_period
+from metrics import MetricsRegistry
+from workout_store import Workout, WorkoutStore
+
+TODAY = date(2026, 3, 11)
+EMPTY_LOG = "You haven't logged any workouts yet"
+
+
+@pytest.fixture
+def store():
+    store = WorkoutStore(":memory:")
+    store.add_many("alice", [
+        Workout("2026-03-02", "Bench Press", 3, 5, 185, completed=True),
+        Workout("2026-03-09", "Squat", 5, 5, 225, completed=True),
+        Workout("2026-03-10", "Bench Press", 3, 5, 195),
+        Workout("2026-03-10", "Leg Press", 3, 10, 300),
+    ])
+    return store
+
+
+def answer(store, question, user_id="alice"):
+    return IntentRouter(store, metrics=MetricsRegistry()).answer(user_id, question, today=TODAY)
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("What's my bench PR?", "Your Bench Press PR is 195 lbs (3 × 5), set on 2026-03-10."),
+    ("When did I last squat?", "You last did Squat on 2026-03-09 (2 days ago): 5 × 5 at 225 lbs."),
+    ("How much volume did I do this week?",
+     "Your volume this week is 17,550 lbs (sets × reps × weight) across 3 workouts on 2 days."),
+    ("How many workouts have I done this week?", "You logged 3 workouts on 2 days this week, 1 of them completed."),
+    ("What's my streak?", "You're on a 2-day streak. Your longest is 2 days."),
+])
+def test_questions_about_the_log_are_answered_from_it(store, question, expected):
+    assert answer(store, question) == expected
+
+
+@pytest.mark.parametrize("question", [
+    "What's the max weight a beginner should squat?",
+    "How many days of rest do I need between sessions?",
+    "How many times a week do I need to train legs?",
+    "How many sets per week is good for chest?",
+    "How can I increase my bench PR?",
+    "What is a PR?",
+    "Hi there",
+])
+def test_coaching_and_general_questions_go_to_the_model(store, question):
+    assert answer(store, question) is None
+
+
+def test_empty_log_reply_only_for_questions_about_the_log(store):
+    assert answer(store, "What's my bench PR?", user_id="bob").startswith(EMPTY_LOG)
+    assert answer(store, "How many days of rest do I need?", user_id="bob") is None
+    assert answer(store, "What's the max I should lift as a beginner?", user_id="bob") is None
+
+
+def test_match_exercise_prefers_the_full_shortest_name():
+    names = ["Bench Press", "Incline Bench Press", "Leg Press"]
+    assert match_exercise("my bench pr", names) == "Bench Press"
+    assert match_exercise("when did i last do incline bench", names) == "Incline Bench Press"
+    assert match_exercise("my press pr", names) is None
+
+
+def test_parse_period():
+    assert parse_period("volume this week", TODAY) == (date(2026, 3, 9), TODAY, "this week")
+    assert parse_period("volume last week", TODAY)[:2] == (date(2026, 3, 2), date(2026, 3, 8))
+    assert parse_period("in the last 3 days", TODAY) == (date(2026, 3, 9), TODAY, "in the last 3 days")
+    assert parse_period("my volume", TODAY) == (None, None, "in total")
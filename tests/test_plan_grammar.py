@@ -0,0 +1,71 @@
+import random
+
+import torch
+
+from coach import clean_plan_response
+from plan_grammar import DONE, NAME_MAX_CHARS, TIP_MAX_CHARS, PlanGrammar
+
+PLAN = (
+    "Barbell Squat | 3 sets | 8 reps | 135 lbs | Keep your chest up\n"
+    "Bench Press | 4 sets | 6 reps | 185 lbs | Pause on the chest\n"
+    "Romanian Deadlift | 3 sets | 10 reps | 155 lbs | Push your hips back\n"
+)
+
+
+def brute_force_mask(grammar, state):
+    strings = grammar._strings()
+    mask = torch.tensor([bool(text) and grammar._walk(state, text) is not None for text in strings])
+    mask[grammar.eos_token_id] = grammar._can_end(state)
+    return mask
+
+
+def random_states(grammar, tokenizer, count, seed=0):
+    # States met while generating plans with random allowed tokens
+    rng = random.Random(seed)
+    states = []
+    while len(states) < count:
+        state = grammar.initial_state()
+        while state != DONE and len(states) < count:
+            states.append(state)
+            allowed = grammar.allowed_tokens(state, len(tokenizer)).nonzero().flatten().tolist()
+            token_id = rng.choice(allowed)
+            if token_id == grammar.eos_token_id:
+                break
+            state = grammar.advance(state, token_id)
+    return states
+
+
+def test_masks_match_a_walk_over_every_token(sentencepiece_tokenizer):
+    grammar = PlanGrammar(sentencepiece_tokenizer)
+    for state in random_states(grammar, sentencepiece_tokenizer, 300):
+        assert torch.equal(grammar.allowed_tokens(state, len(sentencepiece_tokenizer)), brute_force_mask(grammar, state))
+
+
+def test_warm_up_computes_every_mask_a_plan_needs(sentencepiece_tokenizer):
+    grammar = PlanGrammar(sentencepiece_tokenizer)
+    grammar.warm_up()
+    warmed = len(grammar._masks)
+    random_states(grammar, sentencepiece_tokenizer, 2000, seed=1)
+    assert len(grammar._masks) == warmed
+
+
+def test_plan_lines_parse_and_eos_follows_whole_lines(sentencepiece_tokenizer):
+    grammar = PlanGrammar(sentencepiece_tokenizer)
+    state = grammar._walk(grammar.initial_state(), PLAN)
+    assert state is not None and grammar._can_end(state)
+    assert not grammar._can_end(grammar._walk(grammar.initial_state(), PLAN[:-1]))
+    assert grammar._walk(grammar.initial_state(), "Sure! Here is your plan:\n") is None
+
+
+def test_budget_fits_the_longest_plan(byte_tokenizer):
+    # One token per character is the most tokens a plan can take
+    grammar = PlanGrammar(byte_tokenizer)
+    line = "a" * NAME_MAX_CHARS + " | 99 sets | 99 reps | 9999 lbs | " + "b" * TIP_MAX_CHARS + "\n"
+    plan = line * grammar.max_exercises
+    assert grammar._walk(grammar.initial_state(), plan) == DONE
+    assert grammar.max_new_tokens == len(plan) + 1
+
+
+def test_clean_plan_response_drops_an_unfinished_line():
+    assert clean_plan_response(PLAN + "Overhead Press | 3 sets | 8 reps | 13") == PLAN.strip()
+    assert clean_plan_response(PLAN + "</s>") == PLAN.strip()
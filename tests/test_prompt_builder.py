@@ -0,0 +1,155 @@
+import pytest
+
+from benchmark import tiny_tokenizer
+from prompt_builder import PromptBuilder
+
+SYSTEM = "You are a fitness coach. Keep answers short and specific."
+MESSAGES = [
+    ("user", "How much did I bench last week?"),
+    ("assistant", "You benched 185 lbs for 6 reps."),
+    ("user", "What should I train today?"),
+]
+
+
+@pytest.fixture(params=["byte_tokenizer", "sentencepiece_tokenizer"])
+def tokenizer(request):
+    return request.getfixturevalue(request.param)
+
+
+def encode(tokenizer, text):
+    return tokenizer(text, add_special_tokens=False).input_ids
+
+
+@pytest.mark.parametrize("messages", [[], MESSAGES])
+def test_token_ids_are_the_tokenized_text(tokenizer, messages):
+    builder = PromptBuilder(tokenizer)
+    assert builder.exact_segments
+    built = builder.build_chat_prompt(SYSTEM, messages, "  Should I squat heavy today? ")
+    assert built.token_ids == encode(tokenizer, built.text)
+    assert built.text.endswith("Should I squat heavy today? [/INST]")
+
+
+def test_history_fills_the_budget_newest_first(tokenizer):
+    builder = PromptBuilder(tokenizer)
+    full = builder.build_chat_prompt(SYSTEM, MESSAGES, "Squat?")
+    assert full.history == ["User: How much did I bench last week?", "Assistant: You benched 185 lbs for 6 reps.",
+                            "User: What should I train today?"]
+    builder = PromptBuilder(tokenizer, max_prompt_tokens=len(full.token_ids) - 1)
+    built = builder.build_chat_prompt(SYSTEM, MESSAGES, "Squat?")
+    assert built.history == full.history[1:]
+    assert len(built.token_ids) <= builder.max_prompt_tokens
+    assert built.token_ids == encode(tokenizer, built.text)
+
+
+def test_an_oversized_question_is_trimmed_in_the_text_too(tokenizer):
+    question = ("Should I squat heavy today or rest since my legs are sore from Monday, "
+                "and if I rest, should I still do some light cardio or stretching instead?")
+    # The system prompt takes half the room
+    budget = 2 * len(encode(tokenizer, f"<s>[INST] {SYSTEM}")) + len(encode(tokenizer, " [/INST]"))
+    builder = PromptBuilder(tokenizer, max_prompt_tokens=budget)
+    built = builder.build_chat_prompt(SYSTEM, MESSAGES, question)
+    assert len(built.token_ids) <= budget
+    assert built.history == []
+    kept = built.text[len(f"<s>[INST] {SYSTEM}\n\n"):-len(" [/INST]")]
+    assert kept and question.startswith(kept) and kept != question
+    assert built.token_ids == encode(tokenizer, built.text)
+
+
+
+def test_an_oversized_system_prompt_loses_its_end_but_not_the_question(tokenizer):
+    workouts = " Workout history: " + "; ".join(f"Squat 3x5 @ {100 + i}lbs on 2026-03-{i + 1:02d}" for i in range(28))
+    budget = len(encode(tokenizer, f"<s>[INST] {SYSTEM}\n\nShould I squat today? [/INST]")) + 20
+    builder = PromptBuilder(tokenizer, max_prompt_tokens=budget)
+    built = builder.build_chat_prompt(SYSTEM + workouts, MESSAGES, "Should I squat today?")
+    assert len(built.token_ids) <= budget
+    assert built.text.startswith(f"<s>[INST] {SYSTEM}")
+    assert built.text.endswith("\n\nShould I squat today? [/INST]")
+    assert built.token_ids == encode(tokenizer, built.text)
+
+CHATML = (
+    "{% for m in messages %}<|im_start|>{{ m['role'] }}\n{{ m['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+NO_SYSTEM = (
+    "{% for m in messages %}{% if m['role'] == 'system' %}{{ raise_exception('No system role') }}{% endif %}"
+    "[{{ m['role'] }}] {{ m['content'] }}\n{% endfor %}"
+)
+# Like Mistral's and Llama's templates: no system role, and user and assistant turns must alternate
+STRICT = (
+    "{% for m in messages %}{% if m['role'] == 'system' %}{{ raise_exception('No system role') }}{% endif %}"
+    "{% if (m['role'] == 'user') != loop.index0 is even %}{{ raise_exception('Roles must alternate') }}{% endif %}"
+    "[{{ m['role'] }}] {{ m['content'] }}\n{% endfor %}"
+)
+
+
+@pytest.fixture
+def template_tokenizer():
+    tokenizer = tiny_tokenizer()
+    tokenizer.add_special_tokens({"additional_special_tokens": ["<|im_start|>", "<|im_end|>"]})
+    tokenizer.chat_template = CHATML
+    return tokenizer
+
+
+def test_template_prompt_uses_the_tokenizers_chat_format(template_tokenizer):
+    built = PromptBuilder(template_tokenizer).build_template_prompt(SYSTEM, MESSAGES, "Thanks!")
+    assert built.text.startswith(f"<|im_start|>system\n{SYSTEM}<|im_end|>\n<|im_start|>user\nHow much")
+    assert built.text.endswith("<|im_start|>user\nThanks!<|im_end|>\n<|im_start|>assistant\n")
+    assert "[INST]" not in built.text
+    assert built.token_ids == encode(template_tokenizer, built.text)
+    # The last message never got a reply; the question takes its place
+    assert built.history == ["User: How much did I bench last week?", "Assistant: You benched 185 lbs for 6 reps."]
+
+
+def test_template_prompt_drops_the_oldest_exchanges_to_fit(template_tokenizer):
+    messages = MESSAGES[:2] + [("user", "And squat?"), ("assistant", "225 lbs for 5.")]
+    full = PromptBuilder(template_tokenizer).build_template_prompt(SYSTEM, messages, "Thanks!")
+    builder = PromptBuilder(template_tokenizer, max_prompt_tokens=len(full.token_ids) - 1)
+    built = builder.build_template_prompt(SYSTEM, messages, "Thanks!")
+    assert built.history == full.history[2:]
+    assert len(built.token_ids) <= builder.max_prompt_tokens
+    assert built.token_ids == encode(template_tokenizer, built.text)
+
+
+def test_template_without_a_system_role_gets_the_instructions_in_the_first_user_turn(template_tokenizer):
+    template_tokenizer.chat_template = NO_SYSTEM
+    built = PromptBuilder(template_tokenizer).build_template_prompt(SYSTEM, MESSAGES[:2], "Thanks!")
+    assert built.text == (f"[user] {SYSTEM}\n\nHow much did I bench last week?\n"
+                          "[assistant] You benched 185 lbs for 6 reps.\n[user] Thanks!\n")
+
+
+def test_template_history_alternates_roles(template_tokenizer):
+    template_tokenizer.chat_template = STRICT
+    messages = [("assistant", "Hi! Ready to train?"), ("user", "Yes."), ("user", "Legs today."),
+                ("assistant", "Squats first."), ("bot", "Then lunges."), ("user", "How many sets?")]
+    built = PromptBuilder(template_tokenizer).build_template_prompt(SYSTEM, messages, "Thanks!")
+    assert built.text == (f"[user] {SYSTEM}\n\nYes.\n\nLegs today.\n"
+                          "[assistant] Squats first.\n\nThen lunges.\n[user] Thanks!\n")
+    assert built.history == ["User: Yes.\n\nLegs today.", "Assistant: Squats first.\n\nThen lunges."]
+
+
+def test_an_oversized_template_prompt_loses_the_end_of_its_system_prompt(template_tokenizer):
+    workouts = " Workout history: " + "; ".join(f"Squat 3x5 @ {100 + i}lbs on 2026-03-{i + 1:02d}" for i in range(28))
+    short = PromptBuilder(template_tokenizer).build_template_prompt(SYSTEM, [], "Should I squat today?")
+    budget = len(short.token_ids) + 20
+    builder = PromptBuilder(template_tokenizer, max_prompt_tokens=budget)
+    built = builder.build_template_prompt(SYSTEM + workouts, MESSAGES, "Should I squat today?")
+    assert len(built.token_ids) <= budget
+    assert built.text.startswith(f"<|im_start|>system\n{SYSTEM}")
+    assert built.text.endswith("<|im_start|>user\nShould I squat today?<|im_end|>\n<|im_start|>assistant\n")
+    assert built.history == []
+
+
+def test_an_oversized_template_question_is_trimmed(template_tokenizer):
+    question = ("Should I squat heavy today or rest since my legs are sore from Monday, "
+                "and if I rest, should I still do some light cardio or stretching instead?")
+    short = PromptBuilder(template_tokenizer).build_template_prompt(SYSTEM, [], "")
+    builder = PromptBuilder(template_tokenizer, max_prompt_tokens=len(short.token_ids) + 10)
+    built = builder.build_template_prompt(SYSTEM, [], question)
+    assert len(built.token_ids) <= builder.max_prompt_tokens
+    kept = built.text.split("<|im_start|>user\n")[1].split("<|im_end|>")[0]
+    assert kept and question.startswith(kept) and kept != question
+
+
+def test_tokenizer_without_a_template_gets_mistral_format(byte_tokenizer):
+    built = PromptBuilder(byte_tokenizer).build_template_prompt(SYSTEM, [], "Thanks!")
+    assert built.text == f"<s>[INST] {SYSTEM}\n\nThanks! [/INST]"
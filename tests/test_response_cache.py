@@ -0,0 +1,84 @@
+import json
+import threading
+
+from response_cache import ResponseCache
+
+
+def test_lookup_misses_then_hits_and_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    assert cache.get("a") is None
+    cache.put("a", "reply a")
+    cache.put("b", "reply b")
+    assert cache.get("a") == "reply a"
+    cache.put("c", "reply c")
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_expired_entries_miss():
+    cache = ResponseCache(ttl=-1)
+    cache.put("a", "reply")
+    assert cache.get("a") is None
+
+
+def test_keys_ignore_case_and_punctuation():
+    assert ResponseCache.make_key("chat", "What is  my PR?", "ctx") == ResponseCache.make_key("chat", "what is my pr", "ctx")
+    assert ResponseCache.make_key("chat", "hi", "ctx") != ResponseCache.make_key("plan", "hi", "ctx")
+
+
+def test_put_does_not_write_the_file(tmp_path):
+    path = tmp_path / "cache.json"
+    cache = ResponseCache(path=str(path), save_interval=3600)
+    cache.put("a", "reply")
+    assert not path.exists()
+    cache.flush()
+    assert json.loads(path.read_text())[0][::2] == ["a", "reply"]
+    cache.close()
+
+
+def test_flushed_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = ResponseCache(path=path, save_interval=3600)
+    cache.put("a", "reply")
+    cache.close()
+    assert ResponseCache(path=path, save_interval=3600).get("a") == "reply"
+
+
+def test_lookups_do_not_wait_for_a_write(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.json"), save_interval=3600)
+    cache.put("a", "reply")
+    writing, release = threading.Event(), threading.Event()
+
+    def slow_save(entries):
+        writing.set()
+        release.wait(5)
+
+    cache._save = slow_save
+    writer = threading.Thread(target=cache.flush)
+    writer.start()
+    assert writing.wait(5)
+    assert cache.get("a") == "reply"
+    release.set()
+    writer.join()
+
+
+def test_background_writer_saves_changes(tmp_path):
+    path = tmp_path / "cache.json"
+    cache = ResponseCache(path=str(path), save_interval=0.05)
+    cache.put("a", "reply")
+    for _ in range(100):
+        if path.exists():
+            break
+        threading.Event().wait(0.05)
+    assert path.exists()
+    cache.close()
+
+
+def test_failed_writes_are_logged_and_retried(tmp_path, caplog):
+    cache = ResponseCache(path=str(tmp_path / "missing" / "cache.json"), save_interval=3600)
+    cache.put("a", "reply")
+    cache.flush()
+    assert "Couldn't write the response cache" in caplog.text
+    assert cache._dirty
+    cache._dirty = False
+    cache.close()
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import time
+from dataclasses import asdict
+
+import httpx
+import pytest
+
+import server
+from benchmark import tiny_model
+from coach import CoachService, Turn
+from inference import InferenceEngine
+from metrics import MetricsRegistry
+from response_cache import ResponseCache
+from workout_store import Workout
+
+
+@pytest.fixture(scope="module")
+def service(byte_tokenizer):
+    metrics = MetricsRegistry()
+    engine = InferenceEngine(tiny_model(byte_tokenizer), byte_tokenizer, metrics=metrics)
+    service = CoachService(engine, response_cache=ResponseCache(), metrics=metrics)
+    server.coach._service = service
+    yield service
+    server.coach._service = None
+
+
+def post(path, body):
+    async def run():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(path, json=body, timeout=60)
+    return asyncio.run(run())
+
+
+def test_chat_streams_chunks_then_the_final_reply(service):
+    workouts = [asdict(Workout("2026-03-01", "Squat", 3, 5, 225))]
+    response = post("/chat", {"question": "How should I warm up?", "workouts": workouts, "use_cache": False})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[-1]["done"] and not lines[-1]["cached"]
+    assert "".join(line["text"] for line in lines[:-1])
+    assert lines[-1]["stats"]["new_tokens"] > 0
+
+
+def test_plan_without_streaming_returns_only_the_reply(service):
+    response = post("/plan", {"request": "leg day", "stream": False, "use_cache": False})
+    body = response.json()
+    assert set(body) == {"response", "cached", "tier", "stats"}
+    assert body["response"].count(" sets | ") >= 3
+
+
+def test_building_a_turn_does_not_block_the_event_loop(service, monkeypatch):
+    def slow_chat(*args, **kwargs):
+        time.sleep(0.5)
+        return Turn("chat", response="cached reply")
+
+    monkeypatch.setattr(service, "chat", slow_chat)
+
+    async def run():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            finished = []
+
+            async def call(method, path, **kwargs):
+                await client.request(method, path, **kwargs)
+                finished.append(path)
+
+            await asyncio.gather(
+                call("POST", "/chat", json={"question": "hi", "stream": False}),
+                call("GET", "/metrics"),
+            )
+            return finished
+
+    assert asyncio.run(run()) == ["/metrics", "/chat"]
@@ -0,0 +1,85 @@
+import io
+
+import pytest
+
+from workout_io import describe, export_workouts, import_workouts, open_text, parse_workout
+from workout_store import Workout, WorkoutStore
+
+CSV = """date,exercise,sets,reps,weight,notes,completed
+2026-03-01,Bench Press,3,5,185,felt strong,true
+2026-03-01,Squat,5,5,225,,false
+2026-03-02,Deadlift,1,5,315.4,,yes
+"""
+
+
+def test_csv_import_adds_valid_rows_and_reports_invalid_ones():
+    store = WorkoutStore(":memory:")
+    text = CSV + "2026-13-01,Squat,3,5,225,,\n2026-03-03,Squat,three,5,225,,\n"
+    stats = import_workouts(store, "alice", io.StringIO(text), "csv")
+    assert (stats.rows, stats.imported, stats.duplicates, stats.invalid) == (5, 3, 0, 2)
+    assert stats.errors == [
+        "line 5: date must be YYYY-MM-DD, got '2026-13-01'",
+        "line 6: sets must be a number, got 'three'",
+    ]
+    assert [(w.exercise, w.weight, w.completed) for w in store.history("alice")] == [
+        ("Bench Press", 185, True), ("Squat", 225, False), ("Deadlift", 315, True),
+    ]
+
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl"])
+def test_export_then_import_round_trips_and_reimport_adds_nothing(fmt):
+    source = WorkoutStore(":memory:")
+    import_workouts(source, "alice", io.StringIO(CSV), "csv")
+    exported = io.StringIO()
+    assert export_workouts(source, "alice", exported, fmt).rows == 3
+
+    target = WorkoutStore(":memory:")
+    assert import_workouts(target, "bob", io.StringIO(exported.getvalue()), fmt, batch_size=2).imported == 3
+    strip_ids = lambda workouts: [(w.date, w.exercise, w.sets, w.reps, w.weight, w.notes, w.completed)
+                                  for w in workouts]
+    assert strip_ids(target.history("bob")) == strip_ids(source.history("alice"))
+    again = import_workouts(target, "bob", io.StringIO(exported.getvalue()), fmt)
+    assert (again.imported, again.duplicates) == (0, 3)
+
+
+def test_jsonl_reports_bad_lines():
+    store = WorkoutStore(":memory:")
+    text = '{"date": "2026-03-01", "exercise": "Squat", "sets": 3, "reps": 5, "weight": 225}\n{oops\n[1]\n\n'
+    stats = import_workouts(store, "alice", io.StringIO(text), "jsonl")
+    assert (stats.imported, stats.invalid) == (1, 2)
+    assert stats.errors[1] == "line 3: expected a JSON object"
+
+
+def test_non_utf8_file_stops_the_import_without_raising():
+    store = WorkoutStore(":memory:")
+    # A Latin-1 export
+    data = (CSV + "2026-03-03,Développé couché,3,5,135,,\n").encode("latin-1")
+    stats = import_workouts(store, "alice", open_text(io.BytesIO(data)), "csv")
+    assert "isn't UTF-8" in stats.stopped
+    assert "stopped reading" in describe(stats, "import")
+
+
+def test_unreadable_csv_stops_the_import_without_raising():
+    store = WorkoutStore(":memory:")
+    text = CSV + '2026-03-03,Squat,3,5,225,"' + "x" * 200_000 + '",\n2026-03-04,Squat,3,5,225,,\n'
+    stats = import_workouts(store, "alice", io.StringIO(text), "csv")
+    assert stats.stopped == "after line 4: field larger than field limit (131072)"
+    assert stats.imported == 3
+
+
+@pytest.mark.parametrize("record, error", [
+    ({"date": "2026-03-01", "exercise": "Squat", "sets": 3, "reps": 5}, "missing weight"),
+    ({"date": "2026-03-01", "exercise": "Squat", "sets": 3.5, "reps": 5, "weight": 1}, "sets must be a whole number"),
+    ({"date": "2026-03-01", "exercise": "Squat", "sets": 3, "reps": 5, "weight": 9000}, "weight must be between"),
+    ({"date": "2026-03-01", "exercise": "Squat", "sets": 3, "reps": 5, "weight": 1, "completed": "maybe"},
+     "completed must be true or false"),
+    ({"date": "2026-03-01", "exercise": "Be\x00nch", "sets": 3, "reps": 5, "weight": 1}, "NUL"),
+])
+def test_parse_workout_rejects(record, error):
+    with pytest.raises(ValueError, match=error):
+        parse_workout(record)
+
+
+def test_parse_workout_normalizes_fields():
+    record = {" Date ": "2026-03-01", "EXERCISE": "  Bench   Press ", "sets": "3", "reps": "5.0", "weight": "185.6"}
+    assert parse_workout(record) == Workout("2026-03-01", "Bench Press", 3, 5, 186)
@@ -0,0 +1,174 @@
+import random
+import sqlite3
+
+import pytest
+
+from exercise_index import ExerciseIndex
+from workout_store import SCHEMA_VERSION, Workout, WorkoutStore
+
+AGGREGATES = ("user_stats", "day_stats", "exercise_stats")
+# The schema as first released, before exercise keys and completed counts per day
+V1_SCHEMA = """
+CREATE TABLE workouts (
+    id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, date TEXT NOT NULL, exercise TEXT NOT NULL,
+    sets INTEGER NOT NULL, reps INTEGER NOT NULL, weight INTEGER NOT NULL,
+    notes TEXT NOT NULL DEFAULT '', completed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX idx_workouts_user_date ON workouts (user_id, date);
+CREATE INDEX idx_workouts_user_exercise ON workouts (user_id, exercise);
+CREATE TABLE user_stats (
+    user_id TEXT PRIMARY KEY, total_workouts INTEGER NOT NULL DEFAULT 0,
+    completed_workouts INTEGER NOT NULL DEFAULT 0, unique_exercises INTEGER NOT NULL DEFAULT 0,
+    days_worked_out INTEGER NOT NULL DEFAULT 0, total_volume INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE day_stats (
+    user_id TEXT NOT NULL, date TEXT NOT NULL, workout_count INTEGER NOT NULL, PRIMARY KEY (user_id, date)
+);
+CREATE TABLE exercise_stats (
+    user_id TEXT NOT NULL, exercise TEXT NOT NULL, workout_count INTEGER NOT NULL, pr_workout_id INTEGER,
+    pr_weight INTEGER NOT NULL, pr_date TEXT NOT NULL, pr_sets INTEGER NOT NULL, pr_reps INTEGER NOT NULL,
+    PRIMARY KEY (user_id, exercise)
+);
+PRAGMA user_version = 1;
+"""
+EXERCISES = ["Bench Press", "bench", "Bench Presses", "Squat", "squat (barbell)", "Deadlift", "Pull-ups"]
+
+
+def snapshot(store):
+    # Everything derived from the log; the revision only counts writes
+    with store._lock:
+        return {
+            table: sorted(tuple(row[k] for k in row.keys() if k != "revision")
+                          for row in store._conn.execute(f"SELECT * FROM {table}"))
+            for table in AGGREGATES
+        }
+
+
+def rebuilt(store):
+    with store._lock, store._conn:
+        store._rebuild_aggregates()
+    return snapshot(store)
+
+
+def random_workout(rng):
+    return Workout(
+        date=f"2026-03-{rng.randint(1, 20):02d}",
+        exercise=rng.choice(EXERCISES),
+        sets=rng.randint(1, 5),
+        reps=rng.randint(1, 12),
+        weight=rng.choice([95, 135, 135, 185, 225]),
+        completed=rng.random() < 0.5,
+    )
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_aggregates_match_a_rebuild_after_any_writes(seed):
+    rng = random.Random(seed)
+    store = WorkoutStore(":memory:")
+    ids = {"alice": [], "bob": []}
+    for _ in range(300):
+        user_id = rng.choice(list(ids))
+        action = rng.random()
+        if action < 0.5 or not ids[user_id]:
+            ids[user_id] += store.add_many(user_id, [random_workout(rng) for _ in range(rng.randint(1, 3))])
+        elif action < 0.7:
+            store.update_weight(user_id, rng.choice(ids[user_id]), rng.choice([95, 135, 185, 225, 275]))
+        elif action < 0.85:
+            store.mark_complete(user_id, rng.choice(ids[user_id]))
+        else:
+            workout_id = rng.choice(ids[user_id])
+            ids[user_id].remove(workout_id)
+            store.delete(user_id, workout_id)
+    assert snapshot(store) == rebuilt(store)
+
+
+def test_spellings_share_one_record_named_as_on_the_record_set():
+    store = WorkoutStore(":memory:")
+    store.add_many("alice", [
+        Workout("2026-03-01", "Bench", 3, 5, 185),
+        Workout("2026-03-02", "bench press (barbell)", 3, 5, 205),
+        Workout("2026-03-03", "Bench Presses", 3, 5, 195),
+    ])
+    assert store.personal_records("alice") == {
+        "bench press (barbell)": {"weight": 205, "date": "2026-03-02", "sets": 3, "reps": 5},
+    }
+    assert store.summary("alice")["unique_exercises"] == 1
+    assert store.totals("alice", exercise="bench")["workouts"] == 3
+
+
+def test_old_databases_are_migrated_and_rebuilt(tmp_path):
+    path = str(tmp_path / "workouts.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(V1_SCHEMA)
+    conn.executemany(
+        "INSERT INTO workouts (user_id, date, exercise, sets, reps, weight, completed) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [("alice", "2026-03-01", "Bench", 3, 5, 185, 1), ("alice", "2026-03-02", "Bench Press", 3, 5, 195, 0),
+         ("alice", "2026-03-02", "Squat", 5, 5, 225, 1)],
+    )
+    # Aggregates keyed by the old, uncanonical names
+    conn.execute("INSERT INTO user_stats (user_id, total_workouts, unique_exercises) VALUES ('alice', 3, 3)")
+    conn.commit()
+    conn.close()
+
+    store = WorkoutStore(path)
+    assert store._query("PRAGMA user_version", ())[0][0] == SCHEMA_VERSION
+    assert store.summary("alice") == {
+        "total_workouts": 3, "completed_workouts": 2, "unique_exercises": 2, "days_worked_out": 2,
+        "total_volume": 3 * 5 * 185 + 3 * 5 * 195 + 5 * 5 * 225,
+    }
+    assert store.exercise_names("alice") == {"bench press": "Bench Press", "squat": "Squat"}
+    assert store.day_page("alice", 10) == [("2026-03-02", 2, 1), ("2026-03-01", 1, 1)]
+    assert snapshot(store) == rebuilt(store)
+
+
+def test_days_streaks_and_rollups():
+    store = WorkoutStore(":memory:")
+    dates = ["2026-03-02", "2026-03-03", "2026-03-04", "2026-03-09", "2026-03-10", "2026-03-10"]
+    store.add_many("alice", [Workout(d, "Squat", 3, 5, 225, completed=i % 2 == 0) for i, d in enumerate(dates)])
+    assert store.days("alice", "2026-03-04", "2026-03-09") == [("2026-03-04", 1, 1), ("2026-03-09", 1, 0)]
+    assert store.streaks("alice", "2026-03-11") == {"current": 2, "longest": 3}
+    assert store.streaks("alice", "2026-03-12") == {"current": 0, "longest": 3}
+    assert store.rollup("alice", "week") == [("2026-03-02", 3, 3, 2), ("2026-03-09", 2, 3, 1)]
+    assert store.rollup("alice", "month") == [("2026-03-01", 5, 6, 3)]
+
+
+def test_add_new_skips_sets_already_logged_but_keeps_repeats_within_a_batch():
+    store = WorkoutStore(":memory:")
+    store.add("alice", Workout("2026-03-01", "Bench Press", 3, 5, 185))
+    logged_through = store.last_id()
+    batch = [Workout("2026-03-01", "bench", 3, 5, 185), Workout("2026-03-01", "Squat", 3, 5, 225),
+             Workout("2026-03-01", "Squat", 3, 5, 225)]
+    assert store.add_new("alice", batch, logged_through) == 2
+    assert store.add_new("alice", batch, store.last_id()) == 0
+
+
+def test_iter_history_pages_in_date_order():
+    store = WorkoutStore(":memory:")
+    rng = random.Random(0)
+    store.add_many("alice", [random_workout(rng) for _ in range(25)])
+    assert list(store.iter_history("alice", page_size=4)) == store.history("alice")
+
+
+def test_revision_moves_with_writes_from_another_connection(tmp_path):
+    path = str(tmp_path / "workouts.db")
+    app_store, cli_store = WorkoutStore(path), WorkoutStore(path)
+    index = ExerciseIndex(app_store)
+    app_store.add("alice", Workout("2026-03-01", "Bench Press", 3, 5, 185))
+    assert index.search("alice", "squat") == []
+    before = app_store.revision("alice")
+
+    cli_store.add("alice", Workout("2026-03-02", "Squat", 5, 5, 225))
+    assert app_store.revision("alice") > before
+    assert index.search("alice", "squat") == ["Squat"]
+
+
+def test_revision_keeps_counting_through_clear():
+    store = WorkoutStore(":memory:")
+    store.add("alice", Workout("2026-03-01", "Squat", 5, 5, 225))
+    seen = {store.revision("alice")}
+    store.clear("alice")
+    assert store.revision("alice") not in seen and store.summary("alice")["total_workouts"] == 0
+    seen.add(store.revision("alice"))
+    store.add("alice", Workout("2026-03-01", "Squat", 5, 5, 225))
+    assert store.revision("alice") not in seen
+    assert store.revision("bob") == 0
@@ -0,0 +1,157 @@
+"""Relevance-ranked workout history for chat and plan prompts.
+
+Prompts used to carry the last five workouts, so a question about deadlift
+progress after a week of upper-body work showed the model no deadlifts at
+all, and the full log is far too long to include. ``WorkoutIndex`` keeps a
+per-user index of the log keyed by canonical exercise, muscle group and
+date, with IDF weights over exercise names and notes for a light text
+similarity. ``relevant`` ranks the sets that matter for a question. The
+coach then keeps as many of them as fit a fixed token budget (see
+``coach.fit_workouts``), so answers draw on the whole history while the
+prompt stays the same size.
+
+An index is rebuilt only when the store's revision for that user changes.
+"""
+import bisect
+import math
+import threading
+from collections import defaultdict
+from datetime import date
+
+from exercise_index import canonical_exercise, words
+from intents import parse_period
+
+# Words in a canonical exercise name that put it in a group
+MUSCLE_GROUPS = {
+    "legs": ("squat", "lunge", "leg", "calf", "deadlift", "hip thrust", "step up", "glute", "hamstring", "quad"),
+    "back": ("deadlift", "row", "pull up", "chin up", "pulldown", "pull down", "shrug", "lat"),
+    "chest": ("bench", "chest", "fly", "push up", "dip", "pec"),
+    "shoulders": ("overhead press", "shoulder", "military", "lateral raise", "face pull", "arnold", "delt"),
+    "arms": ("curl", "tricep", "bicep", "skull crusher", "pushdown", "dip"),
+    "core": ("plank", "crunch", "sit up", "ab", "leg raise", "russian twist", "core"),
+}
+# What people call the groups in a question
+GROUP_WORDS = {
+    "leg": "legs", "quad": "legs", "hamstring": "legs", "glute": "legs", "calf": "legs",
+    "back": "back", "lat": "back",
+    "chest": "chest", "pec": "chest",
+    "shoulder": "shoulders", "delt": "shoulders",
+    "arm": "arms", "bicep": "arms", "tricep": "arms",
+    "core": "core", "ab": "core",
+}
+STOPWORDS = {
+    "a", "about", "am", "an", "and", "are", "at", "be", "can", "did", "do", "does", "for", "from", "have", "how",
+    "i", "in", "is", "it", "me", "my", "of", "on", "or", "should", "so", "the", "to", "was", "what", "when",
+    "which", "with", "you", "your",
+}
+
+# Score weights; a named exercise outranks everything else
+EXERCISE_WEIGHT = 3.0
+PERIOD_WEIGHT = 2.0
+GROUP_WEIGHT = 1.0
+TEXT_WEIGHT = 2.0
+# The first and heaviest set of a named exercise, so progress shows
+MILESTONE_WEIGHT = 1.0
+RECENCY_WEIGHT = 1.0
+RECENCY_HALF_LIFE_DAYS = 14
+# The latest sets are always candidates, for questions that name nothing
+RECENT_CANDIDATES = 10
+RELEVANT_LIMIT = 40
+
+
+def muscle_groups(canonical):
+    padded = f" {canonical} "
+    return {group for group, keys in MUSCLE_GROUPS.items() if any(f" {key} " in padded for key in keys)}
+
+
+def _recency(day, today):
+    age = (today - date.fromisoformat(day)).days
+    return 0.5 ** (max(age, 0) / RECENCY_HALF_LIFE_DAYS)
+
+
+class _UserIndex:
+    def __init__(self, workouts, revision):
+        self.revision = revision
+        # Oldest first, so date ranges are bisectable
+        self.workouts = workouts
+        self.dates = [w.date for w in workouts]
+        self.by_exercise = defaultdict(list)
+        self.by_group = defaultdict(set)
+        # Word -> sets whose exercise name or notes contain it
+        self.by_term = defaultdict(list)
+        for i, w in enumerate(workouts):
+            canonical = canonical_exercise(w.exercise)
+            self.by_exercise[canonical].append(i)
+            for term in set(canonical.split()) | (set(words(w.notes)) - STOPWORDS):
+                self.by_term[term].append(i)
+        for canonical in self.by_exercise:
+            for group in muscle_groups(canonical):
+                self.by_group[group].add(canonical)
+        n = len(workouts)
+        self.idf = {term: math.log(1 + n / len(positions)) for term, positions in self.by_term.items()}
+
+    def between(self, start, end):
+        lo = bisect.bisect_left(self.dates, start.isoformat()) if start else 0
+        hi = bisect.bisect_right(self.dates, end.isoformat()) if end else len(self.dates)
+        return range(lo, hi)
+
+
+class WorkoutIndex:
+    def __init__(self, store):
+        self.store = store
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _index(self, user_id):
+        revision = self.store.revision(user_id)
+        index = self._indexes.get(user_id)
+        if index is None or index.revision != revision:
+            index = _UserIndex(self.store.history(user_id), revision)
+            with self._lock:
+                self._indexes[user_id] = index
+        return index
+
+    def relevant(self, user_id, query, limit=RELEVANT_LIMIT, today=None):
+        """Up to ``limit`` of the user's workouts, most relevant to ``query`` first."""
+        index = self._index(user_id)
+        if not index.workouts:
+            return []
+        today = today or date.today()
+        query_terms = set(words(query)) - STOPWORDS
+        scores = defaultdict(float)
+
+        # Named exercises: every word of the canonical name is in the question
+        for canonical, positions in index.by_exercise.items():
+            if set(canonical.split()) <= query_terms:
+                for i in positions:
+                    scores[i] += EXERCISE_WEIGHT
+                heaviest = max(positions, key=lambda i: index.workouts[i].weight)
+                scores[positions[0]] += MILESTONE_WEIGHT
+                scores[heaviest] += MILESTONE_WEIGHT
+
+        for group in {GROUP_WORDS[t] for t in query_terms if t in GROUP_WORDS}:
+            for canonical in index.by_group[group]:
+                for i in index.by_exercise[canonical]:
+                    scores[i] += GROUP_WEIGHT
+
+        start, end, _ = parse_period(query, today)
+        if start is not None:
+            for i in index.between(start, end):
+                scores[i] += PERIOD_WEIGHT
+
+        # IDF-weighted share of the question's words found in the set's name and notes
+        query_weight = sum(index.idf.get(t, 0.0) for t in query_terms)
+        if query_weight:
+            for term in query_terms & index.by_term.keys():
+                for i in index.by_term[term]:
+                    scores[i] += TEXT_WEIGHT * index.idf[term] / query_weight
+
+        for i in range(max(0, len(index.workouts) - RECENT_CANDIDATES), len(index.workouts)):
+            scores.setdefault(i, 0.0)
+
+        ranked = sorted(
+            scores,
+            key=lambda i: (scores[i] + RECENCY_WEIGHT * _recency(index.dates[i], today), i),
+            reverse=True,
+        )
+        return [index.workouts[i] for i in ranked[:limit]]
@@ -0,0 +1,265 @@
+"""Streaming import and export of workout logs as CSV or JSONL.
+
+The log could only be filled one set at a time or from an AI plan, so
+years of history from another tracker couldn't come in, and a log couldn't
+be backed up or moved between instances. Both formats carry the
+``Workout`` fields the app already uses: ``date, exercise, sets, reps,
+weight, notes, completed``, one set per row.
+
+``import_workouts`` reads a file row by row. It validates each row and
+inserts them in batches of ``BATCH_SIZE``, skipping sets the log already
+had (see ``WorkoutStore.add_new``), so re-importing an export adds
+nothing. ``export_workouts`` pages through the log. Both hold one batch in
+memory whatever the file size and report rows per second::
+
+    python workout_io.py import strong_export.csv --user alice
+    python workout_io.py export backup.jsonl --user alice
+"""
+import argparse
+import csv
+import io
+import json
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import date
+
+from workout_store import Workout, WorkoutStore
+
+FIELDS = ("date", "exercise", "sets", "reps", "weight", "notes", "completed")
+REQUIRED_FIELDS = ("date", "exercise", "sets", "reps", "weight")
+FORMATS = ("csv", "jsonl")
+BATCH_SIZE = 1000
+# Errors past this many are counted but not kept
+MAX_ERRORS = 20
+# Generous bounds that still catch shifted columns and unit mix-ups
+MAX_SETS = 100
+MAX_REPS = 1000
+MAX_WEIGHT = 2000
+MAX_EXERCISE_LENGTH = 100
+TRUE_WORDS = {"1", "true", "yes", "y", "done", "completed"}
+FALSE_WORDS = {"", "0", "false", "no", "n"}
+
+
+@dataclass
+class TransferStats:
+    rows: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    seconds: float = 0.0
+    # "line N: reason" for the first MAX_ERRORS invalid rows
+    errors: list = field(default_factory=list)
+    # Why the rest of the file couldn't be read, if it couldn't
+    stopped: str = ""
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+def detect_format(filename):
+    """``"csv"`` or ``"jsonl"`` from a file name's extension."""
+    name = filename.lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    raise ValueError(f"Can't tell the format of {filename!r}; expected a .csv or .jsonl file")
+
+
+def _whole_number(record, name, low, high):
+    value = record[name]
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number, got {value!r}") from None
+    if not number.is_integer() and name != "weight":
+        raise ValueError(f"{name} must be a whole number, got {value!r}")
+    if not low <= number <= high:
+        raise ValueError(f"{name} must be between {low} and {high}, got {value!r}")
+    # The log stores whole pounds
+    return int(round(number))
+
+
+def parse_workout(record):
+    """Validate one row (field name -> value, as read from CSV or JSON) into a ``Workout``."""
+    record = {str(k).strip().lower(): v for k, v in record.items() if k is not None}
+    missing = [name for name in REQUIRED_FIELDS if record.get(name) is None or not str(record[name]).strip()]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    try:
+        day = date.fromisoformat(str(record["date"]).strip()).isoformat()
+    except ValueError:
+        raise ValueError(f"date must be YYYY-MM-DD, got {record['date']!r}") from None
+    exercise = " ".join(str(record["exercise"]).split())
+    if len(exercise) > MAX_EXERCISE_LENGTH:
+        raise ValueError(f"exercise name is longer than {MAX_EXERCISE_LENGTH} characters")
+    notes = str(record.get("notes") or "").strip()
+    # SQLite keeps them, but they cut names short wherever they're shown
+    if "\x00" in exercise or "\x00" in notes:
+        raise ValueError("exercise and notes can't contain NUL characters")
+    completed = record.get("completed")
+    if not isinstance(completed, bool):
+        completed = "" if completed is None else str(completed).strip().lower()
+        if completed not in TRUE_WORDS | FALSE_WORDS:
+            raise ValueError(f"completed must be true or false, got {record['completed']!r}")
+        completed = completed in TRUE_WORDS
+    return Workout(
+        date=day,
+        exercise=exercise,
+        sets=_whole_number(record, "sets", 1, MAX_SETS),
+        reps=_whole_number(record, "reps", 1, MAX_REPS),
+        weight=_whole_number(record, "weight", 0, MAX_WEIGHT),
+        notes=notes,
+        completed=completed,
+    )
+
+
+def _records(f, fmt):
+    # (line number, row) pairs; JSON syntax errors come back as the exception in place of the row
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == "jsonl":
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, ValueError(f"invalid JSON ({e.msg})")
+                continue
+            yield line_number, record if isinstance(record, dict) else ValueError("expected a JSON object")
+    else:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {FORMATS}")
+
+
+def import_workouts(store, user_id, f, fmt, batch_size=BATCH_SIZE):
+    """Add every valid, not yet logged row of the text file ``f`` to ``user_id``'s log."""
+    stats = TransferStats()
+    start = time.perf_counter()
+    # Sets added by this import don't count as already logged
+    logged_through = store.last_id()
+    batch = []
+
+    def flush():
+        added = store.add_new(user_id, batch, logged_through)
+        stats.imported += added
+        stats.duplicates += len(batch) - added
+        batch.clear()
+
+    line_number = 0
+    try:
+        for line_number, record in _records(f, fmt):
+            stats.rows += 1
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append(parse_workout(record))
+            except ValueError as e:
+                stats.invalid += 1
+                if len(stats.errors) < MAX_ERRORS:
+                    stats.errors.append(f"line {line_number}: {e}")
+                continue
+            if len(batch) >= batch_size:
+                flush()
+    # Text is decoded a chunk at a time, so this can come some lines after the last row read
+    except (UnicodeDecodeError, csv.Error) as e:
+        where = f"after line {line_number}" if line_number else "before the first row"
+        if isinstance(e, UnicodeDecodeError):
+            e = "the file isn't UTF-8 text; save it as UTF-8 and import it again"
+        stats.stopped = f"{where}: {e}"
+    if batch:
+        flush()
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def export_workouts(store, user_id, f, fmt):
+    """Write ``user_id``'s whole log, oldest first, to the text file ``f``."""
+    stats = TransferStats()
+    start = time.perf_counter()
+    if fmt == "csv":
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+    elif fmt != "jsonl":
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {FORMATS}")
+    for w in store.iter_history(user_id):
+        record = asdict(w)
+        # Ids belong to this database; the importer assigns new ones
+        del record["id"]
+        if fmt == "csv":
+            writer.writerow([str(record[name]).lower() if name == "completed" else record[name] for name in FIELDS])
+        else:
+            f.write(json.dumps(record) + "\n")
+        stats.rows += 1
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def open_text(binary, mode="r"):
+    """Text view of a binary file for ``import_workouts`` and ``export_workouts``.
+
+    Reading tolerates the byte order mark spreadsheet programs add to CSV.
+    """
+    return io.TextIOWrapper(binary, encoding="utf-8-sig" if mode == "r" else "utf-8", newline="")
+
+
+def export_file(store, user_id, fmt):
+    """The exported log as a binary temporary file, rewound, for a download."""
+    f = tempfile.TemporaryFile()
+    text = open_text(f, "w")
+    export_workouts(store, user_id, text, fmt)
+    text.detach()
+    f.seek(0)
+    return f
+
+
+def describe(stats, action):
+    """One line summary, e.g. "Imported 9,980 of 10,000 rows (12 already logged, 8 invalid) in 0.4 s, 25,000 rows/s".
+
+    An import that couldn't read the whole file says where and why it stopped.
+    """
+    if action == "import":
+        summary = (
+            f"Imported {stats.imported:,} of {stats.rows:,} rows "
+            f"({stats.duplicates:,} already logged, {stats.invalid:,} invalid)"
+        )
+    else:
+        summary = f"Exported {stats.rows:,} rows"
+    summary = f"{summary} in {stats.seconds:.1f} s, {stats.rows_per_second:,.0f} rows/s"
+    return f"{summary}; stopped reading {stats.stopped}" if stats.stopped else summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import or export a user's workout log as CSV or JSONL.")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("path", help="file to read or write; .csv, .jsonl or .ndjson")
+    parser.add_argument("--user", required=True, help="user id whose log to fill or write out")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    parser.add_argument("--db", default=None, help="SQLite database (default: WORKOUT_DB_PATH or workouts.db)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    try:
+        fmt = args.format or detect_format(args.path)
+    except ValueError as e:
+        parser.error(str(e))
+    store = WorkoutStore(args.db) if args.db else WorkoutStore()
+    if args.action == "import":
+        with open(args.path, encoding="utf-8-sig", newline="") as f:
+            stats = import_workouts(store, args.user, f, fmt, args.batch_size)
+    else:
+        with open(args.path, "w", encoding="utf-8", newline="") as f:
+            stats = export_workouts(store, args.user, f, fmt)
+    print(describe(stats, args.action))
+    for error in stats.errors:
+        print(f"  {error}")
+    if stats.invalid > len(stats.errors):
+        print(f"  ... and {stats.invalid - len(stats.errors):,} more invalid rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,532 @@
+"""Persistent workout log backed by SQLite.
+
+Workouts used to live in ``st.session_state.workouts``, which vanished on a
+server restart and could not be shared between sessions. They are now rows
+in a SQLite database in WAL mode, indexed by (user, date) and
+(user, exercise), so every view and edit in the app is a single indexed
+statement.
+
+Per-user totals, per-day counts and per-exercise personal records are kept
+in aggregate tables that every write updates in the same transaction, so
+the Achievements tab reads ready-made values instead of scanning the log.
+``user_stats.revision`` counts the writes to a user's log; in-memory views
+(search indexes, analytics) rebuild when it moves, whichever process wrote.
+``day_stats`` is the date index: one row per training day with its workout
+and completed counts, sorted by its primary key, so grouped history,
+streaks and "last N days" read days rather than workouts.
+
+Exercises are keyed by ``canonical_exercise``, so "Bench", "Bench Presses"
+and "bench press (barbell)" share one personal record and one set of
+totals. A record shows the name as spelled on the set that holds it.
+
+Reads return ``Workout`` records: slotted, typed, and carrying the row's
+``id``, so edits and widget keys address one set even when two identical
+sets were logged.
+"""
+import os
+import sqlite3
+from dataclasses import dataclass
+from threading import Lock
+
+from exercise_index import canonical_exercise
+
+DB_PATH = os.environ.get("WORKOUT_DB_PATH", "workouts.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workouts (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    exercise TEXT NOT NULL,
+    sets INTEGER NOT NULL,
+    reps INTEGER NOT NULL,
+    weight INTEGER NOT NULL,
+    notes TEXT NOT NULL DEFAULT '',
+    completed INTEGER NOT NULL DEFAULT 0,
+    exercise_key TEXT NOT NULL DEFAULT ''
+);
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id TEXT PRIMARY KEY,
+    total_workouts INTEGER NOT NULL DEFAULT 0,
+    completed_workouts INTEGER NOT NULL DEFAULT 0,
+    unique_exercises INTEGER NOT NULL DEFAULT 0,
+    days_worked_out INTEGER NOT NULL DEFAULT 0,
+    total_volume INTEGER NOT NULL DEFAULT 0,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS day_stats (
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    workout_count INTEGER NOT NULL,
+    completed_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, date)
+);
+-- exercise is the canonical key; name is the spelling on the record set
+CREATE TABLE IF NOT EXISTS exercise_stats (
+    user_id TEXT NOT NULL,
+    exercise TEXT NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    workout_count INTEGER NOT NULL,
+    pr_workout_id INTEGER,
+    pr_weight INTEGER NOT NULL,
+    pr_date TEXT NOT NULL,
+    pr_sets INTEGER NOT NULL,
+    pr_reps INTEGER NOT NULL,
+    PRIMARY KEY (user_id, exercise)
+);
+"""
+
+# Created after ADDED_COLUMNS, which they may index
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_workouts_user_date ON workouts (user_id, date);
+DROP INDEX IF EXISTS idx_workouts_user_exercise;
+CREATE INDEX IF NOT EXISTS idx_workouts_user_exercise_key ON workouts (user_id, exercise_key);
+"""
+
+# Bump whenever aggregates or canonical_exercise change, so existing databases are rebuilt on open
+SCHEMA_VERSION = 3
+# Columns added since their table was first released; older databases get them on open
+ADDED_COLUMNS = (
+    ("day_stats", "completed_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("workouts", "exercise_key", "TEXT NOT NULL DEFAULT ''"),
+    ("exercise_stats", "name", "TEXT NOT NULL DEFAULT ''"),
+    ("user_stats", "revision", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+EMPTY_SUMMARY = {
+    "total_workouts": 0,
+    "completed_workouts": 0,
+    "unique_exercises": 0,
+    "days_worked_out": 0,
+    "total_volume": 0,
+}
+
+COLUMNS = "id, date, exercise, sets, reps, weight, notes, completed, exercise_key"
+
+
+@dataclass(slots=True)
+class Workout:
+    date: str
+    exercise: str
+    sets: int
+    reps: int
+    weight: int
+    notes: str = ""
+    completed: bool = False
+    # Assigned by the store on insert and never reused
+    id: int | None = None
+
+
+def _row_to_workout(row):
+    return Workout(
+        row["date"], row["exercise"], row["sets"], row["reps"], row["weight"],
+        row["notes"], bool(row["completed"]), row["id"],
+    )
+
+
+class WorkoutStore:
+    def __init__(self, path=DB_PATH):
+        # One connection shared by every Streamlit session thread, serialized by a lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.create_function("canonical_exercise", 1, canonical_exercise, deterministic=True)
+        self._lock = Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            for table, column, definition in ADDED_COLUMNS:
+                existing = {r["name"] for r in self._conn.execute(f"PRAGMA table_info({table})")}
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            self._conn.executescript(INDEXES)
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                self._rebuild_aggregates()
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # ----------------- Writes -----------------
+    def add(self, user_id, workout):
+        return self.add_many(user_id, [workout])[0]
+
+    def add_many(self, user_id, workouts):
+        with self._lock, self._conn:
+            return self._insert(user_id, workouts)
+
+    def add_new(self, user_id, workouts, logged_through):
+        """Add the workouts that don't repeat a set logged with id <= ``logged_through``; return how many were added.
+
+        A repeat is the same date, exercise, sets, reps and weight. Sets
+        added after ``logged_through`` don't count, so an import keeps the
+        identical sets a file lists one row each.
+        """
+        workouts = list(workouts)
+        dates = sorted({w.date for w in workouts})
+        with self._lock, self._conn:
+            logged = set(map(tuple, self._conn.execute(
+                "SELECT date, exercise_key, sets, reps, weight FROM workouts "
+                f"WHERE user_id = ? AND id <= ? AND date IN ({', '.join('?' * len(dates))})",
+                (user_id, logged_through, *dates),
+            )))
+            new = [
+                w for w in workouts
+                if (w.date, canonical_exercise(w.exercise), w.sets, w.reps, w.weight) not in logged
+            ]
+            if new:
+                self._insert(user_id, new)
+        return len(new)
+
+    def mark_complete(self, user_id, workout_id):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE workouts SET completed = 1 WHERE id = ? AND user_id = ? AND completed = 0",
+                (workout_id, user_id),
+            )
+            if cursor.rowcount:
+                self._bump_user_stats(user_id, completed_workouts=1)
+                self._conn.execute(
+                    "UPDATE day_stats SET completed_count = completed_count + 1 "
+                    "WHERE user_id = ? AND date = (SELECT date FROM workouts WHERE id = ?)",
+                    (user_id, workout_id),
+                )
+                self._changed(user_id)
+
+    def update_weight(self, user_id, workout_id, weight):
+        with self._lock, self._conn:
+            old = self._get(user_id, workout_id)
+            if old is None or old["weight"] == weight:
+                return
+            self._conn.execute("UPDATE workouts SET weight = ? WHERE id = ?", (weight, workout_id))
+            self._changed(user_id)
+            self._bump_user_stats(user_id, total_volume=old["sets"] * old["reps"] * (weight - old["weight"]))
+
+            record = self._conn.execute(
+                "SELECT pr_workout_id, pr_weight FROM exercise_stats WHERE user_id = ? AND exercise = ?",
+                (user_id, old["exercise_key"]),
+            ).fetchone()
+            # Heaviest set wins; the earliest logged one breaks ties
+            if (weight, -workout_id) > (record["pr_weight"], -record["pr_workout_id"]):
+                self._set_record(user_id, self._get(user_id, workout_id))
+            elif record["pr_workout_id"] == workout_id:
+                # The record holder got lighter; another set may now be the PR
+                self._recompute_record(user_id, old["exercise_key"])
+
+    def delete(self, user_id, workout_id):
+        with self._lock, self._conn:
+            old = self._get(user_id, workout_id)
+            if old is None:
+                return
+            self._conn.execute("DELETE FROM workouts WHERE id = ?", (workout_id,))
+            self._count_removed(user_id, old)
+            self._changed(user_id)
+
+    def clear(self, user_id):
+        with self._lock, self._conn:
+            for table in ("workouts", "day_stats", "exercise_stats"):
+                self._conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            # The row stays, so the revision keeps counting up
+            self._conn.execute(
+                f"UPDATE user_stats SET {', '.join(f'{column} = 0' for column in EMPTY_SUMMARY)} WHERE user_id = ?",
+                (user_id,),
+            )
+            self._changed(user_id)
+
+    def _insert(self, user_id, workouts):
+        ids = []
+        for w in workouts:
+            row = {
+                "date": w.date, "exercise": w.exercise, "sets": w.sets, "reps": w.reps, "weight": w.weight,
+                "notes": w.notes, "completed": int(w.completed), "exercise_key": canonical_exercise(w.exercise),
+            }
+            row["id"] = self._conn.execute(
+                f"INSERT INTO workouts (user_id, {', '.join(row)}) VALUES (?{', ?' * len(row)})",
+                (user_id, *row.values()),
+            ).lastrowid
+            ids.append(row["id"])
+            # The row as inserted, without reading it back
+            self._count_added(user_id, row)
+        self._changed(user_id)
+        return ids
+
+    # ----------------- Aggregate maintenance -----------------
+    # These run inside the caller's transaction and touch O(1) rows, except
+    # _recompute_record, which only reads the one affected exercise.
+    def _changed(self, user_id):
+        # Stored, not kept in memory, so other processes writing the log (workout_io) invalidate caches here
+        self._bump_user_stats(user_id, revision=1)
+
+    def _get(self, user_id, workout_id):
+        return self._conn.execute(
+            f"SELECT {COLUMNS} FROM workouts WHERE id = ? AND user_id = ?", (workout_id, user_id)
+        ).fetchone()
+
+    def _bump_user_stats(self, user_id, **deltas):
+        self._conn.execute("INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)", (user_id,))
+        assignments = ", ".join(f"{column} = {column} + ?" for column in deltas)
+        self._conn.execute(
+            f"UPDATE user_stats SET {assignments} WHERE user_id = ?", (*deltas.values(), user_id)
+        )
+
+    def _count_added(self, user_id, w):
+        new_day = self._conn.execute(
+            "INSERT OR IGNORE INTO day_stats (user_id, date, workout_count) VALUES (?, ?, 0)",
+            (user_id, w["date"]),
+        ).rowcount
+        self._conn.execute(
+            "UPDATE day_stats SET workout_count = workout_count + 1, completed_count = completed_count + ? "
+            "WHERE user_id = ? AND date = ?",
+            (int(w["completed"]), user_id, w["date"]),
+        )
+
+        record = self._conn.execute(
+            "SELECT pr_weight FROM exercise_stats WHERE user_id = ? AND exercise = ?",
+            (user_id, w["exercise_key"]),
+        ).fetchone()
+        if record is None:
+            self._conn.execute(
+                "INSERT INTO exercise_stats (user_id, exercise, name, workout_count, pr_workout_id, "
+                "pr_weight, pr_date, pr_sets, pr_reps) VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?)",
+                (user_id, w["exercise_key"], w["exercise"], w["id"], w["weight"], w["date"], w["sets"], w["reps"]),
+            )
+        else:
+            self._conn.execute(
+                "UPDATE exercise_stats SET workout_count = workout_count + 1 WHERE user_id = ? AND exercise = ?",
+                (user_id, w["exercise_key"]),
+            )
+            if w["weight"] > record["pr_weight"]:
+                self._set_record(user_id, w)
+
+        self._bump_user_stats(
+            user_id,
+            total_workouts=1,
+            completed_workouts=int(w["completed"]),
+            unique_exercises=int(record is None),
+            days_worked_out=new_day,
+            total_volume=w["sets"] * w["reps"] * w["weight"],
+        )
+
+    def _count_removed(self, user_id, w):
+        self._conn.execute(
+            "UPDATE day_stats SET workout_count = workout_count - 1, completed_count = completed_count - ? "
+            "WHERE user_id = ? AND date = ?",
+            (int(w["completed"]), user_id, w["date"]),
+        )
+        day_gone = self._conn.execute(
+            "DELETE FROM day_stats WHERE user_id = ? AND date = ? AND workout_count = 0",
+            (user_id, w["date"]),
+        ).rowcount
+
+        self._conn.execute(
+            "UPDATE exercise_stats SET workout_count = workout_count - 1 WHERE user_id = ? AND exercise = ?",
+            (user_id, w["exercise_key"]),
+        )
+        exercise_gone = self._conn.execute(
+            "DELETE FROM exercise_stats WHERE user_id = ? AND exercise = ? AND workout_count = 0",
+            (user_id, w["exercise_key"]),
+        ).rowcount
+        if not exercise_gone:
+            holder = self._conn.execute(
+                "SELECT pr_workout_id FROM exercise_stats WHERE user_id = ? AND exercise = ?",
+                (user_id, w["exercise_key"]),
+            ).fetchone()["pr_workout_id"]
+            if holder == w["id"]:
+                self._recompute_record(user_id, w["exercise_key"])
+
+        self._bump_user_stats(
+            user_id,
+            total_workouts=-1,
+            completed_workouts=-int(w["completed"]),
+            unique_exercises=-exercise_gone,
+            days_worked_out=-day_gone,
+            total_volume=-(w["sets"] * w["reps"] * w["weight"]),
+        )
+
+    def _set_record(self, user_id, w):
+        self._conn.execute(
+            "UPDATE exercise_stats SET pr_workout_id = ?, pr_weight = ?, pr_date = ?, pr_sets = ?, pr_reps = ?, "
+            "name = ? WHERE user_id = ? AND exercise = ?",
+            (w["id"], w["weight"], w["date"], w["sets"], w["reps"], w["exercise"], user_id, w["exercise_key"]),
+        )
+
+    def _recompute_record(self, user_id, exercise_key):
+        # Heaviest set wins; the earliest logged one breaks ties
+        best = self._conn.execute(
+            f"SELECT {COLUMNS} FROM workouts WHERE user_id = ? AND exercise_key = ? "
+            "ORDER BY weight DESC, id LIMIT 1",
+            (user_id, exercise_key),
+        ).fetchone()
+        self._set_record(user_id, best)
+
+    def _rebuild_aggregates(self):
+        revisions = self._conn.execute("SELECT user_id, revision FROM user_stats").fetchall()
+        for table in ("user_stats", "day_stats", "exercise_stats"):
+            self._conn.execute(f"DELETE FROM {table}")
+        self._conn.execute("UPDATE workouts SET exercise_key = canonical_exercise(exercise)")
+        rows = self._conn.execute(f"SELECT user_id, {COLUMNS} FROM workouts ORDER BY id").fetchall()
+        for row in rows:
+            self._count_added(row["user_id"], row)
+        for user_id, revision in revisions:
+            self._bump_user_stats(user_id, revision=revision + 1)
+
+    # ----------------- Reads -----------------
+    def _query(self, sql, params):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, user_id, workout_id):
+        rows = self._query(f"SELECT {COLUMNS} FROM workouts WHERE id = ? AND user_id = ?", (workout_id, user_id))
+        return _row_to_workout(rows[0]) if rows else None
+
+    def has_workouts(self, user_id):
+        return bool(self._query("SELECT 1 FROM workouts WHERE user_id = ? LIMIT 1", (user_id,)))
+
+    def recent(self, user_id, limit=5):
+        # Newest by date, returned oldest first like the old list slice
+        rows = self._query(
+            f"SELECT {COLUMNS} FROM workouts WHERE user_id = ? ORDER BY date DESC, id DESC LIMIT ?",
+            (user_id, limit),
+        )
+        return [_row_to_workout(r) for r in reversed(rows)]
+
+    def revision(self, user_id):
+        """A number that changes whenever ``user_id``'s log does, in this process or another."""
+        rows = self._query("SELECT revision FROM user_stats WHERE user_id = ?", (user_id,))
+        return rows[0][0] if rows else 0
+
+    def history(self, user_id):
+        """Every workout of ``user_id``, oldest first."""
+        rows = self._query(f"SELECT {COLUMNS} FROM workouts WHERE user_id = ? ORDER BY date, id", (user_id,))
+        return [_row_to_workout(r) for r in rows]
+
+    def iter_history(self, user_id, page_size=1000):
+        """Yield every workout of ``user_id``, oldest first, reading one page at a time."""
+        after = ("", 0)
+        while True:
+            rows = self._query(
+                f"SELECT {COLUMNS} FROM workouts WHERE user_id = ? AND (date, id) > (?, ?) ORDER BY date, id LIMIT ?",
+                (user_id, *after, page_size),
+            )
+            yield from map(_row_to_workout, rows)
+            if len(rows) < page_size:
+                return
+            after = (rows[-1]["date"], rows[-1]["id"])
+
+    def last_id(self):
+        """The newest workout id; everything added later gets a larger one."""
+        return self._query("SELECT COALESCE(MAX(id), 0) FROM workouts", ())[0][0]
+
+    def columns(self, user_id):
+        """``(dates, exercises, sets, reps, weights)`` of every workout, oldest first, for bulk analysis."""
+        rows = self._query(
+            "SELECT date, exercise, sets, reps, weight FROM workouts WHERE user_id = ? ORDER BY date, id", (user_id,)
+        )
+        return tuple(map(list, zip(*rows))) if rows else ([], [], [], [], [])
+
+    def day_page(self, user_id, limit, offset=0):
+        """Return ``(date, workout_count, completed_count)`` for one page of days, newest first."""
+        rows = self._query(
+            "SELECT date, workout_count, completed_count FROM day_stats WHERE user_id = ? "
+            "ORDER BY date DESC LIMIT ? OFFSET ?",
+            (user_id, limit, offset),
+        )
+        return [tuple(r) for r in rows]
+
+    def days(self, user_id, start, end):
+        """Return ``(date, workout_count, completed_count)`` for each training day in a range, oldest first."""
+        rows = self._query(
+            "SELECT date, workout_count, completed_count FROM day_stats WHERE user_id = ? AND date BETWEEN ? AND ? "
+            "ORDER BY date",
+            (user_id, start, end),
+        )
+        return [tuple(r) for r in rows]
+
+    def streaks(self, user_id, today):
+        """``{"current": days, "longest": days}`` of consecutive training days.
+
+        The current streak is still alive if the last training day was
+        yesterday, so it doesn't read 0 before today's workout is logged.
+        """
+        # Consecutive dates share julianday(date) - row number
+        runs = self._query(
+            "SELECT MAX(date) AS last, COUNT(*) AS length FROM ("
+            "  SELECT date, julianday(date) - ROW_NUMBER() OVER (ORDER BY date) AS run"
+            "  FROM day_stats WHERE user_id = ?"
+            ") GROUP BY run ORDER BY last DESC",
+            (user_id,),
+        )
+        if not runs:
+            return {"current": 0, "longest": 0}
+        alive = self._query("SELECT julianday(?) - julianday(?) <= 1", (today, runs[0]["last"]))[0][0]
+        return {"current": runs[0]["length"] if alive else 0, "longest": max(r["length"] for r in runs)}
+
+    def rollup(self, user_id, period="week", start=None, end=None):
+        """Return ``(period_start, days, workouts, completed)`` per week (from Monday) or month, oldest first."""
+        if period == "week":
+            bucket = "date(date, 'weekday 0', '-6 days')"
+        elif period == "month":
+            bucket = "strftime('%Y-%m-01', date)"
+        else:
+            raise ValueError(f"Unknown period {period!r}; expected 'week' or 'month'")
+        rows = self._query(
+            f"SELECT {bucket} AS bucket, COUNT(*), SUM(workout_count), SUM(completed_count) FROM day_stats "
+            "WHERE user_id = ? AND date BETWEEN ? AND ? GROUP BY bucket ORDER BY bucket",
+            (user_id, start or "0000-00-00", end or "9999-99-99"),
+        )
+        return [tuple(r) for r in rows]
+
+    def workouts_on(self, user_id, date):
+        rows = self._query(
+            f"SELECT {COLUMNS} FROM workouts WHERE user_id = ? AND date = ? ORDER BY id", (user_id, date)
+        )
+        return [_row_to_workout(r) for r in rows]
+
+    def totals(self, user_id, start=None, end=None, exercise=None):
+        """Workouts, completed workouts, volume and days trained between two dates, inclusive."""
+        sql = (
+            "SELECT COUNT(*) AS workouts, COALESCE(SUM(completed), 0) AS completed, "
+            "COALESCE(SUM(sets * reps * weight), 0) AS volume, COUNT(DISTINCT date) AS days "
+            "FROM workouts WHERE user_id = ? AND date BETWEEN ? AND ?"
+        )
+        params = (user_id, start or "0000-00-00", end or "9999-99-99")
+        if exercise is not None:
+            sql += " AND exercise_key = ?"
+            params += (canonical_exercise(exercise),)
+        return dict(self._query(sql, params)[0])
+
+    def last_session(self, user_id, exercise=None):
+        """Workouts on the latest date the user trained (``exercise`` only, if given)."""
+        if exercise is None:
+            rows = self._query("SELECT MAX(date) FROM workouts WHERE user_id = ?", (user_id,))
+        else:
+            key = canonical_exercise(exercise)
+            rows = self._query(
+                "SELECT MAX(date) FROM workouts WHERE user_id = ? AND exercise_key = ?", (user_id, key)
+            )
+        date = rows[0][0]
+        if date is None:
+            return []
+        workouts = self.workouts_on(user_id, date)
+        return [w for w in workouts if exercise is None or canonical_exercise(w.exercise) == key]
+
+    def personal_records(self, user_id):
+        rows = self._query(
+            "SELECT name, pr_weight, pr_date, pr_sets, pr_reps FROM exercise_stats WHERE user_id = ?",
+            (user_id,),
+        )
+        return {
+            r["name"]: {"weight": r["pr_weight"], "date": r["pr_date"], "sets": r["pr_sets"], "reps": r["pr_reps"]}
+            for r in rows
+        }
+
+    def exercise_names(self, user_id):
+        """Canonical key -> display name of every exercise the user has logged."""
+        return dict(self._query("SELECT exercise, name FROM exercise_stats WHERE user_id = ?", (user_id,)))
+
+    def summary(self, user_id):
+        rows = self._query(
+            "SELECT total_workouts, completed_workouts, unique_exercises, days_worked_out, total_volume "
+            "FROM user_stats WHERE user_id = ?",
+            (user_id,),
+        )
+        return dict(rows[0]) if rows else dict(EMPTY_SUMMARY)